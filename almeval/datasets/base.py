@@ -1,7 +1,10 @@
 import asyncio
+import contextlib
 import datetime
 import os
+import threading
 from abc import abstractmethod
+from collections import defaultdict
 
 import jsonlines
 import pandas as pd
@@ -9,7 +12,13 @@ from loguru import logger
 from torch.utils.data import Dataset
 
 from ..judge_models import judge_response
+from ..judge_models.cache import get_judge_cache
+from ..judge_models.stream import judge_key
+from ..metrics.yes_no import is_yes_no_question
+from ..utils.audio_manifest import audio_exists
+from ..utils.columnar_rows import ColumnarRows
 from ..utils.config_manager import ConfigManager
+from ..utils.jsonl_rows import JsonlRows
 
 
 class AudioBaseDataset(Dataset):
@@ -51,6 +60,17 @@ class AudioBaseDataset(Dataset):
     DATASET_NAME = None
 
     EXCLUDE = False  # set to True if you want to exclude this dataset from the evaluation
+    # keep only the byte offset of each JSONL row in memory and parse rows on access, for large datasets
+    ROW_INDEX = False
+    # keep rows in an Arrow table (see almeval/utils/columnar_rows.py) instead of a list of dicts
+    COLUMNAR = False
+
+    # whether the questions are answered with yes or no, for --answer-mode logits: True or False for the whole
+    # dataset, None to decide per sample from a `yes_no` column or the wording of the question
+    YES_NO = None
+
+    # judge results computed during inference, judge_key -> result, filled by the runner with --stream-judge
+    judge_sidecar = None
 
     def __init__(self):
         assert self.INTERACTIVE in self.ALLOWED_INTERACTIVE
@@ -99,9 +119,10 @@ class AudioBaseDataset(Dataset):
                 self.ok = False
                 return None
 
-        self.data = self.load_data(self.dataset_file)
+        # loaded on first access, so building many datasets (e.g. 'all') does not read them all up front
+        self._data = None
+        self._data_lock = threading.Lock()
         self.demo = False
-        assert isinstance(self.data, list)
         self.meta = {
             'task': self.TASK,
             'interactive': self.INTERACTIVE,
@@ -112,6 +133,20 @@ class AudioBaseDataset(Dataset):
         self.post_build()
         self.ok = True
 
+    @property
+    def data(self) -> list[dict] | JsonlRows | ColumnarRows:
+        if self._data is None:
+            with self._data_lock:
+                if self._data is None:
+                    data = self.load_data(self.dataset_file)
+                    assert isinstance(data, (list, JsonlRows, ColumnarRows))
+                    self._data = data
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
     def set_demo_mode(self, demo=True):
         self.demo = demo
         self.data = self.data[:10]
@@ -119,11 +154,36 @@ class AudioBaseDataset(Dataset):
     def __len__(self):
         return len(self.data)
 
+    def column(self, name: str) -> list:
+        """Values of one field for all rows"""
+        if isinstance(self.data, ColumnarRows):
+            return self.data.column(name)
+        return [item[name] for item in self.data]
+
+    def index_at(self, pos: int) -> str:
+        """str(index) of the row at pos, without building the row when the data is columnar"""
+        if isinstance(self.data, ColumnarRows):
+            return self.data.index_at(pos)
+        return str(self.data[pos]['index'])
+
+    def index_positions(self) -> dict[str, int]:
+        """str(index) -> position of the row"""
+        if isinstance(self.data, ColumnarRows):
+            return self.data.index_positions()
+        return {str(item['index']): pos for pos, item in enumerate(self.data)}
+
     def __getitem__(self, idx):
         return self.build_prompt(idx)
 
     # Given the dataset name, return the dataset as a pandas dataframe, can override
     def load_data(self, dataset):
+        if self.ROW_INDEX:
+            return JsonlRows(dataset)
+        if self.COLUMNAR:
+            data = ColumnarRows.from_jsonl(dataset)
+            if data is not None:
+                return data
+            logger.warning(f'{self.DATASET_NAME}: rows of {dataset} do not fit an Arrow table, loaded as dicts')
         with jsonlines.open(dataset) as reader:
             data = [line for line in reader]
             return data
@@ -156,15 +216,16 @@ class AudioBaseDataset(Dataset):
 
         if isinstance(audio_path, list):
             for i, p in enumerate(audio_path):
-                assert os.path.exists(p), f'Audio file not found: {p}'
+                assert audio_exists(p), f'Audio file not found: {p}'
         else:
-            assert os.path.exists(
+            assert audio_exists(
                 audio_path), f'Audio file not found: {audio_path}'
 
         question = item['question']
 
+        # copy meta, messages of one batch must not share (and overwrite) the same dict
         msg = {'index': item['index'], 'audio': [],
-               'text': question, 'meta': self.meta}
+               'text': question, 'meta': dict(self.meta)}
         
 
         if isinstance(audio_path, list):
@@ -197,10 +258,42 @@ class AudioBaseDataset(Dataset):
         """
         pass
 
+    def get_judge_setting(self, item: dict, method='default'):
+        """
+        The LLM judge request for one merged result item, used to judge predictions while inference is still running.
+
+        Returns:
+            dict with the filled judge prompt, temperature and top_p, exactly as `evaluate` with this method
+            would send it, or None if the item is not judged by an LLM.
+        """
+        return None
+
+    def is_yes_no_question(self, item: dict) -> bool:
+        """Whether the item is a binary question with a Yes/No answer, which `--answer-mode logits` scores
+        from the next-token probabilities instead of generating a free-form answer. Only what the model sees decides
+        it, never the answer, so every question takes the same decoding path whatever its label."""
+        if self.TASK == 'ASR' or 'asr' in str(item.get('type', '')).lower():
+            return False
+        if self.YES_NO is not None:
+            return self.YES_NO
+        if item.get('yes_no') is not None:
+            return bool(item['yes_no'])
+        return is_yes_no_question(str(item.get('question') or ''))
+
     @staticmethod
-    def run_llm_judge(judge_model, prompt_template, pred, gt=None, question=None, threads=10, temperature=0.0, top_p=0.95):
+    def fill_judge_prompt(prompt_template, pred, gt=None, question=None):
+        fill_template = {}
+        if gt is not None:
+            fill_template['answer'] = gt.strip()
+        if question is not None:
+            fill_template['question'] = question.strip()
+        fill_template['prediction'] = pred
+        return prompt_template.format(**fill_template)
+
+    def run_llm_judge(self, judge_model, prompt_template, pred, gt=None, question=None, threads=10, temperature=0.0, top_p=0.95):
         """
         Run the LLM judge model to evaluate the prediction.
+        Predictions already judged by the streaming judge during inference (see `judge_sidecar`) are not sent again.
 
         Args:
             judge_model (JudgeModel): the judge model
@@ -219,19 +312,30 @@ class AudioBaseDataset(Dataset):
         print(f'Prediction: {pred_0}')
         print(f'Answer: {gt_0}')
 
-        async def process_single_prediction(i, semaphore):
-            async with semaphore:
-                fill_template = {}
-                if gt:
-                    fill_template['answer'] = gt[i].strip()
-
-                if question:
-                    fill_template['question'] = question[i].strip()
+        judge_sidecar = self.judge_sidecar or {}
+        n_reused = 0
+        judge_cache = get_judge_cache()
 
-                fill_template['prediction'] = pred[i]
+        judge_prompts = [self.fill_judge_prompt(
+            prompt_template, pred[i], gt=gt[i] if gt else None, question=question[i] if question else None)
+            for i in range(len(pred))]
+        # a prompt repeated to judge it several times (e.g. evaluate_llm with n_times) keeps its judgements apart
+        seen = defaultdict(int)
+        repeats = []
+        for judge_prompt in judge_prompts:
+            repeats.append(seen[judge_prompt])
+            seen[judge_prompt] += 1
 
+        async def process_single_prediction(i, semaphore):
+            judge_prompt = judge_prompts[i]
+            key = judge_key(judge_model.model, judge_prompt, temperature, top_p, repeats[i])
+            if key in judge_sidecar:
+                nonlocal n_reused
+                n_reused += 1
+                return i, judge_sidecar[key]
+            async with semaphore or contextlib.nullcontext():
                 res = await judge_response(
-                    prompt_template.format(**fill_template),
+                    judge_prompt,
                     judge_model=judge_model,
                     temperature=temperature,
                     top_p=top_p
@@ -240,11 +344,25 @@ class AudioBaseDataset(Dataset):
 
         async def process_all_predictions():
             from tqdm.asyncio import tqdm
-            semaphore = asyncio.Semaphore(threads)
+            # the judge model's rate limiter adapts the requests in flight, a fixed limit only without one
+            semaphore = asyncio.Semaphore(threads) if getattr(judge_model, 'rate_limiter', None) is None else None
             tasks = [process_single_prediction(
                 i, semaphore) for i in range(len(pred))]
-            return await tqdm.gather(*tasks, desc='Processing samples')
-        results = asyncio.run(process_all_predictions())
+            try:
+                return await tqdm.gather(*tasks, desc='Processing samples')
+            finally:
+                # the pooled session belongs to this loop, which asyncio.run closes next
+                await judge_model.close()
+        # tasks of asyncio.run inherit this context, so the counts leave out a streaming judge running meanwhile
+        with judge_cache.track() if judge_cache is not None else contextlib.nullcontext() as cache_counts:
+            results = asyncio.run(process_all_predictions())
+        if n_reused > 0:
+            logger.info(f'{n_reused}/{len(pred)} judge results reused from the streaming judge')
+        if judge_cache is not None:
+            logger.info(f'judge cache {judge_cache.db_file}: {cache_counts["hits"]} hits, '
+                        f'{cache_counts["misses"]} misses')
+        if getattr(judge_model, 'rate_limiter', None) is not None:
+            logger.info(f'judge rate limiter: {judge_model.rate_limiter.summary()}')
         return results
 
     def format_performance(self, model_name, performance, eval_method='null'):
@@ -274,6 +392,15 @@ class AudioBaseDataset(Dataset):
             raise ValueError(f'Unsupported interactive: {self.INTERACTIVE}')
         return question
 
+    def get_LLM_query_item(self, item: dict) -> str:
+        """Same as get_LLM_query, for a single item"""
+        if self.INTERACTIVE == 'Audio-QA':
+            return str(item['audio_content'])
+        elif self.INTERACTIVE == 'Audio-analysis':
+            return str(item['question'])
+        else:
+            raise ValueError(f'Unsupported interactive: {self.INTERACTIVE}')
+
     @staticmethod
     def collect_acc(results: list, origin_df) -> dict:
         correct = 0
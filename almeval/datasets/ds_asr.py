@@ -113,3 +113,4 @@ class WenetSpeech(ASRDataset):
     DATASET_NAME = 'WenetSpeech'
     LANG = 'zh'
     DATASET_SERIES = 'WenetSpeech'
+    ROW_INDEX = True
@@ -386,6 +386,21 @@ class AudioMQADataset(AudioBaseDataset):
             judge_results[task] = judge_result
         return metrics, judge_results
 
+    def get_judge_template(self):
+        if self.DATASET_NAME == 'tut2017':
+            return TUT2017_SINGLE_CHOICE_PRPMPT
+        elif self.DATASET_NAME == 'cochlscene':
+            return COCHLSCENE_SINGLE_CHOICE_PRPMPT
+        else:
+            return SINGLE_CHOICE_PRPMPT
+
+    def get_judge_setting(self, item, method='default'):
+        if method == 'vb-mcq' or item['subset'] == 'sentiment':
+            return None
+        prompt = self.fill_judge_prompt(self.get_judge_template(), str(item['prediction']),
+                                        gt=str(item['answer']), question=self.get_LLM_query_item(item))
+        return dict(prompt=prompt, temperature=0.0, top_p=0.95)
+
     def evaluate_llm(self, eval_file, judge_model=None):
         df = pd.read_json(eval_file, lines=True)
         metrics = {}
@@ -397,15 +412,8 @@ class AudioMQADataset(AudioBaseDataset):
             gt = group['answer'].astype(str).to_list()
             pred = group['prediction'].astype(str).to_list()
 
-            if self.DATASET_NAME == 'tut2017':
-                judge_prompt = TUT2017_SINGLE_CHOICE_PRPMPT
-            elif self.DATASET_NAME == 'cochlscene':
-                judge_prompt = COCHLSCENE_SINGLE_CHOICE_PRPMPT
-            else:
-                judge_prompt = SINGLE_CHOICE_PRPMPT
-
             results = self.run_llm_judge(
-                judge_model, judge_prompt, pred=pred, gt=gt, question=question)
+                judge_model, self.get_judge_template(), pred=pred, gt=gt, question=question)
             task_result, judge_result = self.collect_acc(results, group)
             metrics[task] = task_result
             print(f'{task} result: {task_result}')
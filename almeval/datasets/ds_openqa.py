@@ -223,6 +223,12 @@ class AudioOpenQADataset(AudioBaseDataset):
             # return None
             raise NotImplementedError
 
+    def get_judge_setting(self, item, method='default'):
+        if method in ['vb-advbench', 'vb-ifeval']:
+            return None
+        prompt = self.fill_judge_prompt(OPEN_QA_PROMPT, str(item['prediction']), question=self.get_LLM_query_item(item))
+        return dict(prompt=prompt, temperature=0.5, top_p=0.95)
+
     def evaluate_llm(self, eval_file, judge_model=None, n_times=1):
         df = pd.read_json(eval_file, lines=True)
         metrics = {}
@@ -303,3 +309,4 @@ class aha(AudioOpenQADataset):
     DATASET_NAME = 'aha'
     DATASET_SERIES = 'aha'
     AUDIO_TYPE = ''
+    COLUMNAR = True
@@ -231,18 +231,25 @@ class AudioRefQADataset(AudioBaseDataset):
             judge_results[task] = judge_result
         return metrics, judge_results
 
+    def get_judge_template(self):
+        if self.DATASET_NAME == 'sd-qa':
+            return SQ_QA_PROMPT
+        return REF_QA_PRPMPT
+
+    def get_judge_setting(self, item, method='default'):
+        if method == 'vb-qa':
+            return None
+        prompt = self.fill_judge_prompt(self.get_judge_template(), str(item['prediction']),
+                                        gt=str(item['answer']), question=self.get_LLM_query_item(item))
+        return dict(prompt=prompt, temperature=0.0, top_p=0.95)
+
     def evaluate_llm(self, eval_file, judge_model=None):
         df = pd.read_json(eval_file, lines=True)
         metrics = {}
         judge_results = {}
-        if self.DATASET_NAME == 'sd-qa':
-            temperature = 0.0
-            top_p = 0.95
-            prompt = SQ_QA_PROMPT
-        else:
-            temperature = 0.0
-            top_p = 0.95
-            prompt = REF_QA_PRPMPT
+        temperature = 0.0
+        top_p = 0.95
+        prompt = self.get_judge_template()
         for task, group in df.groupby('subset'):
             # audio QA时，question是prompt，因为没有对于Audio的question
             question = self.get_LLM_query(group)
@@ -276,6 +283,16 @@ class OpenAudioBench(AudioRefQADataset):
     AUDIO_TYPE = 'Speech'
     INTERACTIVE = 'Audio-QA'
 
+    def get_judge_setting(self, item, method='default'):
+        if method == 'vb-qa':
+            return None
+        subset = item['subset']
+        # alpaca_eval has no reference answer
+        gt = None if subset == 'alpaca_eval' else str(item['answer'])
+        prompt = self.fill_judge_prompt(OpenAudioBench_PROMPTS[subset], str(item['prediction']),
+                                        gt=gt, question=self.get_LLM_query_item(item))
+        return dict(prompt=prompt, temperature=0.0, top_p=0.95)
+
     def evaluate_llm(self, eval_file, judge_model=None):
         """follow code from: https://huggingface.co/datasets/baichuan-inc/OpenAudioBench/tree/main
            and : https://arxiv.org/pdf/2502.17239
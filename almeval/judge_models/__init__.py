@@ -1,6 +1,27 @@
 import os
 
 from .api import OpenAIWrapper
+from .cache import get_judge_cache
+
+
+def _judge_cache_key(cache, prompt: str, judge_model: OpenAIWrapper, **params) -> str:
+    return cache.key(judge_model.model, prompt, system_prompt=judge_model.system_prompt, **params)
+
+
+def cached_judge_response(prompt: str, judge_model: OpenAIWrapper,
+                          temperature=0.0,
+                          top_p=0.95,
+                          max_tokens=1024,
+                          frequency_penalty=0,
+                          presence_penalty=0,
+                          stop=None):
+    """What judge_response has cached for these arguments, None if nothing. Sends no request"""
+    cache = get_judge_cache()
+    if cache is None:
+        return None
+    return cache.peek(_judge_cache_key(cache, prompt, judge_model, temperature=temperature, top_p=top_p,
+                                       max_tokens=max_tokens, frequency_penalty=frequency_penalty,
+                                       presence_penalty=presence_penalty, stop=stop))
 
 
 async def judge_response(prompt: str, judge_model: OpenAIWrapper,
@@ -9,7 +30,21 @@ async def judge_response(prompt: str, judge_model: OpenAIWrapper,
                          max_tokens=1024,
                          frequency_penalty=0,
                          presence_penalty=0,
-                         stop=None):
+                         stop=None,
+                         use_cache=None):
+    """Judge one prompt. Responses are cached on disk (see `get_judge_cache`); use_cache=None caches only
+    deterministic requests (temperature 0), so repeated sampled judgements stay independent"""
+    if use_cache is None:
+        use_cache = temperature == 0
+    cache = get_judge_cache() if use_cache else None
+    if cache is not None:
+        key = _judge_cache_key(cache, prompt, judge_model, temperature=temperature, top_p=top_p,
+                               max_tokens=max_tokens, frequency_penalty=frequency_penalty,
+                               presence_penalty=presence_penalty, stop=stop)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     judge_result_str = ''
     try:
         judge_result_str = await judge_model.generate(prompt,
@@ -19,6 +54,8 @@ async def judge_response(prompt: str, judge_model: OpenAIWrapper,
                                                       frequency_penalty=frequency_penalty,
                                                       presence_penalty=presence_penalty, stop=stop)
         judge_result_str = judge_result_str.strip()
+        if cache is not None and judge_result_str != '' and judge_model.fail_msg not in judge_result_str:
+            cache.put(key, judge_model.model, judge_result_str)
         return judge_result_str
 
     except Exception as e:
@@ -51,7 +88,7 @@ def get_gpt4o_mini_model():
 def get_judge_model(method='default'):
     if method == 'default':
         method = 'gpt-4o-mini'
-    elif method == 'gpt-4o':
+    if method == 'gpt-4o':
         return get_gpt4o_model()
     elif method == 'gpt-4o-mini':
         return get_gpt4o_mini_model()
@@ -1,12 +1,16 @@
+import asyncio
+import functools
 import json
 import os
 import sys
+import time
 import traceback
 
 import aiohttp
 import numpy as np
 from loguru import logger
 
+from ..rate_limit import get_rate_limiter, parse_retry_after
 from .base import BaseAPI
 
 APIBASES = {
@@ -52,6 +56,11 @@ class OpenAIWrapper(BaseAPI):
                  max_tokens: int = 1024,
                  use_azure: bool = False,
                  ocr_provider: str = None,
+                 max_connections: int = 64,
+                 keepalive_timeout: float = 30,
+                 dns_cache_ttl: int = 300,
+                 rpm: float = None,
+                 tpm: float = None,
                  **kwargs):
 
         self.model = model
@@ -87,6 +96,11 @@ class OpenAIWrapper(BaseAPI):
 
         self.key = key
         self.timeout = timeout
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        # event loop -> pooled session, a session can only be used on the loop it was created on
+        self._sessions = {}
 
         super().__init__(wait=wait, retry=retry,
                          system_prompt=system_prompt, verbose=verbose, **kwargs)
@@ -126,6 +140,30 @@ class OpenAIWrapper(BaseAPI):
                 logger.error('Unknown API Base. ')
                 sys.exit(-1)
 
+        # requests, tokens and concurrency are metered per endpoint and model, across all wrappers
+        self.rate_limiter = get_rate_limiter(self.api_base, self.model, rpm=rpm, tpm=tpm,
+                                             max_concurrency=max_connections)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Keep-alive session of the running event loop, created on first use"""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            # sessions of loops that are gone can not be closed any more, just drop them
+            self._sessions = {k: v for k, v in self._sessions.items() if not k.is_closed()}
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_connections,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=self.dns_cache_ttl)
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[loop] = session
+        return session
+
+    async def close(self):
+        """Close the session of the running event loop, call before the loop ends"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
     def prepare_itlist(self, inputs):
         assert all([x['type'] == 'text' for x in inputs])
         text = '\n'.join([x['value'] for x in inputs])
@@ -155,8 +193,8 @@ class OpenAIWrapper(BaseAPI):
         max_tokens = kwargs.pop('max_tokens', self.max_tokens)
 
         context_window = GPT_context_window(self.model)
-        max_tokens = min(max_tokens, context_window -
-                         self.get_token_len(inputs))
+        prompt_tokens = self.get_token_len(inputs)
+        max_tokens = min(max_tokens, context_window - prompt_tokens)
         if 0 < max_tokens <= 100:
             logger.warning(
                 'Less than 100 tokens left, '
@@ -178,16 +216,32 @@ class OpenAIWrapper(BaseAPI):
             n=1,
             temperature=temperature,
             **kwargs)
-        async with aiohttp.ClientSession() as session:
-            response = await session.post(
-                self.api_base,
-                headers=headers, json=payload, timeout=self.timeout * 1.1)
-            ret_code = response.status
-            ret_code = 0 if (200 <= int(ret_code) < 300) else ret_code
-            answer = self.fail_msg
-            response_text = await response.text()
+        # providers count max_tokens against the token budget until the actual usage is known
+        tokens = prompt_tokens + max_tokens
+        await self.rate_limiter.acquire(tokens)
+        start = time.monotonic()
+        ret_code = None
+        retry_after = None
+        used_tokens = None
+        response_text = None
+        try:
+            async with self._get_session().post(
+                    self.api_base,
+                    headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=self.timeout * 1.1)) as response:
+                ret_code = response.status
+                retry_after = parse_retry_after(response.headers)
+                response_text = await response.text()
+        finally:
+            latency = time.monotonic() - start
+            if response_text is None:
+                # failed before a response was read, e.g. a timeout
+                self.rate_limiter.release(tokens, latency=latency, status=ret_code, retry_after=retry_after)
+        status = ret_code
+        ret_code = 0 if (200 <= int(ret_code) < 300) else ret_code
+        answer = self.fail_msg
         try:
             resp_struct = json.loads(response_text)
+            used_tokens = (resp_struct.get('usage') or {}).get('total_tokens')
             answer = resp_struct['choices'][0]['message']['content'].strip()
         except Exception as e:
             print(f'Error: {e}')
@@ -195,19 +249,40 @@ class OpenAIWrapper(BaseAPI):
             print(f'Response:\n{response_text}')
             answer = self.fail_msg
             # import pdb; pdb.set_trace()
+        finally:
+            self.rate_limiter.release(tokens, used_tokens=used_tokens, latency=latency, status=status,
+                                      retry_after=retry_after)
         return ret_code, answer, response
 
     def get_token_len(self, inputs) -> int:
-        import tiktoken
-        try:
-            enc = tiktoken.encoding_for_model(self.model)
-        except Exception:
-            enc = tiktoken.encoding_for_model('gpt-4')
+        enc = _token_encoder(self.model)
         assert isinstance(inputs, list)
         tot = 0
         for item in inputs:
             if 'role' in item:
                 tot += self.get_token_len(item['content'])
             elif item['type'] == 'text':
-                tot += len(enc.encode(item['value']))
+                if enc is not None:
+                    tot += len(enc.encode(item['value']))
+                else:
+                    # about 4 bytes per token when no encoder could be loaded
+                    tot += len(item['value'].encode('utf-8')) // 4 + 1
         return tot
+
+
+@functools.lru_cache(maxsize=None)
+def _token_encoder(model: str):
+    """tiktoken encoder of model (the gpt-4 one for unknown models), loaded once per process.
+    None if tiktoken can not load one, e.g. offline without a cached encoding file"""
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning('tiktoken is not installed, token counts are estimated from the text length')
+        return None
+    for name in [model, 'gpt-4']:
+        try:
+            return tiktoken.encoding_for_model(name)
+        except Exception:
+            continue
+    logger.warning(f'no tiktoken encoding for {model}, token counts are estimated from the text length')
+    return None
@@ -0,0 +1,106 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import os.path as osp
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+DEFAULT_JUDGE_CACHE = osp.join(osp.expanduser('~'), '.cache', 'almeval', 'judge_cache.sqlite')
+# path of the cache file, or one of these to disable the cache
+JUDGE_CACHE_ENV = 'ALMEVAL_JUDGE_CACHE'
+_DISABLED = ['', '0', 'off', 'none', 'false']
+
+_judge_cache = None
+_judge_cache_lock = threading.Lock()
+# hits and misses of the evaluation running in this context, see JudgeCache.track
+_tracked_counts = contextvars.ContextVar('judge_cache_counts', default=None)
+
+
+class JudgeCache:
+    """Judge responses kept in a SQLite file, shared by evaluations, re-evaluations and gpt_eval.py.
+
+    A response is keyed by a hash of the judge model, its system prompt, the full rendered prompt and
+    the sampling parameters, so re-evaluating unchanged predictions sends no request. Only successful
+    responses are stored.
+    """
+
+    def __init__(self, db_file: str, timeout: float = 600):
+        self.db_file = db_file
+        # the streaming judge writes from its own thread
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout=timeout, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL)')
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, prompt: str, **params) -> str:
+        content = {'model': model, 'prompt': prompt, 'params': params}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            row = self.conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            tracked = _tracked_counts.get()
+            if row is None:
+                self.misses += 1
+                if tracked is not None:
+                    tracked['misses'] += 1
+                return None
+            self.hits += 1
+            if tracked is not None:
+                tracked['hits'] += 1
+        return row[0]
+
+    def peek(self, key: str) -> str | None:
+        """Like get, without counting a hit or miss"""
+        with self.lock:
+            row = self.conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key: str, model: str, response: str):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, model, response, created) VALUES (?, ?, ?, ?)',
+                              (key, model, response, time.time()))
+
+    def counts(self) -> tuple[int, int]:
+        """(hits, misses) so far, of all evaluations in this process"""
+        with self.lock:
+            return self.hits, self.misses
+
+    @staticmethod
+    @contextlib.contextmanager
+    def track():
+        """Count the hits and misses of the lookups made in this context only, including asyncio tasks started in
+        it, but not those of a streaming judge or another evaluation running in other threads at the same time.
+        Yields a Counter with 'hits' and 'misses'."""
+        counts = Counter(hits=0, misses=0)
+        token = _tracked_counts.set(counts)
+        try:
+            yield counts
+        finally:
+            _tracked_counts.reset(token)
+
+    def close(self):
+        self.conn.close()
+
+
+def get_judge_cache() -> JudgeCache | None:
+    """The process-wide judge cache at $ALMEVAL_JUDGE_CACHE (default ~/.cache/almeval/judge_cache.sqlite),
+    None if the variable disables it"""
+    global _judge_cache
+    db_file = os.environ.get(JUDGE_CACHE_ENV, DEFAULT_JUDGE_CACHE)
+    if db_file.strip().lower() in _DISABLED:
+        return None
+    with _judge_cache_lock:
+        if _judge_cache is None or _judge_cache.db_file != db_file:
+            os.makedirs(osp.dirname(osp.abspath(db_file)), exist_ok=True)
+            _judge_cache = JudgeCache(db_file)
+        return _judge_cache
@@ -0,0 +1,234 @@
+import asyncio
+import email.utils
+import os
+import threading
+import time
+from collections import deque
+
+# requests and tokens per minute a key allows, unlimited if not set
+RPM_ENV = 'ALMEVAL_JUDGE_RPM'
+TPM_ENV = 'ALMEVAL_JUDGE_TPM'
+
+# api base, model -> limiter shared by all wrappers calling it
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Budget of `rate_per_minute` units refilled continuously, holding at most `capacity` (a tenth of a
+    second's worth by default, so no burst goes much beyond the rate even in short windows). A request is
+    admitted once the bucket holds its amount; one larger than the bucket is admitted when the bucket is full
+    and overdraws it, so it is not starved, and later ones wait until refill and refunds pay the debt back."""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or max(1.0, self.rate / 10)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until a request of amount may be admitted, 0 if it may be now"""
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+    def refund(self, amount: float, now: float):
+        """Give back (or take more, if negative) once the actual usage is known"""
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter:
+    """Admission control for one API key: requests per minute, tokens per minute and requests in flight.
+
+    `acquire` waits for a concurrency slot, then for the request and token budgets, and for any pause a
+    429 `Retry-After` asked for. `release` reports the outcome: the token estimate is corrected with the
+    usage the API returned, and the concurrency limit adapts AIMD-style, growing by one per window of
+    successful requests and shrinking by half on 429/503 or to 0.9 when the latency climbs above
+    `latency_factor` times the lowest latency seen. Decreases happen at most once per latency, so one
+    burst of throttled requests counts once.
+
+    The limiter is shared by event loops in different threads (run_llm_judge, the streaming judge), so
+    its state is guarded by a thread lock and waiters are woken on their own loop.
+    """
+
+    def __init__(self,
+                 rpm: float = None,
+                 tpm: float = None,
+                 max_concurrency: int = 64,
+                 min_concurrency: int = 1,
+                 initial_concurrency: int = 8,
+                 latency_factor: float = 3.0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.latency_factor = latency_factor
+        self.lock = threading.Lock()
+        # slots taken, and requests among them that passed the budgets and are being sent
+        self.inflight = 0
+        self.sending = 0
+        self.waiters = deque()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.latency = None
+        self.base_latency = None
+        self.n_requests = 0
+        self.n_throttled = 0
+
+    def _grant(self):
+        # with self.lock held: hand free slots to waiters in arrival order
+        while self.waiters and self.inflight < int(self.concurrency):
+            waiter = self.waiters.popleft()
+            try:
+                waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+            except RuntimeError:
+                # its loop is closed, nobody waits there any more
+                continue
+            waiter.granted = True
+            self.inflight += 1
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Wait until a request of about `tokens` prompt + completion tokens may be sent, return the seconds waited"""
+        start = time.monotonic()
+        with self.lock:
+            if not self.waiters and self.inflight < int(self.concurrency):
+                self.inflight += 1
+                waiter = None
+            else:
+                waiter = _Waiter(asyncio.get_running_loop())
+                self.waiters.append(waiter)
+        if waiter is not None:
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self.lock:
+                    if waiter.granted:
+                        self.inflight -= 1
+                        self._grant()
+                    else:
+                        self.waiters.remove(waiter)
+                raise
+
+        try:
+            while True:
+                with self.lock:
+                    now = time.monotonic()
+                    # a 429 asked for a pause, or the budgets are overdrawn
+                    wait = self.blocked_until - now
+                    for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                        if bucket is not None:
+                            wait = max(wait, bucket.wait_time(amount, now))
+                    if wait <= 0:
+                        if self.requests is not None:
+                            self.requests.take(1, now)
+                        if self.tokens is not None:
+                            self.tokens.take(tokens, now)
+                        self.sending += 1
+                        break
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._release_slot()
+            raise
+        return time.monotonic() - start
+
+    def _release_slot(self):
+        with self.lock:
+            self.inflight -= 1
+            self._grant()
+
+    def release(self, tokens: int = 0, used_tokens: int = None, latency: float = None, status: int = None,
+                retry_after: float = None):
+        """Report a finished request: the tokens acquired for it, the tokens it actually used (None if unknown),
+        its latency in seconds, the HTTP status (None if it failed without one) and the Retry-After delay"""
+        with self.lock:
+            now = time.monotonic()
+            self.inflight -= 1
+            self.sending -= 1
+            self.n_requests += 1
+            if self.tokens is not None and used_tokens is not None:
+                self.tokens.refund(tokens - used_tokens, now)
+
+            if status in (429, 503):
+                self.n_throttled += 1
+                # without Retry-After, pause briefly so the retries of this burst do not hit the limit again
+                self.blocked_until = max(self.blocked_until, now + (retry_after if retry_after is not None else 1.0))
+                self._decrease(0.5, now)
+            elif status is not None and 200 <= status < 300 and latency is not None:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                self.base_latency = self.latency if self.base_latency is None else min(self.base_latency,
+                                                                                       self.latency)
+                if self.latency > self.latency_factor * self.base_latency:
+                    self._decrease(0.9, now)
+                elif self.sending + 1 >= int(self.concurrency):
+                    # only grow a limit that is actually reached, not while the budgets hold requests back
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._grant()
+
+    def _decrease(self, factor: float, now: float):
+        # once per round trip, the other requests of the same window saw the same congestion
+        if now - self.last_decrease < max(1.0, self.latency or 0.0):
+            return
+        self.last_decrease = now
+        self.concurrency = max(self.min_concurrency, self.concurrency * factor)
+
+    def summary(self) -> str:
+        with self.lock:
+            return (f'{self.n_requests} requests, {self.n_throttled} throttled, concurrency {self.concurrency:.1f}'
+                    + (f', latency {self.latency:.2f}s' if self.latency is not None else ''))
+
+
+def parse_retry_after(headers) -> float | None:
+    """Seconds to wait from the Retry-After (seconds or HTTP date) or retry-after-ms headers, None if absent"""
+    value = headers.get('retry-after-ms')
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_rate_limiter(api_base: str, model: str, rpm: float = None, tpm: float = None,
+                     max_concurrency: int = 64) -> RateLimiter:
+    """The limiter of an endpoint and model, shared by every wrapper calling them. rpm/tpm default to
+    $ALMEVAL_JUDGE_RPM/$ALMEVAL_JUDGE_TPM and only take effect when the limiter is first created"""
+    with _limiters_lock:
+        limiter = _limiters.get((api_base, model))
+        if limiter is None:
+            rpm = rpm or float(os.environ.get(RPM_ENV, 0)) or None
+            tpm = tpm or float(os.environ.get(TPM_ENV, 0)) or None
+            limiter = RateLimiter(rpm=rpm, tpm=tpm, max_concurrency=max_concurrency)
+            _limiters[(api_base, model)] = limiter
+        return limiter
@@ -0,0 +1,91 @@
+import asyncio
+import contextlib
+import threading
+
+from loguru import logger
+
+from ..utils.journal import PredictionJournal
+from . import judge_response
+
+
+def judge_key(model: str, prompt: str, temperature: float, top_p: float, repeat: int = 0):
+    """repeat numbers the judgements of one prompt, so an evaluation judging it several times (sampled, e.g.
+    evaluate_llm with n_times) reuses a streamed result for the first one only"""
+    return (model, prompt, float(temperature), float(top_p), int(repeat))
+
+
+def load_judge_sidecar(sidecar_files: list[str]) -> dict:
+    """Load judge results written by StreamingJudge, judge_key -> result"""
+    results = {}
+    for sidecar_file in sidecar_files:
+        for record in PredictionJournal.scan(sidecar_file):
+            key = judge_key(record['model'], record['prompt'], record['temperature'], record['top_p'],
+                            record.get('repeat', 0))
+            results[key] = record['judge_result']
+    return results
+
+
+class StreamingJudge:
+    """Judge finished predictions in the background while inference is still running.
+
+    Requests run on an asyncio loop in a daemon thread, paced by the judge model's rate limiter (at most
+    `threads` at a time for a judge model without one), and each
+    successful result is appended to a sidecar file. `evaluate` later reuses these results
+    through `AudioBaseDataset.judge_sidecar`, and only judges what is missing.
+    Failed requests are not recorded, so they are retried by `evaluate`.
+    """
+
+    def __init__(self, judge_model, sidecar_file: str, threads=10):
+        self.judge_model = judge_model
+        self.sidecar_file = sidecar_file
+        # results of a previous, interrupted run
+        self.submitted = set(load_judge_sidecar([sidecar_file]))
+        self.journal = PredictionJournal(sidecar_file, fsync_every=0)
+        self.futures = []
+        self.n_judged = 0
+        self.n_failed = 0
+
+        self.loop = asyncio.new_event_loop()
+        # the rate limiter is shared with run_llm_judge and adapts the requests in flight
+        self.semaphore = asyncio.Semaphore(threads) if getattr(judge_model, 'rate_limiter', None) is None else None
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, setting: dict):
+        """Queue one judge request, setting comes from `AudioBaseDataset.get_judge_setting`"""
+        key = judge_key(self.judge_model.model, setting['prompt'], setting['temperature'], setting['top_p'])
+        if key in self.submitted:
+            return
+        self.submitted.add(key)
+        self.futures.append(asyncio.run_coroutine_threadsafe(self._judge(setting), self.loop))
+
+    async def _judge(self, setting: dict):
+        async with self.semaphore or contextlib.nullcontext():
+            res = await judge_response(setting['prompt'], judge_model=self.judge_model,
+                                       temperature=setting['temperature'], top_p=setting['top_p'])
+        if res is None or self.judge_model.fail_msg in res:
+            self.n_failed += 1
+            return
+        # only the loop thread writes to the journal
+        self.journal.append({
+            'model': self.judge_model.model,
+            'prompt': setting['prompt'],
+            'temperature': setting['temperature'],
+            'top_p': setting['top_p'],
+            'judge_result': res,
+        })
+        self.n_judged += 1
+
+    def close(self):
+        """Wait for the requests in flight, then stop the loop"""
+        n_pending = sum(not f.done() for f in self.futures)
+        if n_pending > 0:
+            logger.info(f'waiting for {n_pending} streaming judge requests')
+        for future in self.futures:
+            future.result()
+        asyncio.run_coroutine_threadsafe(self.judge_model.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.journal.close()
+        logger.info(f'streaming judge: {self.n_judged} judged, {self.n_failed} failed and left to evaluate')
@@ -1 +1,7 @@
-from .wer import compute_wer  # noqa
+# compute_wer pulls in editdistance and the Chinese normalizer, loaded on first use so that light
+# submodules such as yes_no import without them
+def __getattr__(name):
+    if name == 'compute_wer':
+        from .wer import compute_wer
+        return compute_wer
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
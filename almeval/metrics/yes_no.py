@@ -0,0 +1,105 @@
+import re
+import unicodedata
+from typing import NamedTuple
+
+YES = 'yes'
+NO = 'no'
+UNKNOWN = 'unknown'
+
+# confidence levels: HIGH is safe to decide without the judge model, LOW is a best guess
+HIGH = 'high'
+LOW = 'low'
+
+_YES_WORDS = ['yes', 'yeah', 'yep', 'yup', 'correct', 'true', 'right', 'indeed', 'sure', 'certainly',
+              'definitely', 'absolutely', 'affirmative']
+# an emphatic yes word negated is a no, these go before 'no' so "absolutely not" is not read as a yes
+_NO_WORDS = ['absolutely not', 'certainly not', 'definitely not', 'of course not', 'no', 'nope', 'nah', 'incorrect', 'false', 'wrong', 'negative']
+_YES_ZH = ['是的', '是', '对的', '对', '正确', '没错', '确实', '当然', '有的', '有', '会的', '会', '能', '可以']
+_NO_ZH = ['并不是', '不是的', '不是', '不对', '不正确', '错误', '错', '否', '没有', '没', '无', '不会', '不能', '不']
+
+# answers that hedge, they are left to the judge model
+_HEDGES = re.compile(
+    r"\b(not sure|unsure|uncertain|unclear|unknown|maybe|perhaps|possibly|probably|likely|might|may|could|"
+    r"can ?not (?:determine|tell|be determined)|can't (?:determine|tell)|hard to (?:say|tell)|don't know|"
+    r"do not know|difficult to (?:say|tell|determine))\b"
+    r"|不确定|无法确定|无法判断|不好说|难以判断|很难说|不清楚|不知道|可能|也许|或许|大概")
+# words that turn a leading yes or no around later in the answer
+_CONTRAST = re.compile(r"\b(but|however|although|though|except|yet)\b|但|不过|然而|只是|除了")
+_NEGATION = re.compile(r"\b(no|not|never|none|nothing|neither|nor|without)\b|n't|不|没|无|否|非")
+_YES_PATTERN = re.compile(r'\b(' + '|'.join(_YES_WORDS) + r')\b(?! not\b)')
+_NO_PATTERN = re.compile(r'\b(' + '|'.join(_NO_WORDS) + r')\b|\bnot\b|n\'t\b')
+_YES_START_ZH = re.compile(r'[是对有](?!否)')
+# what may follow a leading yes/no word: the end of the answer, punctuation or a space
+_SEPARATOR = re.compile(r'$|[\s,.!;:\-—，。！；：、]')
+_STRIP = ' \t\n"\'“”‘’`*()[]（）【】'
+
+# questions a yes or no answers: a sentence opening with an auxiliary verb, or the Chinese 吗/是否 forms
+_YES_NO_QUESTION = re.compile(
+    r"(?:^|[.!?;:]\s*)(?:is|are|was|were|am|do|does|did|can|could|will|would|should|shall|has|have|had|may|"
+    r"might|must)(?:n't)?\b[^.!?]*\?"
+    r"|吗\s*[？?]?\s*$|是否|是不是|有没有|能不能|会不会|对不对")
+# "is it a dog or a cat?" and "是…还是…" pick one of several options, "what is said? is it loud?" is open
+_ALTERNATIVE = re.compile(r"\bor\b(?! not\b)|还是"
+                          r"|(?:^|[.!?;:]\s*)(?:what|which|who|whom|whose|how|why|where|when)\b[^.!?]*\?"
+                          r"|什么|哪|几|多少|怎么|为什么|谁")
+_ASKS_YES_NO = re.compile(r"\byes or no\b|\byes/no\b|是或否|是还是否")
+
+
+class YesNo(NamedTuple):
+    label: str  # YES, NO or UNKNOWN
+    confidence: str  # HIGH or LOW
+
+
+def _normalize(text: str) -> str:
+    # full-width punctuation and letters to their ASCII forms, curly apostrophes to '
+    text = unicodedata.normalize('NFKC', str(text)).replace('’', "'").lower()
+    return text.strip(_STRIP)
+
+
+def _leading(text: str, words: list[str]) -> str | None:
+    """The rest of text if it starts with one of words as a whole word, else None"""
+    for word in words:
+        if text.startswith(word) and _SEPARATOR.match(text, len(word)):
+            return text[len(word):]
+    return None
+
+
+def is_yes_no_question(question: str) -> bool:
+    """Whether question is answered with yes or no, judged from its wording only"""
+    text = _normalize(question)
+    if _ASKS_YES_NO.search(text):
+        return True
+    return _YES_NO_QUESTION.search(text) is not None and _ALTERNATIVE.search(text) is None
+
+
+def classify_yes_no(text: str) -> YesNo:
+    """Extract a yes/no answer from a prediction in English or Chinese.
+
+    HIGH confidence means the answer is plainly yes or no: a bare yes/no word ("Yes.", "不是"), or one that
+    leads the answer and is not contradicted, hedged or negated later ("No, there is no dog barking.").
+    Anything else is LOW confidence: the label then comes from yes or no words found anywhere in the text,
+    matched as whole words ("know" is not a no), and is UNKNOWN when there are none or both.
+    """
+    text = _normalize(text)
+    if text == '':
+        return YesNo(UNKNOWN, LOW)
+    hedged = _HEDGES.search(text) is not None
+    if not hedged:
+        # Chinese first, 是否 ("whether") must not count as 是
+        for words, label in [(_NO_ZH, NO), (_YES_ZH, YES), (_NO_WORDS, NO), (_YES_WORDS, YES)]:
+            rest = _leading(text, words)
+            if rest is None:
+                continue
+            if _CONTRAST.search(rest):
+                break
+            if label == YES and _NEGATION.search(rest):
+                break
+            if label == NO and (_YES_PATTERN.search(rest) or _leading(rest.lstrip(' ,.!;:，。！；：、'), _YES_ZH) is not None):
+                break
+            return YesNo(label, HIGH)
+
+    has_yes = _YES_PATTERN.search(text) is not None or _YES_START_ZH.match(text) is not None
+    has_no = _NO_PATTERN.search(text) is not None or text.startswith(('不', '否', '没'))
+    if hedged or has_yes == has_no:
+        return YesNo(UNKNOWN, LOW)
+    return YesNo(YES if has_yes else NO, LOW)
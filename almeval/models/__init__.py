@@ -1,42 +1,33 @@
 import importlib
-import inspect
-import pkgutil
 
-from ..utils.config_manager import ConfigManager
 from .base import BaseModel
 
-EXCLUDED_CLASSES = [
-    'BaseModel',
-]
-
-
-def get_subclasses(base_class, package_name):
-    """Get all subclasses of base_class in the specified package"""
-    all_classes = []
-
-    package = importlib.import_module(package_name)
-
-    for _, name, is_pkg in pkgutil.iter_modules(package.__path__):
-        if not name.startswith('__'):
-            try:
-                module = importlib.import_module(f'{package_name}.{name}')
-                classes = [
-                    cls for _, cls in inspect.getmembers(module, inspect.isclass)
-                    if issubclass(cls, base_class) and cls.__name__ not in EXCLUDED_CLASSES
-                ]
-                all_classes.extend(classes)
-            except Exception as e:
-                print(f'Warning: Failed to load module {name}: {str(e)}')
-
-    return all_classes
-
-
-supported_models = get_subclasses(BaseModel, __package__)
-supported_models = {model.NAME: model for model in supported_models}
+# NAME -> (module, class) of every model wrapper. Kept by hand so that building a model only imports its own
+# wrapper (and its heavy dependencies), and runs that need no model import none. Add new wrappers here.
+MODEL_REGISTRY = {
+    'Baichuan-Audio': ('baichuan_audio', 'BaichuanAudioBase'),
+    'Baichuan-Audio-Chat': ('baichuan_audio', 'BaichuanAudioChat'),
+    'GLM4-Voice': ('glm4_voice', 'GLM4Voice'),
+    'Kimi-Audio': ('kimi_audio', 'KimiAudio'),
+    'Qwen2-Audio-7B': ('qwen_audio', 'Qwen2Audio'),
+    'Qwen2-Audio-7B-Instruct': ('qwen_audio', 'Qwen2AudioChat'),
+    'Qwen-Audio': ('qwen_audio', 'QwenAudio'),
+    'Qwen2.5-Omni-7B': ('qwen_omni', 'Qwen2_5Omni'),
+    'StepAudio': ('step_audio', 'StepAudio'),
+}
+
+supported_models = list(MODEL_REGISTRY)
+
+
+def get_model_class(name) -> type[BaseModel]:
+    if name not in MODEL_REGISTRY:
+        raise ValueError(
+            f'Model {name} not supported, all supported models: {supported_models}')
+    module, class_name = MODEL_REGISTRY[name]
+    model_class = getattr(importlib.import_module(f'{__package__}.{module}'), class_name)
+    assert model_class.NAME == name, f'MODEL_REGISTRY entry of {name} points to {model_class.NAME}'
+    return model_class
 
 
 def build_model(name, **kwargs):
-    if name not in supported_models:
-        raise ValueError(
-            f'Model {name} not supported, all supported models: {supported_models.keys()}')
-    return supported_models[name](**kwargs)
+    return get_model_class(name)(**kwargs)
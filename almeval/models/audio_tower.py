@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+
+import torch
+from loguru import logger
+from torch import nn
+from transformers.modeling_outputs import BaseModelOutput
+
+from ..utils.embed_cache import EmbeddingCache
+
+
+class CachedAudioTower(nn.Module):
+    """Wrap the audio encoder of a model, so that clips seen before reuse their cached encoder output.
+
+    The model wrapper tells the encoder which clips it is about to see with `audio_keys`, one
+    key per clip in the order the processor stacked them. Without keys, the encoder runs as is.
+    Attributes not defined here (config, device, helper methods) are looked up on the encoder.
+
+    `packed` encoders (Qwen2.5-Omni) take all clips concatenated along time with `feature_lens`,
+    the others (Qwen2-Audio) take one padded row per clip.
+    """
+
+    def __init__(self, tower: nn.Module, cache: EmbeddingCache, namespace: str, packed=False):
+        super().__init__()
+        self.tower = tower
+        self.cache = cache
+        self.namespace = namespace
+        self.packed = packed
+        self.keys = None
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.tower, name)
+
+    def forward(self, input_features, *args, **kwargs):
+        if self.keys is None:
+            return self.tower(input_features, *args, **kwargs)
+        if self.packed:
+            return self._forward_packed(input_features, *args, **kwargs)
+        return self._forward_padded(input_features, *args, **kwargs)
+
+    def _forward_padded(self, input_features, attention_mask=None, **kwargs):
+        if len(self.keys) != input_features.shape[0]:
+            logger.warning(f'{len(self.keys)} audio keys for {input_features.shape[0]} clips, embedding cache skipped')
+            return self.tower(input_features, attention_mask=attention_mask, **kwargs)
+        hidden = [self.cache.get(key, device=input_features.device) for key in self.keys]
+        missing = [k for k, h in enumerate(hidden) if h is None]
+        if len(missing) > 0:
+            rows = torch.tensor(missing, device=input_features.device)
+            mask = attention_mask[rows] if attention_mask is not None else None
+            outputs = self.tower(input_features[rows], attention_mask=mask, **kwargs)
+            if len(missing) == len(hidden):
+                self._store(missing, outputs.last_hidden_state)
+                return outputs
+            self._store(missing, outputs.last_hidden_state, hidden)
+        return BaseModelOutput(last_hidden_state=torch.stack(hidden))
+
+    def _forward_packed(self, input_features, feature_lens=None, aftercnn_lens=None, **kwargs):
+        if len(self.keys) != len(feature_lens):
+            logger.warning(f'{len(self.keys)} audio keys for {len(feature_lens)} clips, embedding cache skipped')
+            return self.tower(input_features, feature_lens=feature_lens, aftercnn_lens=aftercnn_lens, **kwargs)
+        hidden = [self.cache.get(key, device=input_features.device) for key in self.keys]
+        missing = [k for k, h in enumerate(hidden) if h is None]
+        if len(missing) > 0:
+            starts = [0] + torch.cumsum(feature_lens, 0).tolist()
+            features = torch.cat([input_features[:, starts[k]:starts[k + 1]] for k in missing], dim=1)
+            rows = torch.tensor(missing, device=feature_lens.device)
+            outputs = self.tower(features, feature_lens=feature_lens[rows],
+                                 aftercnn_lens=aftercnn_lens[rows] if aftercnn_lens is not None else None, **kwargs)
+            if len(missing) == len(hidden):
+                self._store(missing, self._split(outputs.last_hidden_state, feature_lens))
+                return outputs
+            self._store(missing, self._split(outputs.last_hidden_state, feature_lens[rows]), hidden)
+        return BaseModelOutput(last_hidden_state=torch.cat(hidden))
+
+    def _split(self, last_hidden_state, feature_lens):
+        _, output_lens = self.tower._get_feat_extract_output_lengths(feature_lens)
+        return last_hidden_state.split(output_lens.tolist())
+
+    def _store(self, missing, outputs, hidden=None):
+        for k, output in zip(missing, outputs):
+            # a copy, a view would keep the whole batch output alive in the cache
+            output = output.clone()
+            self.cache.put(self.keys[k], output)
+            if hidden is not None:
+                hidden[k] = output
+
+    @contextmanager
+    def audio_keys(self, paths: list[str], sr: int):
+        self.keys = [self.cache.audio_key(path, sr, namespace=self.namespace) for path in paths]
+        try:
+            yield
+        finally:
+            self.keys = None
+
+
+@contextmanager
+def audio_keys(tower: nn.Module, paths: list[str], sr: int):
+    """Tell `tower` which clips come next if it is a CachedAudioTower, do nothing otherwise"""
+    if isinstance(tower, CachedAudioTower):
+        with tower.audio_keys(paths, sr):
+            yield
+    else:
+        yield
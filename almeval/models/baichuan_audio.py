@@ -19,6 +19,7 @@ class BaichuanAudioBase(BaseModel):
     NAME = 'Baichuan-Audio'
 
     def __init__(self, model_path='baichuan-inc/Baichuan-Audio-Base', **kwargs):
+        self.model_path = model_path
         self.tokenizer = AutoTokenizer.from_pretrained(
             model_path, trust_remote_code=True, model_max_length=128000)
         self.model = AutoModelForCausalLM.from_pretrained(
@@ -110,6 +111,7 @@ class BaichuanAudioChat(BaichuanAudioBase):
         r'<\|endoftext\|>|<audiogen_start_baichuan>|<audiogen_end_baichuan>')
     sample_rate = 24000
     NAME = 'Baichuan-Audio-Chat'
+    SAMPLING = True
 
     def __init__(self, model_path='baichuan-inc/Baichuan-Audio-Instruct', **kwargs):
         super().__init__(model_path, **kwargs)
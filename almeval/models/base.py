@@ -1,37 +1,164 @@
+import json
 from abc import abstractmethod
 
-import librosa
 import torch
 from loguru import logger
 
+from ..utils.audio_manifest import cached_audio_duration
+
 
 class BaseModel:
 
     NAME = None
+    # bump when prompt building or generation settings of a wrapper change, so cached results are not reused
+    VERSION = 1
+    # whether answer_logits_inner is implemented, see --answer-mode logits
+    ANSWER_LOGITS = False
+    # clips outside these limits (seconds) are skipped, the runner drops such samples before scheduling
+    MAX_DURATION = 60
+    MIN_DURATION = 0.1
+    # whether generate_inner samples regardless of generation_config, see is_sampling
+    SAMPLING = False
 
     @abstractmethod
     def generate_inner(self, msg: dict) -> (str, str):
         raise NotImplementedError
 
+    def get_cache_config(self) -> dict:
+        """Everything besides the prompt and audio that decides the output, part of the inference cache key"""
+        return {
+            'name': self.NAME,
+            'version': self.VERSION,
+            'model_path': getattr(self, 'model_path', None),
+            'generation_config': getattr(self, 'generation_config', None),
+        }
+
+    def is_sampling(self) -> bool:
+        """Whether generation is stochastic (SAMPLING, or do_sample in generation_config), so a single unseeded
+        run is not reproducible and is kept out of the inference cache"""
+        if self.SAMPLING:
+            return True
+        config = getattr(self, 'generation_config', None) or {}
+        # per-task configs are nested, e.g. Qwen2.5-Omni
+        configs = [config] + [c for c in config.values() if isinstance(c, dict)]
+        return any(v for c in configs for k, v in c.items() if k.endswith('do_sample'))
+
+    def supports_samples(self) -> bool:
+        """Whether --num-samples > 1 works: generate_samples_inner is overridden to sample natively, or the
+        wrapper samples, so the default one pass per sample gives different responses"""
+        return type(self).generate_samples_inner is not BaseModel.generate_samples_inner or self.is_sampling()
+
+    def get_cache_prompt(self, msg: dict) -> str:
+        """The prompt of msg plus the task fields wrappers branch on, part of the inference cache key.
+        Subclasses override this if their output also depends on something else, e.g. a per-dataset system prompt.
+        """
+        meta = msg['meta']
+        return json.dumps([self.get_prompt(msg)] + [meta.get(k) for k in ['task', 'type', 'interactive', 'audio_type']],
+                          ensure_ascii=False)
+
+    def enable_embedding_cache(self, cache):
+        """Reuse audio encoder outputs of clips seen before, see almeval/models/audio_tower.py.
+        Models that support it override this.
+        """
+        logger.warning(f'{self.NAME} does not support the embedding cache, ignored')
+
+    def enable_prefix_cache(self, cache):
+        """Reuse the KV cache of prompt prefixes shared by several samples, see almeval/models/prefix_cache.py.
+        Models that support it override this.
+        """
+        logger.warning(f'{self.NAME} does not support the prefix cache, ignored')
+
+    def preprocess(self, msg: dict) -> dict:
+        """CPU-side work (e.g. decoding and resampling audio) that the runner may run in a background thread ahead of
+        generation. Results are stored in msg for generate_inner to pick up, by default nothing is done.
+        """
+        return msg
+
+    def generate_batch_inner(self, msgs: list[dict]) -> list[tuple[str, str]]:
+        """by default, messages are generated one by one. subclasses whose processor accepts lists can override this
+        to run the whole batch in one padded generate call.
+        """
+        return [self.generate_inner(msg) for msg in msgs]
+
+    def generate_samples_inner(self, msgs: list[dict], n: int, seed: int) -> list[tuple[str, list[str]]]:
+        """Generate n sampled responses per message, returns one (prompt, responses) per message. All samples
+        come from one RNG stream seeded with seed. By default, the whole batch is generated n times, which needs
+        a wrapper that samples (see is_sampling). Subclasses whose generate supports num_return_sequences override
+        this and turn sampling on, so the audio is encoded once for all samples.
+        """
+        if not self.is_sampling():
+            raise NotImplementedError(f'{self.NAME} generates greedily, its samples would all be the same')
+        torch.manual_seed(seed)
+        outputs = [self.generate_batch_inner(msgs) for _ in range(n)]
+        return [(outputs[0][k][0], [output[k][1] for output in outputs]) for k in range(len(msgs))]
+
+    def answer_logits_inner(self, msgs: list[dict]) -> list[tuple[str, str, float]]:
+        """Answer yes/no questions with one forward pass instead of generation: compare the next-token probabilities
+        of the yes and no tokens (see almeval/models/yes_no.py). Returns one (prompt, label, confidence) per message,
+        label is 'yes' or 'no'. Subclasses that support it override this and set ANSWER_LOGITS.
+        """
+        raise NotImplementedError
+
     @staticmethod
-    def check_audio_legal(audio_path: str | list[str], max_duration: float = 60) -> bool:
+    def check_audio_legal(audio_path: str | list[str], max_duration: float = 60, min_duration: float = 0.1) -> bool:
         """by default, we discard audio longer than 60s. subclasses can override this method (depends on model requirements)
+        durations come from the audio manifest when the runner has loaded one.
         """
         if isinstance(audio_path, str):
-            duration = librosa.get_duration(path=audio_path)
-            if duration > max_duration or duration < 0.1:
+            duration = cached_audio_duration(audio_path)
+            if duration > max_duration or duration < min_duration:
                 return False
         else:
             for path in audio_path:
-                duration = librosa.get_duration(path=path)
-                if duration > max_duration or duration < 0.1:
+                duration = cached_audio_duration(path)
+                if duration > max_duration or duration < min_duration:
                     return False
         return True
 
+    def is_legal(self, msg: dict) -> bool:
+        if not self.check_audio_legal(msg['audio'], self.MAX_DURATION, self.MIN_DURATION):
+            logger.warning(
+                f'dataset: {msg["meta"]["dataset_name"]}, audio: {msg["audio"]}, duration outside '
+                f'[{self.MIN_DURATION}, {self.MAX_DURATION}]s, skipping this sample')
+            return False
+        return True
+
     @torch.inference_mode()
     def __call__(self, msg: dict) -> str:
-        if not self.check_audio_legal(msg['audio']):
-            logger.warning(
-                f'dataset: {msg["meta"]["dataset_name"]}, audio: {msg["audio"]}, duration exceeds 60s limit, skipping this sample')
+        if not self.is_legal(msg):
             return msg['text'], None
         return self.generate_inner(msg)
+
+    @torch.inference_mode()
+    def generate_batch(self, msgs: list[dict]) -> list[tuple[str, str]]:
+        """Batched version of __call__, returns one (prompt, response) per message, response is None if skipped"""
+        results = [(msg['text'], None) for msg in msgs]
+        legal = [k for k, msg in enumerate(msgs) if self.is_legal(msg)]
+        if len(legal) > 0:
+            outputs = self.generate_batch_inner([msgs[k] for k in legal])
+            for k, output in zip(legal, outputs):
+                results[k] = output
+        return results
+
+    @torch.inference_mode()
+    def generate_samples(self, msgs: list[dict], n: int, seed: int) -> list[tuple[str, list[str]]]:
+        """Multi-sample version of generate_batch, returns one (prompt, responses) per message, responses is None
+        if skipped"""
+        results = [(msg['text'], None) for msg in msgs]
+        legal = [k for k, msg in enumerate(msgs) if self.is_legal(msg)]
+        if len(legal) > 0:
+            outputs = self.generate_samples_inner([msgs[k] for k in legal], n, seed)
+            for k, output in zip(legal, outputs):
+                results[k] = output
+        return results
+
+    @torch.inference_mode()
+    def answer_logits(self, msgs: list[dict]) -> list[tuple[str, str, float]]:
+        """Batched yes/no scoring, returns one (prompt, label, confidence) per message, label is None if skipped"""
+        results = [(msg['text'], None, None) for msg in msgs]
+        legal = [k for k, msg in enumerate(msgs) if self.is_legal(msg)]
+        if len(legal) > 0:
+            outputs = self.answer_logits_inner([msgs[k] for k in legal])
+            for k, output in zip(legal, outputs):
+                results[k] = output
+        return results
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from io import BytesIO
 
 import librosa
@@ -6,6 +7,8 @@ import torch
 from transformers import (AutoConfig, AutoModel, AutoTokenizer,
                           WhisperFeatureExtractor)
 
+from ..utils.audio_archive import audio_stat
+from ..utils.audio_loader import load_waveform
 from ..utils.misc import print_once
 from .base import BaseModel
 from .glm4voice.speech_tokenizer.modeling_whisper import WhisperVQEncoder
@@ -17,10 +20,14 @@ Semantic = ['homophone','inferredsound','knowledge','overreliance','polysemy','p
 
 class GLM4Voice(BaseModel):
     NAME = 'GLM4-Voice'
+    SAMPLING = True
+    AUDIO_TOKEN_CACHE_SIZE = 4096
+    audio_token_cache = None
 
     def __init__(self, model_path='THUDM/glm-4-voice-9b',
                  device='cuda',
                  **kwargs):
+        self.model_path = model_path
         self.device = device
         config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
         model_class = AutoModel.from_config(config, trust_remote_code=True)
@@ -44,8 +51,23 @@ class GLM4Voice(BaseModel):
                                       'with 13 text token followed by 26 audio tokens. ')
         torch.cuda.empty_cache()
 
-    def get_token_ids(self, audio: BytesIO):
+    def enable_prefix_cache(self, cache):
+        # the system prompt holds the question and comes before the audio, so no KV prefix is shared
+        # between questions about a clip. Cache the speech tokens of each clip instead.
+        self.audio_token_cache = OrderedDict()
 
+    def get_token_ids(self, audio: BytesIO):
+        if self.audio_token_cache is not None and isinstance(audio, str):
+            key = (audio, audio_stat(audio)[1])
+            if key not in self.audio_token_cache:
+                self.audio_token_cache[key] = self._get_token_ids(audio)
+                if len(self.audio_token_cache) > self.AUDIO_TOKEN_CACHE_SIZE:
+                    self.audio_token_cache.popitem(last=False)
+            self.audio_token_cache.move_to_end(key)
+            return self.audio_token_cache[key]
+        return self._get_token_ids(audio)
+
+    def _get_token_ids(self, audio: BytesIO):
         audio_tokens = self.audio_tokenizer.tokenize(audio)[0]
         audio_tokens = ''.join([f'<|audio_{x}|>' for x in audio_tokens])
         audio_tokens = '<|begin_of_audio|>' + audio_tokens + '<|end_of_audio|>'
@@ -152,7 +174,11 @@ class Glm4Tokenizer:
             audio_tokens: torch.Tensor, shape (B, T), B is batch size, T is token length.
         """
         in_sr = sr or self.in_sr
-        if isinstance(audio, str) or isinstance(audio, BytesIO):
+        if isinstance(audio, str):
+            audio, sr = load_waveform(audio, sr=in_sr)
+            audio = torch.tensor(audio).unsqueeze(0)
+            audio_info = (audio, sr)
+        elif isinstance(audio, BytesIO):
             audio, sr = librosa.load(audio, sr=in_sr)
             audio = torch.tensor(audio).unsqueeze(0)
             audio_info = (audio, sr)
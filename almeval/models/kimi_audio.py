@@ -2,6 +2,7 @@ import sys
 sys.path.insert(0, 'almeval/models/kimi_audio') #noqa
 from .kimia_infer.api.kimia import KimiAudio as KimiAudio_hf
 
+from ..utils.audio_archive import materialize
 from .base import BaseModel
 
 
@@ -10,6 +11,7 @@ class KimiAudio(BaseModel):
 
     def __init__(self, model_path='moonshotai/Kimi-Audio-7B-Instruct', **kwargs):
         assert model_path is not None
+        self.model_path = model_path
         self.model = KimiAudio_hf(
             model_path=model_path, load_detokenizer=False)
 
@@ -26,6 +28,11 @@ class KimiAudio(BaseModel):
         }
         super().__init__()
 
+    def get_cache_config(self) -> dict:
+        config = super().get_cache_config()
+        config['generation_config'] = self.sampling_params
+        return config
+
     def get_prompt(self, msg: dict):
         return msg['text']
 
@@ -34,7 +41,9 @@ class KimiAudio(BaseModel):
         audio = msg['audio']
 
         if len(audio) == 1:
-            audio = audio[0]
+            # the Kimi-Audio prompt manager only accepts a file path (it runs its own whisper and audio tokenizer
+            # on it), so this model reads the original file and does not use the waveform cache
+            audio = materialize(audio[0])
         else:
             raise NotImplementedError(
                 f'Audio length {len(audio)} not supported')
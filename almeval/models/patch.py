@@ -1,6 +1,8 @@
 import torch
 import torchaudio
 
+from ..utils.audio_archive import materialize
+from ..utils.audio_loader import load_waveform
 from ..utils.misc import print_once
 
 
@@ -64,20 +66,29 @@ def patch_glm4_voice_update_model_kwargs_for_generation(
     return model_kwargs
 
 
-def patch_baichuan_load_audio_waveform(self, uri, return_tensors=True, do_normalize=False):
-    # for mmau-test-mini: https://huggingface.co/baichuan-inc/Baichuan-Audio-Instruct/discussions/1#67e27c55ad5e6f59d8561187
-    print_once('Using patched baichuan load_audio_waveform')
+def baichuan_decode_audio(uri, sr):
+    uri = materialize(uri)
     # sample_rate, num_frames, num_channels, bits_per_sample, encoding=PCM_S
     metadata = torchaudio.info(uri)
     # assert(metadata.num_channels <= 2), "acoustic file with {} channels.".format(metadata.num_channels)
     waveform_tensor, _ = torchaudio.load(uri, normalize=True)
-    if self.config.sampling_rate != metadata.sample_rate:
+    if sr != metadata.sample_rate:
         waveform_tensor = torchaudio.functional.resample(
-            waveform_tensor, metadata.sample_rate, self.config.sampling_rate, lowpass_filter_width=128)
+            waveform_tensor, metadata.sample_rate, sr, lowpass_filter_width=128)
 
     # downmix to mono channel https://trac.ffmpeg.org/wiki/AudioChannelManipulation
     if metadata.num_channels > 1:
         waveform_tensor = torch.mean(waveform_tensor, dim=0, keepdim=True)
+    # (channels, samples)
+    return waveform_tensor.numpy(), sr
+
+
+def patch_baichuan_load_audio_waveform(self, uri, return_tensors=True, do_normalize=False):
+    # for mmau-test-mini: https://huggingface.co/baichuan-inc/Baichuan-Audio-Instruct/discussions/1#67e27c55ad5e6f59d8561187
+    print_once('Using patched baichuan load_audio_waveform')
+    # decoded once per clip with --audio-cache, copied since the cached waveform is read-only
+    waveform, _ = load_waveform(uri, sr=self.config.sampling_rate, decode=baichuan_decode_audio)
+    waveform_tensor = torch.tensor(waveform)
 
     # normalized to zero mean
     if do_normalize:
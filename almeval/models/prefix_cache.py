@@ -0,0 +1,93 @@
+import copy
+import hashlib
+from collections import OrderedDict
+
+import torch
+
+
+def _nbytes(obj) -> int:
+    """Total size of the tensors held by a cache object, whatever its layout across transformers versions"""
+    if torch.is_tensor(obj):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(o) for o in obj)
+    if isinstance(obj, dict):
+        return sum(_nbytes(o) for o in obj.values())
+    if hasattr(obj, '__dict__'):
+        return sum(_nbytes(o) for o in vars(obj).values())
+    return 0
+
+
+class PrefixKVCache:
+    """LRU of `past_key_values` of prompt prefixes, bounded by the total size of the cached tensors.
+
+    Used for prompts that start with the audio, so that every question about one clip reuses the
+    KV cache of the audio part. Entries are handed out as copies, since generate extends them in place.
+    """
+
+    def __init__(self, max_gb: float = 4):
+        self.max_bytes = int(max_gb * 2**30)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*tensors) -> str:
+        hash = hashlib.sha1()
+        for tensor in tensors:
+            tensor = tensor.detach().cpu().contiguous()
+            hash.update(str((tuple(tensor.shape), tensor.dtype)).encode('utf-8'))
+            hash.update(tensor.view(torch.uint8).numpy().tobytes() if tensor.numel() > 0 else b'')
+        return hash.hexdigest()
+
+    def get(self, key: str):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return copy.deepcopy(self.entries[key][0])
+
+    def put(self, key: str, past_key_values):
+        nbytes = _nbytes(past_key_values)
+        if key in self.entries or nbytes > self.max_bytes:
+            return
+        self.entries[key] = (past_key_values, nbytes)
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total > 0 else 0.
+        return (f'prefix cache: {self.hits} hits, {self.misses} misses, hit rate {rate:.1%}, '
+                f'{len(self.entries)} entries, {self.total_bytes / 2**20:.1f} MB')
+
+
+@torch.inference_mode()
+def generate_with_prefix(model, inputs: dict, prefix_len: int, cache: PrefixKVCache, **generate_kwargs):
+    """Generate for one sample whose first prefix_len tokens hold all multimodal inputs and are shared with
+    other samples. The prefix is run once and its KV cache reused, the rest of the prompt is prefilled on top.
+
+    Args:
+        inputs: processor outputs of a single sample (batch size 1), on the model's device.
+
+    Returns:
+        generated ids, including the prompt, like model.generate
+    """
+    input_ids = inputs['input_ids']
+    attention_mask = inputs['attention_mask']
+    assert input_ids.shape[0] == 1 and prefix_len < input_ids.shape[1]
+    # everything besides the text belongs to the prefix, e.g. input_features and feature_attention_mask
+    extra = {k: v for k, v in inputs.items() if k not in ['input_ids', 'attention_mask']}
+    key = PrefixKVCache.key(input_ids[:, :prefix_len], *[extra[k] for k in sorted(extra)])
+    past_key_values = cache.get(key)
+    if past_key_values is None:
+        outputs = model(input_ids=input_ids[:, :prefix_len], attention_mask=attention_mask[:, :prefix_len],
+                        use_cache=True, **extra)
+        cache.put(key, outputs.past_key_values)
+        past_key_values = copy.deepcopy(outputs.past_key_values)
+    return model.generate(input_ids=input_ids, attention_mask=attention_mask, past_key_values=past_key_values,
+                          **generate_kwargs)
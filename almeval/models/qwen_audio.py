@@ -1,11 +1,14 @@
 import random
 import re
-import librosa
 import torch
 from transformers import AutoProcessor, Qwen2AudioForConditionalGeneration
 
+from ..utils.audio_loader import load_waveform
 from ..utils.misc import print_once
+from .audio_tower import CachedAudioTower, audio_keys
 from .base import BaseModel
+from .prefix_cache import generate_with_prefix
+from .yes_no import score_yes_no, yes_no_token_ids
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from transformers.generation import GenerationConfig
 import torch
@@ -15,6 +18,8 @@ Semantic = ['homophone','inferredsound','knowledge','overreliance','polysemy','p
 
 class Qwen2Audio(BaseModel):
     NAME = 'Qwen2-Audio-7B'
+    ANSWER_LOGITS = True
+    prefix_cache = None
 
     def __init__(self, model_path='Qwen/Qwen2-Audio-7B', **kwargs):
         assert model_path is not None
@@ -25,6 +30,8 @@ class Qwen2Audio(BaseModel):
 
         self.model = Qwen2AudioForConditionalGeneration.from_pretrained(
             model_path, device_map='cuda').eval()
+        self.generation_config = dict(max_new_tokens=256, min_new_tokens=1, do_sample=False, top_k=None, top_p=None)
+        self.yes_no_ids = yes_no_token_ids(self.processor.tokenizer)
         random.seed(0)
         torch.cuda.empty_cache()
 
@@ -70,8 +77,7 @@ class Qwen2Audio(BaseModel):
         prompt = self.get_prompt(msg)
 
         print_once(f'Prompt: {prompt}')
-        audio = librosa.load(
-            audio, sr=self.processor.feature_extractor.sampling_rate)[0]
+        audio = self.load_audio(msg)
 
         inputs = self.processor(
             text=prompt,
@@ -79,15 +85,88 @@ class Qwen2Audio(BaseModel):
             return_tensors='pt',
             sampling_rate=self.processor.feature_extractor.sampling_rate,
         )
-        inputs = inputs.to('cuda')
-        generated_ids = self.model.generate(**inputs, max_new_tokens=256, min_new_tokens=1, do_sample=False,
-                                            top_k=None,
-                                            top_p=None)
+        return prompt, self._generate(inputs, [msg])[0]
+
+    def build_inputs(self, msgs: list[dict]):
+        prompts = [self.get_prompt(msg) for msg in msgs]
+        print_once(f'Prompt: {prompts[0]}')
+        audios = [self.load_audio(msg) for msg in msgs]
+
+        # left padding, so that generated tokens of all samples start at the same position
+        self.processor.tokenizer.padding_side = 'left'
+        inputs = self.processor(
+            text=prompts,
+            audios=audios,
+            return_tensors='pt',
+            padding=True,
+            sampling_rate=self.processor.feature_extractor.sampling_rate,
+        )
+        return prompts, inputs
+
+    def generate_batch_inner(self, msgs: list[dict]):
+        prompts, inputs = self.build_inputs(msgs)
+        return list(zip(prompts, self._generate(inputs, msgs)))
+
+    def generate_samples_inner(self, msgs: list[dict], n: int, seed: int):
+        prompts, inputs = self.build_inputs(msgs)
+        # one RNG stream for all samples, the audio is encoded once and expanded inside generate
+        torch.manual_seed(seed)
+        preds = self._generate(inputs, msgs, do_sample=True, num_return_sequences=n)
+        return [(prompt, preds[k * n:(k + 1) * n]) for k, prompt in enumerate(prompts)]
+
+    def answer_logits_inner(self, msgs: list[dict]):
+        prompts, inputs = self.build_inputs(msgs)
+        inputs = inputs.to(self.model.device)
+        sr = self.processor.feature_extractor.sampling_rate
+        with audio_keys(self.model.audio_tower, [msg['audio'][0] for msg in msgs], sr):
+            logits = self.model(**inputs).logits[:, -1]
+        scores = score_yes_no(logits, *self.yes_no_ids)
+        return [(prompt, label, confidence) for prompt, (label, confidence) in zip(prompts, scores)]
+
+    def preprocess(self, msg: dict):
+        msg['audio_data'] = [load_waveform(path, sr=self.processor.feature_extractor.sampling_rate)[0]
+                             for path in msg['audio']]
+        return msg
+
+    def load_audio(self, msg: dict):
+        if 'audio_data' in msg:
+            return msg['audio_data'][0]
+        return load_waveform(msg['audio'][0], sr=self.processor.feature_extractor.sampling_rate)[0]
+
+    def enable_embedding_cache(self, cache):
+        self.model.audio_tower = CachedAudioTower(self.model.audio_tower, cache, namespace=self.NAME)
+
+    def enable_prefix_cache(self, cache):
+        # the prompt starts with the audio, so all questions about a clip share the KV cache up to <|audio_eos|>
+        self.prefix_cache = cache
+
+    def audio_prefix_len(self, input_ids):
+        """Number of prompt tokens up to <|audio_eos|>, None if the processor left the audio token unexpanded
+        (older processors), then the model expands it inside forward and positions do not line up.
+        """
+        ids = input_ids[0].tolist()
+        if ids.count(self.model.config.audio_token_index) <= 1:
+            return None
+        return ids.index(self.processor.tokenizer.convert_tokens_to_ids('<|audio_eos|>')) + 1
+
+    def _generate(self, inputs, msgs, **generate_kwargs):
+        inputs = inputs.to(self.model.device)
+        sr = self.processor.feature_extractor.sampling_rate
+        generation_config = dict(self.generation_config, **generate_kwargs)
+        prefix_len = None
+        if self.prefix_cache is not None and len(msgs) == 1 and generation_config.get('num_return_sequences', 1) == 1:
+            prefix_len = self.audio_prefix_len(inputs.input_ids)
+        with audio_keys(self.model.audio_tower, [msg['audio'][0] for msg in msgs], sr):
+            if prefix_len is not None:
+                generated_ids = generate_with_prefix(self.model, inputs, prefix_len, self.prefix_cache,
+                                                     **generation_config)
+            else:
+                generated_ids = self.model.generate(**inputs, **generation_config)
         generated_ids = generated_ids[:, inputs.input_ids.size(1):]
         pred = self.processor.batch_decode(
             generated_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
-        return prompt, pred
+        )
+        return pred
 
 
 
@@ -99,8 +178,11 @@ class Qwen2Audio(BaseModel):
 
 class Qwen2AudioChat(BaseModel):
     NAME = 'Qwen2-Audio-7B-Instruct'
+    ANSWER_LOGITS = True
 
     def __init__(self, model_path='Qwen/Qwen2-Audio-7B-Instruct', **kwargs):
+        self.model_path = model_path
+        self.generation_config = dict(max_new_tokens=256)
         self.processor = AutoProcessor.from_pretrained(
             model_path, trust_remote_code=True
         )
@@ -108,6 +190,7 @@ class Qwen2AudioChat(BaseModel):
         self.model = Qwen2AudioForConditionalGeneration.from_pretrained(
             model_path, device_map='cuda'
         )
+        self.yes_no_ids = yes_no_token_ids(self.processor.tokenizer)
         torch.cuda.empty_cache()
 
     def get_prompt(self, msg: dict):
@@ -122,7 +205,7 @@ class Qwen2AudioChat(BaseModel):
         #     prompt = msg['text']
         return prompt
 
-    def generate_inner(self, msg: dict):
+    def get_conversation(self, msg: dict):
         audio = msg['audio']
         if len(audio) == 1:
             audio = audio[0]
@@ -139,41 +222,94 @@ class Qwen2AudioChat(BaseModel):
                         {'role': 'user',
                             'content': [{'type': 'audio', 'audio_url': audio},
                                         {'type': 'text', 'text': prompt}]}]
+        return prompt, conversation
 
-        text = self.processor.apply_chat_template(
-            conversation, add_generation_prompt=True, tokenize=False
-        )
+    def enable_embedding_cache(self, cache):
+        self.model.audio_tower = CachedAudioTower(self.model.audio_tower, cache, namespace=self.NAME)
+
+    def preprocess(self, msg: dict):
+        msg['audio_data'] = [load_waveform(path, sr=self.processor.feature_extractor.sampling_rate)[0]
+                             for path in msg['audio']]
+        return msg
+
+    def load_audios(self, msg: dict, conversation: list):
+        if 'audio_data' in msg:
+            return msg['audio_data']
         audios = []
         for message in conversation:
             if isinstance(message['content'], list):
                 for ele in message['content']:
                     if ele['type'] == 'audio':
                         audios.append(
-                            librosa.load(
+                            load_waveform(
                                 ele['audio_url'],
                                 sr=self.processor.feature_extractor.sampling_rate,
                             )[0]
                         )
+        return audios
+
+    def postprocess(self, msg: dict, answer: str):
+        meta = msg['meta']
+        if 'asr' in meta['type']:
+            answer1 = re.findall(r"'([^']*)'", answer)
+            if answer1:
+                answer = answer1[0]
+        return answer
+
+    def generate_inner(self, msg: dict):
+        return self.generate_batch_inner([msg])[0]
+
+    def build_inputs(self, msgs: list[dict]):
+        prompts, texts, audios = [], [], []
+        for msg in msgs:
+            prompt, conversation = self.get_conversation(msg)
+            prompts.append(prompt)
+            texts.append(self.processor.apply_chat_template(
+                conversation, add_generation_prompt=True, tokenize=False
+            ))
+            audios.extend(self.load_audios(msg, conversation))
+
+        # left padding, so that generated tokens of all samples start at the same position
+        self.processor.tokenizer.padding_side = 'left'
         inputs = self.processor(
-            text=text,
+            text=texts,
             audios=audios,
             return_tensors='pt',
             padding=True,
             sampling_rate=self.processor.feature_extractor.sampling_rate,
         )
-        inputs = inputs.to('cuda')
-        generate_ids = self.model.generate(**inputs, max_new_tokens=256)
+        return prompts, inputs.to(self.model.device)
+
+    def answer_logits_inner(self, msgs: list[dict]):
+        prompts, inputs = self.build_inputs(msgs)
+        sr = self.processor.feature_extractor.sampling_rate
+        with audio_keys(self.model.audio_tower, [path for msg in msgs for path in msg['audio']], sr):
+            # the chat template ends with the assistant header, so the next token is the answer
+            logits = self.model(**inputs).logits[:, -1]
+        scores = score_yes_no(logits, *self.yes_no_ids)
+        return [(prompt, label, confidence) for prompt, (label, confidence) in zip(prompts, scores)]
+
+    def generate_batch_inner(self, msgs: list[dict]):
+        prompts, inputs = self.build_inputs(msgs)
+        answers = self._generate(inputs, msgs)
+        return [(prompt, self.postprocess(msg, answer)) for msg, prompt, answer in zip(msgs, prompts, answers)]
+
+    def generate_samples_inner(self, msgs: list[dict], n: int, seed: int):
+        prompts, inputs = self.build_inputs(msgs)
+        # one RNG stream for all samples, the audio is encoded once and expanded inside generate
+        torch.manual_seed(seed)
+        answers = self._generate(inputs, msgs, do_sample=True, num_return_sequences=n)
+        return [(prompt, [self.postprocess(msg, answer) for answer in answers[k * n:(k + 1) * n]])
+                for k, (msg, prompt) in enumerate(zip(msgs, prompts))]
+
+    def _generate(self, inputs, msgs, **generate_kwargs):
+        sr = self.processor.feature_extractor.sampling_rate
+        with audio_keys(self.model.audio_tower, [path for msg in msgs for path in msg['audio']], sr):
+            generate_ids = self.model.generate(**inputs, **dict(self.generation_config, **generate_kwargs))
         generate_ids = generate_ids[:, inputs.input_ids.size(1):]
-        answer = self.processor.batch_decode(
+        return self.processor.batch_decode(
             generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
-        meta = msg['meta']
-        if 'asr' in meta['type']:
-            answer1 = re.findall(r"'([^']*)'", answer)
-            if answer1:
-                answer = answer1[0]
-
-        return prompt, answer
+        )
 
 
 class QwenAudio(BaseModel):
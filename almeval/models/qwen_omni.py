@@ -1,3 +1,4 @@
+import json
 import random
 
 import torch
@@ -5,12 +6,16 @@ from qwen_omni_utils import process_mm_info
 from transformers import (Qwen2_5OmniForConditionalGeneration,
                           Qwen2_5OmniProcessor)
 
+from ..utils.audio_loader import load_waveform
 from ..utils.misc import print_once
+from .audio_tower import CachedAudioTower, audio_keys
 from .base import BaseModel
+from .yes_no import score_yes_no, yes_no_token_ids
 
 
 class Qwen2_5Omni(BaseModel):
     NAME = 'Qwen2.5-Omni-7B'
+    ANSWER_LOGITS = True
 
     def __init__(self, model_path='Qwen/Qwen2.5-Omni-7B', **kwargs):
         assert model_path is not None
@@ -21,6 +26,12 @@ class Qwen2_5Omni(BaseModel):
 
         self.model = Qwen2_5OmniForConditionalGeneration.from_pretrained(
             model_path, device_map='cuda').eval()
+        # https://github.com/QwenLM/Qwen2.5-Omni/issues/79
+        self.generation_config = {
+            'asr': dict(thinker_max_new_tokens=256, thinker_do_sample=False, repetition_penalty=1.0),
+            'default': dict(thinker_do_sample=False),
+        }
+        self.yes_no_ids = yes_no_token_ids(self.processor.tokenizer)
         random.seed(0)
         torch.cuda.empty_cache()
 
@@ -66,8 +77,23 @@ class Qwen2_5Omni(BaseModel):
             system_prompt = 'You are a helpful assistant.'
         return system_prompt
 
-    def generate_inner(self, msg: dict):
-        audio = msg['audio']
+    def get_cache_prompt(self, msg: dict) -> str:
+        # the system prompt depends on the dataset
+        return json.dumps([super().get_cache_prompt(msg), self.get_system_prompt(msg)], ensure_ascii=False)
+
+    def enable_embedding_cache(self, cache):
+        # the thinker packs all clips of a batch into one sequence
+        self.model.thinker.audio_tower = CachedAudioTower(
+            self.model.thinker.audio_tower, cache, namespace=self.NAME, packed=True)
+
+    def preprocess(self, msg: dict):
+        msg['audio_data'] = [load_waveform(path, sr=self.processor.feature_extractor.sampling_rate)[0]
+                             for path in msg['audio']]
+        return msg
+
+    def get_messages(self, msg: dict):
+        # decoded waveforms are passed to process_mm_info in place of paths
+        audio = msg['audio_data'] if 'audio_data' in msg else self.preprocess(msg)['audio_data']
         if len(audio) == 1:
             audio = audio[0]
 
@@ -120,14 +146,27 @@ class Qwen2_5Omni(BaseModel):
             raise NotImplementedError
         # only for dump
         prompt = system_prompt + '\n' + task_prompt
-        print_once(f'Prompt: {prompt}')
+        assert audio is not None
+        return prompt, messages
 
-        text = self.processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True)
+    def generate_inner(self, msg: dict):
+        return self.generate_batch_inner([msg])[0]
+
+    def build_inputs(self, msgs: list[dict]):
+        prompts, conversations = [], []
+        for msg in msgs:
+            prompt, messages = self.get_messages(msg)
+            prompts.append(prompt)
+            conversations.append(messages)
+        print_once(f'Prompt: {prompts[0]}')
+
+        text = [self.processor.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True) for messages in conversations]
         audios, images, videos = process_mm_info(
-            messages, use_audio_in_video=True)
-        assert audio is not None
+            conversations, use_audio_in_video=True)
 
+        # left padding, so that generated tokens of all samples start at the same position
+        self.processor.tokenizer.padding_side = 'left'
         inputs = self.processor(text=text,
                                 audio=audios,
                                 images=images,
@@ -135,19 +174,38 @@ class Qwen2_5Omni(BaseModel):
                                 return_tensors='pt',
                                 padding=True, use_audio_in_video=True)
 
-        inputs = inputs.to('cuda').to(self.model.dtype)
-
-        if msg['meta']['task'] == 'ASR':
-            # https://github.com/QwenLM/Qwen2.5-Omni/issues/79
+        return prompts, inputs.to(self.model.device).to(self.model.dtype)
+
+    def answer_logits_inner(self, msgs: list[dict]):
+        prompts, inputs = self.build_inputs(msgs)
+        sr = self.processor.feature_extractor.sampling_rate
+        with audio_keys(self.model.thinker.audio_tower, [path for msg in msgs for path in msg['audio']], sr):
+            # only the thinker produces text, the chat template ends with the assistant header
+            logits = self.model.thinker(**inputs, use_audio_in_video=True).logits[:, -1]
+        scores = score_yes_no(logits, *self.yes_no_ids)
+        return [(prompt, label, confidence) for prompt, (label, confidence) in zip(prompts, scores)]
+
+    def generate_batch_inner(self, msgs: list[dict]):
+        prompts, inputs = self.build_inputs(msgs)
+        return list(zip(prompts, self._generate(inputs, msgs)))
+
+    def generate_samples_inner(self, msgs: list[dict], n: int, seed: int):
+        prompts, inputs = self.build_inputs(msgs)
+        # one RNG stream for all samples, the audio is encoded once and expanded inside generate
+        torch.manual_seed(seed)
+        preds = self._generate(inputs, msgs, thinker_do_sample=True, thinker_num_return_sequences=n)
+        return [(prompt, preds[k * n:(k + 1) * n]) for k, prompt in enumerate(prompts)]
+
+    def _generate(self, inputs, msgs, **generate_kwargs):
+        # a batch comes from one dataset, so all samples share the same task
+        generation_config = self.generation_config['asr' if msgs[0]['meta']['task'] == 'ASR' else 'default']
+        generation_config = dict(generation_config, **generate_kwargs)
+        sr = self.processor.feature_extractor.sampling_rate
+        with audio_keys(self.model.thinker.audio_tower, [path for msg in msgs for path in msg['audio']], sr):
             generated_ids = self.model.generate(**inputs, use_audio_in_video=True, return_audio=False,
-                                                thinker_max_new_tokens=256, thinker_do_sample=False, repetition_penalty=1.0)
-
-        else:
-            generated_ids = self.model.generate(
-                **inputs, use_audio_in_video=True, return_audio=False, thinker_do_sample=False)
+                                                **generation_config)
 
         generated_ids = generated_ids[:, inputs.input_ids.size(1):]
-        pred = self.processor.batch_decode(
+        return self.processor.batch_decode(
             generated_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
-        return prompt, pred
+        )
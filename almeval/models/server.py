@@ -0,0 +1,219 @@
+import json
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+from ..utils.misc import NumpyEncoder
+from .base import BaseModel
+
+
+class ModelServer:
+    """Serve a loaded model over HTTP, so that repeated runs of run_audio.py skip model loading.
+
+    GET  /health                    status ('loading', 'warming', 'ready'), requests in flight and served
+    GET  /info                      name, version, cache config and capabilities of the model
+    POST /generate                  {"msg": msg} -> {"output": [prompt, response]}
+    POST /generate_batch            {"msgs": [...]} -> {"outputs": [[prompt, response], ...]}
+    POST /generate_samples          {"msgs": [...], "n": N, "seed": S} -> {"outputs": [[prompt, [responses]], ...]}
+    POST /answer_logits             {"msgs": [...]} -> {"outputs": [[prompt, label, confidence], ...]}
+    POST /cache_prompt              {"msg": msg} -> {"output": prompt used in inference cache keys}
+
+    Messages are the dicts datasets build, audio is passed by path, so the server has to see the same files.
+    At most `max_concurrency` model calls run at a time, further requests wait for a slot.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8000, max_concurrency: int = 1):
+        self.model = None
+        self.status = 'loading'
+        self.slots = threading.Semaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.served = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f'http://{host}:{self.httpd.server_address[1]}'
+
+    def start(self):
+        """Answer requests in a background thread, /health works while the model is still loading"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f'model server listening on {self.url}')
+
+    def set_model(self, model: BaseModel, warmup_msg: dict = None):
+        self.model = model
+        if warmup_msg is not None:
+            # the first call pays for CUDA kernels and lazy initialization, not the first client
+            self.status = 'warming'
+            start = time.perf_counter()
+            model.generate_batch([warmup_msg])
+            logger.info(f'warmup took {time.perf_counter() - start:.1f}s')
+        self.status = 'ready'
+        logger.info(f'model server ready, serving {model.NAME}')
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def info(self) -> dict:
+        return {
+            'name': self.model.NAME,
+            'version': self.model.VERSION,
+            'cache_config': self.model.get_cache_config(),
+            'answer_logits': self.model.ANSWER_LOGITS,
+            'sampling': self.model.is_sampling(),
+            'supports_samples': self.model.supports_samples(),
+            'max_duration': self.model.MAX_DURATION,
+            'min_duration': self.model.MIN_DURATION,
+        }
+
+    def call(self, method: str, request: dict):
+        model = self.model
+        if method == 'cache_prompt':
+            return model.get_cache_prompt(request['msg'])
+        # decode audio (through the waveform cache) outside the generation slots, as the runner's prefetch does
+        for msg in [request['msg']] if 'msg' in request else request['msgs']:
+            model.preprocess(msg)
+        with self.slots:
+            with self.lock:
+                self.in_flight += 1
+            try:
+                if method == 'generate':
+                    return model(request['msg'])
+                if method == 'generate_batch':
+                    return model.generate_batch(request['msgs'])
+                if method == 'generate_samples':
+                    return model.generate_samples(request['msgs'], request['n'], request['seed'])
+                if method == 'answer_logits':
+                    return model.answer_logits(request['msgs'])
+                raise KeyError(method)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    self.served += 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _reply(self, code: int, body: dict):
+                data = json.dumps(body, ensure_ascii=False, cls=NumpyEncoder).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._reply(200, {'status': server.status, 'in_flight': server.in_flight,
+                                      'served': server.served})
+                elif self.path == '/info' and server.status == 'ready':
+                    self._reply(200, server.info())
+                elif self.path == '/info':
+                    self._reply(503, {'error': f'model is {server.status}'})
+                else:
+                    self._reply(404, {'error': f'unknown path {self.path}'})
+
+            def do_POST(self):
+                method = self.path.strip('/')
+                if method not in ['generate', 'generate_batch', 'generate_samples', 'answer_logits', 'cache_prompt']:
+                    self._reply(404, {'error': f'unknown path {self.path}'})
+                    return
+                if server.status != 'ready':
+                    self._reply(503, {'error': f'model is {server.status}'})
+                    return
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                    output = server.call(method, request)
+                except Exception as e:
+                    logger.error(f'{method} failed: {traceback.format_exc()}')
+                    self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+                    return
+                if method in ['generate', 'cache_prompt']:
+                    self._reply(200, {'output': output})
+                else:
+                    self._reply(200, {'outputs': output})
+
+            def log_message(self, format, *args):
+                # one line per request would flood the log
+                pass
+
+        return Handler
+
+
+class RemoteModel(BaseModel):
+    """Client of a ModelServer, used by run_audio.py --server in place of a locally loaded model.
+    Audio is decoded and checked on the server, preprocessing and caches of the model run there too.
+    """
+
+    def __init__(self, url: str, timeout: float = 3600, wait: float = 600):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.wait_ready(wait)
+        info = self._request('GET', 'info')
+        self.NAME = info['name']
+        self.VERSION = info['version']
+        self.ANSWER_LOGITS = info['answer_logits']
+        self.SAMPLING = info['sampling']
+        self._supports_samples = info['supports_samples']
+        self.MAX_DURATION = info['max_duration']
+        self.MIN_DURATION = info['min_duration']
+        self.cache_config = info['cache_config']
+
+    def _request(self, method: str, path: str, body: dict = None, timeout: float = None):
+        data = json.dumps(body, ensure_ascii=False, cls=NumpyEncoder).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(f'{self.url}/{path}', data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f'model server {self.url}/{path}: {e.code} {e.read().decode("utf-8")}') from e
+
+    def wait_ready(self, wait: float):
+        """Block until the server has loaded and warmed up its model"""
+        deadline = time.time() + wait
+        status = None
+        while time.time() < deadline:
+            try:
+                status = self._request('GET', 'health', timeout=10)['status']
+            except (urllib.error.URLError, ConnectionError):
+                status = 'unreachable'
+            if status == 'ready':
+                return
+            time.sleep(2)
+        raise TimeoutError(f'model server {self.url} not ready after {wait}s, last status: {status}')
+
+    def get_cache_config(self) -> dict:
+        return self.cache_config
+
+    def supports_samples(self) -> bool:
+        return self._supports_samples
+
+    def get_cache_prompt(self, msg: dict) -> str:
+        return self._request('POST', 'cache_prompt', {'msg': msg})['output']
+
+    def enable_embedding_cache(self, cache):
+        logger.warning('caches of a served model are set up on the server, --embed-cache ignored')
+
+    def enable_prefix_cache(self, cache):
+        logger.warning('caches of a served model are set up on the server, --prefix-cache-gb ignored')
+
+    def __call__(self, msg: dict):
+        return tuple(self._request('POST', 'generate', {'msg': msg})['output'])
+
+    def generate_batch(self, msgs: list[dict]):
+        return [tuple(output) for output in self._request('POST', 'generate_batch', {'msgs': msgs})['outputs']]
+
+    def generate_samples(self, msgs: list[dict], n: int, seed: int):
+        outputs = self._request('POST', 'generate_samples', {'msgs': msgs, 'n': n, 'seed': seed})['outputs']
+        return [tuple(output) for output in outputs]
+
+    def answer_logits(self, msgs: list[dict]):
+        return [tuple(output) for output in self._request('POST', 'answer_logits', {'msgs': msgs})['outputs']]
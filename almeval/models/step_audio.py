@@ -3,6 +3,8 @@ import os
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+from ..utils.audio_archive import materialize
+from ..utils.audio_loader import load_waveform
 from ..utils.misc import print_once
 from .base import BaseModel
 from .stepaudio.tokenizer import StepAudioTokenizer
@@ -10,11 +12,19 @@ from .stepaudio.utils import load_audio, load_optimus_ths_lib
 from huggingface_hub import snapshot_download
 
 
+def step_decode_audio(path, sr):
+    # native sample rate and channels, the tokenizer resamples
+    audio_wav, sr = load_audio(materialize(path))
+    return audio_wav.numpy(), sr
+
+
 class StepAudio(BaseModel):
     NAME = 'StepAudio'
+    SAMPLING = True
 
     def __init__(self, model_path: str | None = None):
         super().__init__()
+        self.model_path = model_path
         # step-audio requires tokenizer & llm, if model_path is local path, try to find tokenizer & llm in the path
         # else, load from huggingface
         if model_path is not None:
@@ -84,7 +94,8 @@ class StepAudio(BaseModel):
 
     def encode_audio(self, audio: str | torch.Tensor, sr=None):
         if isinstance(audio, str):
-            audio_wav, sr = load_audio(audio)
+            audio_wav, sr = load_waveform(audio, decode=step_decode_audio)
+            audio_wav = torch.tensor(audio_wav)
         else:
             assert sr is not None
             audio_wav = audio
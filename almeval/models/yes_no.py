@@ -0,0 +1,38 @@
+import torch
+
+# surface forms of the two answers, the tokenizer decides which of them are single tokens
+YES_WORDS = ['yes', 'Yes', 'YES', '是']
+NO_WORDS = ['no', 'No', 'NO', '否']
+
+
+def _single_token_ids(tokenizer, words: list[str]) -> list[int]:
+    ids = set()
+    for word in words:
+        # with and without a leading space, base models usually continue a prompt with ' Yes'
+        for text in [word, ' ' + word]:
+            token_ids = tokenizer.encode(text, add_special_tokens=False)
+            if len(token_ids) == 1:
+                ids.add(token_ids[0])
+    return sorted(ids)
+
+
+def yes_no_token_ids(tokenizer) -> tuple[list[int], list[int]]:
+    """Ids of the single-token variants of "yes" and "no" (including 是/否) in the vocabulary of tokenizer"""
+    yes_ids = _single_token_ids(tokenizer, YES_WORDS)
+    no_ids = _single_token_ids(tokenizer, NO_WORDS)
+    assert len(yes_ids) > 0 and len(no_ids) > 0, 'tokenizer has no single-token yes/no'
+    assert not set(yes_ids) & set(no_ids)
+    return yes_ids, no_ids
+
+
+def score_yes_no(logits: torch.Tensor, yes_ids: list[int], no_ids: list[int]) -> list[tuple[str, float]]:
+    """Turn next-token logits (batch, vocab) into (label, confidence) per row.
+
+    The label is 'yes' or 'no', whichever variants hold more probability mass, the confidence is
+    that mass renormalized over both answers, so it is in [0.5, 1].
+    """
+    logits = logits.float()
+    # p_yes / (p_yes + p_no), in log space so that it stays finite when both masses are tiny
+    p_yes = torch.sigmoid(torch.logsumexp(logits[:, yes_ids], dim=-1) -
+                          torch.logsumexp(logits[:, no_ids], dim=-1)).tolist()
+    return [('yes', p) if p >= 0.5 else ('no', 1 - p) for p in p_yes]
@@ -0,0 +1,198 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+import os.path as osp
+import re
+import tempfile
+import threading
+
+ARCHIVE_SCHEME = 'archive://'
+_REF_PATTERN = re.compile(r'^archive://(?P<shard>.+)#(?P<offset>\d+)\+(?P<length>\d+)$')
+
+# shard file -> memory map, shared by all threads of this process
+_shard_maps = {}
+_shard_lock = threading.Lock()
+
+
+def is_archive_ref(path) -> bool:
+    return isinstance(path, str) and path.startswith(ARCHIVE_SCHEME)
+
+
+def archive_ref(shard: str, offset: int, length: int) -> str:
+    """Reference to the clip stored in `length` bytes at `offset` of the archive shard file"""
+    return f'{ARCHIVE_SCHEME}{shard}#{offset}+{length}'
+
+
+def parse_archive_ref(ref: str) -> tuple[str, int, int]:
+    """(shard, offset, length) of an archive:// reference"""
+    m = _REF_PATTERN.match(ref)
+    if m is None:
+        raise ValueError(f'invalid audio archive reference: {ref}')
+    return m.group('shard'), int(m.group('offset')), int(m.group('length'))
+
+
+def _shard_map(shard: str) -> mmap.mmap:
+    with _shard_lock:
+        mm = _shard_maps.get(shard)
+        if mm is None:
+            with open(shard, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _shard_maps[shard] = mm
+    return mm
+
+
+def read_audio_bytes(path: str) -> bytes | memoryview:
+    """Encoded bytes of a clip, a zero-copy view into the memory-mapped shard for archive references"""
+    if not is_archive_ref(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    shard, offset, length = parse_archive_ref(path)
+    mm = _shard_map(shard)
+    if offset + length > len(mm):
+        raise OSError(f'{path} is out of range of {shard} ({len(mm)} bytes)')
+    return memoryview(mm)[offset:offset + length]
+
+
+def open_audio(path: str):
+    """What to hand to soundfile/librosa: plain paths as they are, archive references as file objects"""
+    if is_archive_ref(path):
+        return io.BytesIO(read_audio_bytes(path))
+    return path
+
+
+def audio_stat(path: str) -> tuple[int, float]:
+    """(size, mtime) of a clip, the slice length and the shard mtime for archive references"""
+    if is_archive_ref(path):
+        shard, _, length = parse_archive_ref(path)
+        return length, os.stat(shard).st_mtime
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def audio_path_exists(path: str) -> bool:
+    if is_archive_ref(path):
+        try:
+            shard, offset, length = parse_archive_ref(path)
+            return offset + length <= os.stat(shard).st_size
+        except (ValueError, OSError):
+            return False
+    return osp.exists(path)
+
+
+def audio_md5(path: str) -> str:
+    """md5 of the encoded content of a clip"""
+    if is_archive_ref(path):
+        return hashlib.md5(read_audio_bytes(path)).hexdigest()
+    hash = hashlib.new('md5')
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def _audio_suffix(data) -> str:
+    head = bytes(data[:4])
+    if head == b'fLaC':
+        return '.flac'
+    if head == b'OggS':
+        return '.ogg'
+    if head[:3] == b'ID3' or head[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
+        return '.mp3'
+    return '.wav'
+
+
+def materialize(path: str, cache_dir: str = None) -> str:
+    """A real file path for a clip, for third-party loaders that only accept paths.
+    Archive references are extracted once into cache_dir (a temp directory by default), plain paths are returned as is.
+    """
+    if not is_archive_ref(path):
+        return path
+    shard, offset, length = parse_archive_ref(path)
+    cache_dir = cache_dir or osp.join(tempfile.gettempdir(), 'almeval_archive')
+    data = read_audio_bytes(path)
+    name = f'{osp.basename(shard)}_{offset}_{length}_{int(os.stat(shard).st_mtime)}{_audio_suffix(data)}'
+    file = osp.join(cache_dir, name)
+    if not osp.exists(file):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, file)
+    return file
+
+
+class ArchiveWriter:
+    """Pack encoded clips into a few large shard files `<prefix>-00000.bin`, ... in output_dir.
+
+    Clips are stored back to back as their original bytes (WAV, FLAC, ...), so headers still tell the
+    sample rate. A clip is stored once however often it is added. `<prefix>.index.jsonl` lists md5,
+    shard, offset and length of every clip, `add` returns the archive:// reference that goes into the
+    dataset jsonl in place of a file path. An existing archive is extended: its clips are not stored
+    again and new clips go to new shards.
+    """
+
+    def __init__(self, output_dir: str, prefix: str = 'audio', shard_size_mb: float = 1024):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.shard_size = int(shard_size_mb * 2**20)
+        os.makedirs(output_dir, exist_ok=True)
+        self.refs = {}
+        self.shard_id = -1
+        self.fout = None
+        index_file = osp.join(output_dir, f'{prefix}.index.jsonl')
+        if osp.exists(index_file):
+            with open(index_file, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # torn last line of an interrupted run
+                        continue
+                    self.refs[entry['md5']] = archive_ref(entry['shard'], entry['offset'], entry['length'])
+                    self.shard_id = max(self.shard_id, int(entry['shard'].rsplit('-', 1)[-1].split('.')[0]))
+        self.index = open(index_file, 'a', encoding='utf-8')
+        if self.index.tell() > 0:
+            with open(index_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.index.write('\n')
+
+    def _next_shard(self):
+        if self.fout is not None:
+            self.fout.close()
+        self.shard_id += 1
+        self.shard = osp.join(self.output_dir, f'{self.prefix}-{self.shard_id:05d}.bin')
+        self.fout = open(self.shard, 'wb')
+        self.offset = 0
+
+    def add(self, data: bytes, digest: str = None) -> str:
+        digest = digest or hashlib.md5(data).hexdigest()
+        if digest in self.refs:
+            return self.refs[digest]
+        if self.fout is None or (self.offset > 0 and self.offset + len(data) > self.shard_size):
+            self._next_shard()
+        self.fout.write(data)
+        ref = archive_ref(self.shard, self.offset, len(data))
+        self.index.write(json.dumps({'md5': digest, 'shard': self.shard, 'offset': self.offset,
+                                     'length': len(data)}) + '\n')
+        self.offset += len(data)
+        self.refs[digest] = ref
+        return ref
+
+    def flush(self):
+        if self.fout is not None:
+            self.fout.flush()
+        self.index.flush()
+
+    def close(self):
+        if self.fout is not None:
+            self.fout.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,150 @@
+import os
+import os.path as osp
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+
+from .audio_archive import open_audio
+from .audio_manifest import cached_audio_md5
+
+
+def decode_audio(path: str, sr: int | None = None) -> tuple[np.ndarray, int]:
+    """Decode a file or archive reference to a mono float32 waveform resampled to sr, the native sample rate if sr
+    is None"""
+    import librosa
+    waveform, sr = librosa.load(open_audio(path), sr=sr)
+    return waveform.astype(np.float32, copy=False), sr
+
+
+class WaveformCache:
+    """Decoded waveforms of audio clips, keyed by audio content hash, target sample rate and decoder.
+
+    Every waveform is stored in `cache_dir` as a .npy file and read back memory-mapped, so repeated
+    loads by later runs, other models and other ranks cost no decoding, resampling or copying. The
+    least recently used files are deleted once the directory grows over `max_disk_gb`. Other ranks write
+    to the same directory, so its size is measured on disk every `RESCAN_EVERY` writes, not only counted.
+    """
+
+    RESCAN_EVERY = 64
+
+    def __init__(self, cache_dir: str, max_disk_gb: float = 50):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_gb * 2**30)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+
+        # key -> (file, size), oldest access first
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self._scan_disk()
+        self.n_puts = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def _scan_disk(self):
+        # rebuild the index from the directory, with the files of all processes; reads touch the mtime
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, entry.name.split('.')[0], entry.path, stat.st_size))
+        entries.sort()
+        self.disk = OrderedDict((key, (file, size)) for _, key, file, size in entries)
+        self.disk_bytes = sum(size for _, _, _, size in entries)
+
+    @staticmethod
+    def key(path: str, sr: int | None, decoder: str) -> str:
+        return f'{decoder}_{cached_audio_md5(path)}_{sr or "native"}'
+
+    def get(self, key: str) -> tuple[np.ndarray, int] | None:
+        with self.lock:
+            if key not in self.disk:
+                self.misses += 1
+                return None
+            file, _ = self.disk[key]
+            self.disk.move_to_end(key)
+        try:
+            waveform = np.load(file, mmap_mode='r')
+            os.utime(file)
+        except (OSError, ValueError) as e:
+            # evicted by another process, or torn
+            logger.warning(f'failed to read waveform cache file {file}: {e}')
+            with self.lock:
+                self.disk.pop(key, None)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return waveform, int(file.split('.')[-2])
+
+    def put(self, key: str, waveform: np.ndarray, sr: int) -> np.ndarray:
+        """Store waveform and return its memory-mapped copy"""
+        file = osp.join(self.cache_dir, f'{key}.{sr}.npy')
+        # write to a temp file first, other ranks may read the cache at the same time
+        tmp_file = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.save(f, waveform)
+        os.replace(tmp_file, file)
+        with self.lock:
+            self.n_puts += 1
+            if self.n_puts % self.RESCAN_EVERY == 0:
+                self._scan_disk()
+            elif key not in self.disk:
+                self.disk[key] = (file, osp.getsize(file))
+                self.disk_bytes += self.disk[key][1]
+            self._evict_disk()
+        return np.load(file, mmap_mode='r')
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+            _, (file, size) = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            # readers keep their memory maps of a deleted file, another rank may have evicted it already
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total > 0 else 0.
+        return f'waveform cache: {self.hits} hits, {self.misses} misses, hit rate {rate:.1%}'
+
+
+_waveform_cache = None
+
+
+def set_waveform_cache(cache: WaveformCache | None):
+    """Share cache with every load_waveform call of this process, see --audio-cache"""
+    global _waveform_cache
+    _waveform_cache = cache
+
+
+def get_waveform_cache() -> WaveformCache | None:
+    return _waveform_cache
+
+
+def load_waveform(path: str, sr: int | None = None, decode=decode_audio) -> tuple[np.ndarray, int]:
+    """Drop-in replacement for librosa.load(path, sr=sr) used by the model wrappers.
+
+    With a waveform cache set, the result is a read-only memory map shared with other processes. Wrappers
+    that decode differently (e.g. keep channels, another resampler) pass their own decode(path, sr) function,
+    its name is part of the cache key.
+    """
+    cache = _waveform_cache
+    if cache is None:
+        return decode(path, sr)
+    key = cache.key(path, sr, decode.__name__)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    waveform, sr_out = decode(path, sr)
+    waveform = np.ascontiguousarray(waveform, dtype=np.float32)
+    return cache.put(key, waveform, sr_out), sr_out
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import os.path as osp
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from tqdm import tqdm
+
+from .audio_archive import audio_md5, audio_path_exists, audio_stat, open_audio
+
+MANIFEST_COLUMNS = ['path', 'duration', 'sample_rate', 'channels', 'size', 'mtime', 'md5']
+# where manifests of datasets on read-only mounts are kept
+MANIFEST_CACHE_DIR = osp.join(osp.expanduser('~'), '.cache', 'almeval', 'manifests')
+
+# durations of the clips of every manifest loaded in this process, so legality checks and existence
+# checks during inference are answered without opening the audio files again
+_known_durations = {}
+# path -> ((size, mtime), md5), content hashes from loaded manifests or computed on demand, they key the waveform,
+# embedding and inference caches
+_known_md5 = {}
+_known_lock = threading.Lock()
+# manifests already loaded and refreshed by load_audio_manifest, the runner asks for one several times per dataset
+_loaded_manifests = {}
+
+
+def get_audio_duration(path: str) -> float:
+    """Duration of an audio file or archive reference in seconds, read from the file header when possible"""
+    import librosa
+    return librosa.get_duration(path=open_audio(path))
+
+
+def cached_audio_duration(path: str) -> float:
+    """Duration of path from a loaded manifest, measured if no manifest has it. -1 if the clip cannot be read"""
+    duration = _known_durations.get(path)
+    if duration is None:
+        duration = get_audio_duration(path)
+    return duration
+
+
+def cached_audio_md5(path: str) -> str:
+    """md5 of the content of path, taken from a loaded manifest or hashed once per process, unless the file changed"""
+    stat = audio_stat(path)
+    cached = _known_md5.get(path)
+    if cached is None or cached[0] != stat:
+        cached = (stat, audio_md5(path))
+        with _known_lock:
+            _known_md5[path] = cached
+    return cached[1]
+
+
+def audio_exists(path: str) -> bool:
+    """os.path.exists, skipped for clips a loaded manifest has already read"""
+    duration = _known_durations.get(path)
+    if duration is not None:
+        return duration >= 0
+    return audio_path_exists(path)
+
+
+def get_sample_audio_paths(item: dict) -> list[str]:
+    audio_path = item['audio_path']
+    if isinstance(audio_path, list):
+        return audio_path
+    return [audio_path]
+
+
+def scan_audio(path: str) -> dict:
+    """Read the header of one clip, a clip that cannot be read gets duration -1"""
+    entry = {'path': path, 'duration': -1.0, 'sample_rate': -1, 'channels': -1, 'size': -1, 'mtime': -1.0, 'md5': None}
+    try:
+        size, mtime = audio_stat(path)
+        entry.update(size=size, mtime=mtime, md5=audio_md5(path))
+        try:
+            import soundfile
+            info = soundfile.info(open_audio(path))
+            entry.update(duration=info.duration, sample_rate=info.samplerate, channels=info.channels)
+        except Exception:
+            # formats libsndfile cannot read, e.g. mp3 with older versions
+            import librosa
+            entry.update(duration=get_audio_duration(path), sample_rate=librosa.get_samplerate(open_audio(path)))
+    except Exception as e:
+        logger.warning(f'failed to read audio {path}: {e}')
+        entry['duration'] = -1.0
+    return entry
+
+
+class AudioManifest:
+    """Cached metadata of the audio clips of one dataset: duration, sample rate, channels, size, mtime and content md5.
+
+    The manifest is a parquet file next to the dataset jsonl, or under ~/.cache/almeval/manifests when the
+    dataset directory is read-only. It is built once by a parallel scan of the file headers, extended when
+    new paths show up, and entries whose size or mtime changed on disk are scanned again. Clips that cannot
+    be read are recorded with a duration of -1. The md5 saves the caches keyed by audio content from hashing
+    every clip again in each process.
+    """
+
+    def __init__(self, manifest_file: str):
+        self.manifest_file = manifest_file
+        self.entries = {}
+        if osp.exists(manifest_file):
+            import pandas as pd
+            df = pd.read_parquet(manifest_file)
+            self.entries = {row['path']: row for row in df.to_dict('records')}
+        self.durations = {path: entry['duration'] for path, entry in self.entries.items()}
+
+    @classmethod
+    def for_dataset(cls, dataset):
+        return cls(manifest_file_of(dataset.dataset_file))
+
+    def stale_paths(self, paths: list[str]) -> list[str]:
+        """Paths that are not in the manifest, or changed on disk since they were scanned"""
+        stale = []
+        for path in sorted(set(paths)):
+            entry = self.entries.get(path)
+            if entry is None:
+                stale.append(path)
+                continue
+            try:
+                size, mtime = audio_stat(path)
+            except (OSError, ValueError):
+                # deleted, a clip that was readable before is stale
+                if entry['duration'] >= 0:
+                    stale.append(path)
+                continue
+            # manifests written before the md5 column was added are hashed once
+            if size != entry['size'] or mtime != entry['mtime'] or (entry['duration'] >= 0 and not entry.get('md5')):
+                stale.append(path)
+        return stale
+
+    def update(self, paths: list[str], save=True, workers: int = 16) -> int:
+        """Scan the paths that are missing or stale, in parallel, return how many were scanned"""
+        stale = self.stale_paths(paths)
+        if len(stale) > 0:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                entries = list(tqdm(pool.map(scan_audio, stale), total=len(stale), desc='Scanning audio'))
+            for entry in entries:
+                self.entries[entry['path']] = entry
+                self.durations[entry['path']] = entry['duration']
+            if save:
+                try:
+                    self.save()
+                except OSError as e:
+                    logger.warning(f'failed to save audio manifest {self.manifest_file}, kept in memory: {e}')
+        with _known_lock:
+            _known_durations.update(self.durations)
+            _known_md5.update({path: ((entry['size'], entry['mtime']), entry['md5'])
+                               for path, entry in self.entries.items() if entry.get('md5')})
+        return len(stale)
+
+    def save(self):
+        import pandas as pd
+        df = pd.DataFrame(list(self.entries.values()), columns=MANIFEST_COLUMNS)
+        # write to a temp file first, so other ranks never see a half-written manifest
+        tmp_file = f'{self.manifest_file}.{os.getpid()}.tmp'
+        df.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, self.manifest_file)
+
+    def sample_durations(self, items: list[dict]) -> list[float]:
+        """Total audio duration of each sample, unreadable clips count as 0"""
+        return [sum(max(self.durations[p], 0.) for p in get_sample_audio_paths(item))
+                for item in items]
+
+    def sample_legal(self, items: list[dict], min_duration: float, max_duration: float) -> list[bool]:
+        """Whether every clip of each sample is readable and within [min_duration, max_duration] seconds"""
+        return [all(min_duration <= self.durations[p] <= max_duration for p in get_sample_audio_paths(item))
+                for item in items]
+
+
+def manifest_file_of(dataset_file: str) -> str:
+    """<dataset>_manifest.parquet next to the dataset, in MANIFEST_CACHE_DIR if that directory is read-only"""
+    base = osp.splitext(dataset_file)[0]
+    if os.access(osp.dirname(osp.abspath(dataset_file)), os.W_OK):
+        return base + '_manifest.parquet'
+    digest = hashlib.md5(osp.abspath(dataset_file).encode('utf-8')).hexdigest()[:8]
+    os.makedirs(MANIFEST_CACHE_DIR, exist_ok=True)
+    return osp.join(MANIFEST_CACHE_DIR, f'{osp.basename(base)}_{digest}_manifest.parquet')
+
+
+def load_audio_manifest(dataset, rank=0, timeout=3600) -> AudioManifest:
+    """Load the manifest of dataset, rank 0 builds or refreshes it while other ranks wait for it"""
+    paths = [p for audio_path in dataset.column('audio_path')
+             for p in get_sample_audio_paths({'audio_path': audio_path})]
+    manifest_file = manifest_file_of(dataset.dataset_file)
+    manifest = _loaded_manifests.get(manifest_file)
+    if manifest is not None and all(p in manifest.entries for p in paths):
+        return manifest
+
+    if rank == 0:
+        manifest = AudioManifest(manifest_file)
+        scanned = manifest.update(paths)
+        if scanned:
+            logger.info(f'scanned {scanned} clips into audio manifest {manifest.manifest_file}')
+        _loaded_manifests[manifest_file] = manifest
+        return manifest
+
+    time_elapsed = 0
+    while True:
+        manifest = AudioManifest(manifest_file) if osp.exists(manifest_file) else None
+        if (manifest is not None and len(manifest.stale_paths(paths)) == 0) or time_elapsed >= timeout:
+            break
+        time.sleep(5)
+        time_elapsed += 5
+    manifest = manifest or AudioManifest(manifest_file)
+    # anything still missing is scanned locally, rank 0 owns the file
+    manifest.update(paths, save=False)
+    _loaded_manifests[manifest_file] = manifest
+    return manifest
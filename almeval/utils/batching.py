@@ -0,0 +1,46 @@
+from itertools import islice
+
+
+def bucket_batches(sample_indices, cost_of, batch_size: int, max_audio_seconds: float | None = None,
+                   window: int | None = None):
+    """Group samples of similar audio duration and prompt length into batches, to keep padding small.
+
+    Args:
+        sample_indices: iterable of sample indices, can be a lazy generator (e.g. a work queue).
+        cost_of: callable, sample index -> tuple starting with the audio seconds, e.g. (audio seconds, prompt length).
+            Samples are sorted by it.
+        batch_size: max number of samples per batch.
+        max_audio_seconds: max padded audio seconds per batch, i.e. batch length * longest clip.
+            A sample longer than that still gets a batch of its own.
+        window: number of samples sorted together. None sorts all of them at once,
+            use a window when sample_indices is a generator that should not be drained up front.
+
+    Yields:
+        list[int]: sample indices of one batch.
+    """
+    it = iter(sample_indices)
+    while True:
+        chunk = list(islice(it, window)) if window else list(it)
+        if len(chunk) == 0:
+            return
+        costs = {i: cost_of(i) for i in chunk}
+        chunk.sort(key=lambda i: costs[i])
+
+        batch = []
+        longest = 0.
+        for i in chunk:
+            seconds = costs[i][0]
+            if len(batch) > 0:
+                full = len(batch) >= batch_size
+                too_long = max_audio_seconds is not None and \
+                    (len(batch) + 1) * max(longest, seconds) > max_audio_seconds
+                if full or too_long:
+                    yield batch
+                    batch = []
+                    longest = 0.
+            batch.append(i)
+            longest = max(longest, seconds)
+        if len(batch) > 0:
+            yield batch
+        if not window:
+            return
@@ -0,0 +1,150 @@
+import sys
+import threading
+from collections.abc import Sequence
+
+import pyarrow as pa
+
+from .jsonl_rows import JsonlRows
+
+# string columns with fewer distinct values than this share of rows are dictionary-encoded (type, subset, audio_path)
+_DICTIONARY_RATIO = 0.5
+
+
+def _timestamp_free(schema: pa.Schema) -> bool:
+    return not any(pa.types.is_timestamp(field.type) or pa.types.is_date(field.type) for field in schema)
+
+
+def _exact_type(dtype: pa.DataType) -> bool:
+    # ints mixed with floats are read as doubles (1 -> 1.0), and a struct field missing from some rows as null
+    if pa.types.is_floating(dtype) or pa.types.is_struct(dtype) or pa.types.is_null(dtype):
+        return False
+    if pa.types.is_list(dtype) or pa.types.is_large_list(dtype):
+        return _exact_type(dtype.value_type)
+    return True
+
+
+def _round_trips(table: pa.Table) -> bool:
+    """Whether rows built from table equal the parsed JSON rows. A null stands for a missing key as well as a
+    JSON null, so any column with nulls does not round-trip either"""
+    return all(column.null_count == 0 and _exact_type(column.type) for column in table.columns)
+
+
+class ColumnarRows(Sequence):
+    """Read-only list of dataset rows stored column by column in an Arrow table.
+
+    Repeated strings (task types, audio paths) are dictionary-encoded and a column that duplicates another
+    one (e.g. audio_text == text) is stored once, so the full benchmark takes a fraction of the memory of
+    a list of dicts. Rows are materialized as new dicts when accessed. If the table does not give back the rows
+    exactly (keys missing from some rows, ints read as floats), rows are parsed from their lines in the file
+    instead, as JsonlRows does, so merged results match the dict path. `column` serves whole-column reads,
+    and `index_at`/`index_positions` answer index lookups from one interned string list instead of
+    materializing rows.
+    """
+
+    def __init__(self, table: pa.Table, aliases: dict = None, names: list[str] = None, rows: JsonlRows = None):
+        self.table = table
+        # rows read from the file when the table does not round-trip them
+        self.rows = rows
+        # column -> column it duplicates
+        self.aliases = aliases or {}
+        # keys of a row in their original order, aliases included
+        self.names = names or list(table.column_names) + list(self.aliases)
+        # one contiguous array per column, scalar reads from these are several times faster than slicing the table
+        self.arrays = {name: column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+                       for name, column in zip(table.column_names, table.columns)}
+        self.lock = threading.Lock()
+        self._index = None
+        self._positions = None
+
+    @classmethod
+    def from_jsonl(cls, file: str) -> 'ColumnarRows | None':
+        """Parse a JSONL file with the Arrow JSON reader. None if the rows do not fit a table, e.g. a field that
+        is a string in some rows and a list in others, or strings Arrow would turn into timestamps"""
+        import pyarrow.json as pj
+        try:
+            table = pj.read_json(file)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return None
+        if not _timestamp_free(table.schema):
+            return None
+        rows = cls.from_table(table)
+        if not _round_trips(table):
+            rows.rows = JsonlRows(file)
+        del table
+        # the parse buffers are freed by now, but the allocator keeps them unless asked
+        pa.default_memory_pool().release_unused()
+        return rows
+
+    @classmethod
+    def from_table(cls, table: pa.Table) -> 'ColumnarRows':
+        table = table.combine_chunks()
+        aliases = {}
+        columns, names = [], []
+        for name in table.column_names:
+            column = table.column(name)
+            duplicate = next((other for other in names if table.column(other).equals(column)), None)
+            if duplicate is not None:
+                aliases[name] = duplicate
+                continue
+            if pa.types.is_string(column.type) and len(column) > 0 and \
+                    len(column.unique()) < _DICTIONARY_RATIO * len(column):
+                column = column.dictionary_encode()
+            columns.append(column)
+            names.append(name)
+        return cls(pa.table(columns, names=names), aliases, table.column_names)
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def _with_aliases(self, row: dict) -> dict:
+        if not self.aliases:
+            return row
+        return {name: row[self.aliases.get(name, name)] for name in self.names}
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            table = self.table.slice(start, max(stop - start, 0)) if step == 1 else \
+                self.table.take(pa.array(range(start, stop, step), type=pa.int64()))
+            return ColumnarRows(table, self.aliases, self.names, None if self.rows is None else self.rows[idx])
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        if self.rows is not None:
+            return self.rows[idx]
+        arrays = self.arrays
+        return {name: arrays[self.aliases.get(name, name)][idx].as_py() for name in self.names}
+
+    def __iter__(self):
+        if self.rows is not None:
+            yield from self.rows
+            return
+        for batch in self.table.to_batches(max_chunksize=4096):
+            for row in batch.to_pylist():
+                yield self._with_aliases(row)
+
+    def column(self, name: str) -> list:
+        """All values of one column, without materializing rows"""
+        return self.table.column(self.aliases.get(name, name)).to_pylist()
+
+    def _indices(self) -> list[str]:
+        if self._index is None:
+            with self.lock:
+                if self._index is None:
+                    # composite ids like 40_10_3 are compared against journal and result records, intern them once
+                    self._index = [sys.intern(str(index)) for index in self.column('index')]
+        return self._index
+
+    def index_at(self, pos: int) -> str:
+        """str(row['index']) of the row at pos"""
+        return self._indices()[pos]
+
+    def index_positions(self) -> dict[str, int]:
+        """str(row['index']) -> position of the row"""
+        if self._positions is None:
+            self._positions = {index: pos for pos, index in enumerate(self._indices())}
+        return self._positions
+
+    def __repr__(self):
+        return f'ColumnarRows({len(self)} rows, {self.table.nbytes / 2**20:.1f} MB)'
@@ -0,0 +1,131 @@
+import os
+import os.path as osp
+import re
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from loguru import logger
+
+from .audio_manifest import cached_audio_md5
+
+# numpy has no bfloat16, such tensors are stored as their raw 16 bit pattern
+_VIEW_DTYPES = {torch.bfloat16: torch.int16}
+
+
+class EmbeddingCache:
+    """LRU cache of audio encoder outputs, keyed by audio content hash and sample rate.
+
+    Recent entries are kept in memory (on their original device). Every entry is also written
+    to `cache_dir` as a .npy file, so later runs and other ranks can reuse it; disk entries are
+    memory-mapped when read, and the least recently used ones are deleted once the directory
+    grows over `max_disk_gb`.
+    """
+
+    def __init__(self, cache_dir: str, max_memory_items: int = 64, max_disk_gb: float = 20):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = int(max_disk_gb * 2**30)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        # key -> (file, size), oldest access first
+        self.disk = OrderedDict()
+        files = [f for f in os.listdir(cache_dir) if f.endswith('.npy')]
+        files.sort(key=lambda f: osp.getmtime(osp.join(cache_dir, f)))
+        for f in files:
+            self.disk[f.split('.')[0]] = (osp.join(cache_dir, f), osp.getsize(osp.join(cache_dir, f)))
+        self.disk_bytes = sum(size for _, size in self.disk.values())
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def audio_key(self, path: str, sr: int, namespace: str = '') -> str:
+        """Key of the encoder output of the audio file at path resampled to sr, namespace tells encoders apart"""
+        namespace = re.sub(r'[^A-Za-z0-9_-]', '-', namespace)
+        return f'{namespace}_{cached_audio_md5(path)}_{sr}'
+
+    def get(self, key: str, device=None) -> torch.Tensor | None:
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+            if key not in self.disk:
+                self.misses += 1
+                return None
+            file, _ = self.disk[key]
+            self.disk.move_to_end(key)
+        try:
+            tensor = self._load(file, device)
+            os.utime(file)
+        except (OSError, ValueError) as e:
+            # deleted by another process, or torn
+            logger.warning(f'failed to read embedding cache file {file}: {e}')
+            with self.lock:
+                self.disk.pop(key, None)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.disk_hits += 1
+            self._put_memory(key, tensor)
+        return tensor
+
+    def put(self, key: str, tensor: torch.Tensor):
+        tensor = tensor.detach()
+        with self.lock:
+            self._put_memory(key, tensor)
+            if key in self.disk:
+                return
+        file = self._save(key, tensor)
+        with self.lock:
+            self.disk[key] = (file, osp.getsize(file))
+            self.disk_bytes += self.disk[key][1]
+            self._evict_disk()
+
+    def _put_memory(self, key, tensor):
+        self.memory[key] = tensor
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+            _, (file, size) = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            if osp.exists(file):
+                os.remove(file)
+
+    def _save(self, key, tensor):
+        dtype = str(tensor.dtype).replace('torch.', '')
+        tensor = tensor.cpu()
+        if tensor.dtype in _VIEW_DTYPES:
+            tensor = tensor.view(_VIEW_DTYPES[tensor.dtype])
+        file = osp.join(self.cache_dir, f'{key}.{dtype}.npy')
+        # write to a temp file first, other ranks may read the cache at the same time
+        tmp_file = f'{file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.save(f, tensor.numpy())
+        os.replace(tmp_file, file)
+        return file
+
+    @staticmethod
+    def _load(file, device):
+        dtype = getattr(torch, file.split('.')[-2])
+        with warnings.catch_warnings():
+            # the memory map is read-only, the tensor is copied right below
+            warnings.simplefilter('ignore')
+            tensor = torch.from_numpy(np.load(file, mmap_mode='r'))
+        if dtype in _VIEW_DTYPES:
+            tensor = tensor.view(dtype)
+        return tensor.to(device, copy=True) if device is not None else tensor.clone()
+
+    def stats(self) -> str:
+        total = self.hits + self.disk_hits + self.misses
+        rate = (self.hits + self.disk_hits) / total if total > 0 else 0.
+        return (f'embedding cache: {self.hits} memory hits, {self.disk_hits} disk hits, {self.misses} misses, '
+                f'hit rate {rate:.1%}')
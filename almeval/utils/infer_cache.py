@@ -0,0 +1,55 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from .audio_manifest import cached_audio_md5
+
+
+class InferenceCache:
+    """Model outputs kept in a SQLite file, shared by runs, datasets and ranks.
+
+    A result is keyed by a hash of everything that decides it: the model config (name, version,
+    weights, generation settings), the prompt the model builds, and the content hash of every
+    audio clip. A re-run, a reshuffled dataset or another benchmark that shares samples only
+    pays for the samples that are actually new.
+    """
+
+    def __init__(self, db_file: str, timeout: float = 600):
+        self.db_file = db_file
+        # prefetch threads compute keys while the main thread writes results
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout=timeout, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(key TEXT PRIMARY KEY, prompt TEXT, prediction TEXT, created REAL)')
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model_config: dict, prompt: str, audio_paths: list[str]) -> str:
+        content = {
+            'model': model_config,
+            'prompt': prompt,
+            'audio': [cached_audio_md5(path) for path in audio_paths],
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> tuple[str, str] | None:
+        """Return (prompt, prediction), or None if the key is not cached"""
+        with self.lock:
+            row = self.conn.execute('SELECT prompt, prediction FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0], row[1]
+
+    def put(self, key: str, prompt: str, prediction: str):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO results (key, prompt, prediction, created) VALUES (?, ?, ?, ?)',
+                              (key, prompt, prediction, time.time()))
+
+    def close(self):
+        self.conn.close()
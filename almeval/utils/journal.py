@@ -0,0 +1,92 @@
+import heapq
+import json
+import os
+import os.path as osp
+
+from loguru import logger
+
+from .misc import NumpyEncoder
+
+
+class PredictionJournal:
+    """Append-only journal of the predictions of one rank, one json record per line.
+
+    Each finished sample is appended and flushed right away, so killing the process
+    loses nothing. Records are fsync-ed every `fsync_every` appends (0: only on close).
+    A record torn by a crash is dropped the next time the journal is opened.
+
+    Every record holds at least `pos` (position in the dataset) and `index`.
+    """
+
+    def __init__(self, journal_file: str, fsync_every: int = 1):
+        self.journal_file = journal_file
+        self.fsync_every = fsync_every
+        self.n_appended = 0
+        self._repair()
+        self.file = open(journal_file, 'a', encoding='utf-8')
+
+    def _repair(self):
+        # cut a partial last line, otherwise the next record would be glued to it
+        if not osp.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                logger.warning(
+                    f'dropping {len(data) - end} bytes of a torn record at the end of {self.journal_file}')
+                f.truncate(end)
+
+    def append(self, record: dict):
+        self.file.write(json.dumps(record, ensure_ascii=False, cls=NumpyEncoder) + '\n')
+        self.file.flush()
+        self.n_appended += 1
+        if self.fsync_every > 0 and self.n_appended % self.fsync_every == 0:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    @staticmethod
+    def scan(journal_file: str):
+        """Yield the complete records of a journal"""
+        if not osp.exists(journal_file):
+            return
+        with open(journal_file, encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # torn by a crash
+                    break
+                yield json.loads(line)
+
+    @staticmethod
+    def compact(journal_file: str, position: dict[str, int] | None = None):
+        """Rewrite the journal with one record per index (the latest wins), sorted by dataset position.
+
+        Args:
+            position: maps index to its position in the current dataset, used to refresh `pos`
+                of records written by a previous run.
+        """
+        records = {}
+        for record in PredictionJournal.scan(journal_file):
+            if position is not None:
+                if record['index'] not in position:
+                    logger.warning(
+                        f'index {record["index"]} in {journal_file} is not in the dataset anymore, dropped')
+                    continue
+                record['pos'] = position[record['index']]
+            records[record['index']] = record
+        tmp_file = journal_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for record in sorted(records.values(), key=lambda r: r['pos']):
+                f.write(json.dumps(record, ensure_ascii=False, cls=NumpyEncoder) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, journal_file)
+
+
+def merge_journals(journal_files: list[str]):
+    """Stream the records of several compacted journals in dataset order"""
+    return heapq.merge(*[PredictionJournal.scan(f) for f in journal_files], key=lambda r: r['pos'])
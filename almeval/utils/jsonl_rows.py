@@ -0,0 +1,74 @@
+import json
+import threading
+from collections.abc import Sequence
+
+import numpy as np
+
+_CHUNK_SIZE = 16 * 2**20
+
+
+def build_row_offsets(file: str) -> np.ndarray:
+    """Byte offset of every non-empty line of file, found without parsing the JSON"""
+    starts, ends = [np.zeros(1, dtype=np.int64)], []
+    position = 0
+    with open(file, 'rb') as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n')).astype(np.int64) + position
+            ends.append(newlines)
+            starts.append(newlines + 1)
+            position += len(chunk)
+    starts = np.concatenate(starts)
+    # the last line may or may not end with a newline
+    ends = np.concatenate(ends + [np.array([position], dtype=np.int64)])
+    return starts[ends > starts]
+
+
+class JsonlRows(Sequence):
+    """Read-only list of the rows of a JSONL file, which keeps only the byte offset of each row in memory.
+
+    Rows are parsed when accessed, and every access returns a new dict. Iterating over all rows streams the
+    file, so it does not even need the offsets. Slices are JsonlRows over a subset of the rows.
+    """
+
+    def __init__(self, file: str, offsets: np.ndarray = None):
+        self.file = file
+        self.offsets = offsets
+        self.lock = threading.Lock()
+        self.f = None
+
+    def _offsets(self):
+        if self.offsets is None:
+            self.offsets = build_row_offsets(self.file)
+        return self.offsets
+
+    def __len__(self):
+        return len(self._offsets())
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return JsonlRows(self.file, self._offsets()[idx])
+        offset = self._offsets()[idx]
+        # prefetch threads read rows concurrently
+        with self.lock:
+            if self.f is None:
+                self.f = open(self.file, 'rb')
+            self.f.seek(offset)
+            line = self.f.readline()
+        return json.loads(line)
+
+    def __iter__(self):
+        if self.offsets is not None:
+            for k in range(len(self.offsets)):
+                yield self[k]
+            return
+        with open(self.file, 'rb') as f:
+            for line in f:
+                # empty lines are skipped, like in build_row_offsets
+                if line != b'\n':
+                    yield json.loads(line)
+
+    def __repr__(self):
+        return f'JsonlRows({self.file!r}, {"unindexed" if self.offsets is None else len(self.offsets)} rows)'
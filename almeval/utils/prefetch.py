@@ -0,0 +1,52 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_END = object()
+
+
+class Prefetcher:
+    """Apply fn to items in a thread pool, up to `depth` items ahead of the consumer.
+
+    Results are yielded in the order of items. Items are pulled from the source iterator
+    in the consumer's thread only, so the source does not need to be thread safe.
+    `wait_time` accumulates how long the consumer was blocked waiting for a result;
+    with depth=0, fn runs inline and all of its time counts as waiting.
+    """
+
+    def __init__(self, fn, items, depth: int = 2, workers: int = 1):
+        self.fn = fn
+        self.items = items
+        self.depth = depth
+        self.workers = workers
+        self.wait_time = 0.
+        self.n_items = 0
+
+    def __iter__(self):
+        it = iter(self.items)
+        if self.depth <= 0:
+            for item in it:
+                start = time.perf_counter()
+                result = self.fn(item)
+                self.wait_time += time.perf_counter() - start
+                self.n_items += 1
+                yield result
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for item in it:
+                pending.append(pool.submit(self.fn, item))
+                if len(pending) >= self.depth:
+                    break
+            while len(pending) > 0:
+                future = pending.popleft()
+                start = time.perf_counter()
+                result = future.result()
+                self.wait_time += time.perf_counter() - start
+                self.n_items += 1
+                # refill before handing the result out, so workers stay busy while the consumer runs
+                item = next(it, _END)
+                if item is not _END:
+                    pending.append(pool.submit(self.fn, item))
+                yield result
@@ -0,0 +1,55 @@
+import heapq
+
+
+def shard_by_count(sample_indices: list[int], world_size: int) -> list[list[int]]:
+    return [sample_indices[rank::world_size] for rank in range(world_size)]
+
+
+def shard_by_weight(sample_indices: list[int], weights: list[float], world_size: int) -> list[list[int]]:
+    """Pack samples into world_size bins of nearly equal total weight.
+
+    Longest-processing-time-first greedy: heaviest samples go first, each to the currently
+    lightest bin. Ties are broken by sample order, so every rank computes the same shards.
+    Each shard keeps the dataset order.
+    """
+    order = sorted(range(len(sample_indices)), key=lambda k: (-weights[k], k))
+    bins = [(0., rank) for rank in range(world_size)]
+    shards = [[] for _ in range(world_size)]
+    for k in order:
+        load, rank = heapq.heappop(bins)
+        shards[rank].append(k)
+        heapq.heappush(bins, (load + weights[k], rank))
+    return [[sample_indices[k] for k in sorted(shard)] for shard in shards]
+
+
+def group_by_key(sample_indices: list[int], key_of) -> list[list[int]]:
+    """Group samples sharing key_of(i), groups are in order of their first sample"""
+    groups = {}
+    for i in sample_indices:
+        groups.setdefault(key_of(i), []).append(i)
+    return list(groups.values())
+
+
+def shard_groups_by_weight(groups: list[list[int]], weights: list[float], world_size: int) -> list[list[int]]:
+    """Like shard_by_weight, but whole groups go to one shard and stay back to back in it"""
+    group_shards = shard_by_weight(list(range(len(groups))), weights, world_size)
+    return [[i for g in shard for i in groups[g]] for shard in group_shards]
+
+
+def reuse_rate(shards: list[list[int]], key_of) -> float:
+    """Fraction of samples whose key was already seen on the same shard, an upper bound of per-rank cache hits"""
+    n_reused = 0
+    for shard in shards:
+        n_reused += len(shard) - len(set(key_of(i) for i in shard))
+    n_samples = sum(len(shard) for shard in shards)
+    return n_reused / n_samples if n_samples > 0 else 0.
+
+
+def shard_loads(shards: list[list[int]], weight_of: dict[int, float]) -> list[float]:
+    return [sum(weight_of[i] for i in shard) for shard in shards]
+
+
+def imbalance(loads: list[float]) -> float:
+    """Slowest shard over the mean shard, 1.0 is a perfect balance"""
+    mean = sum(loads) / len(loads)
+    return max(loads) / mean if mean > 0 else 1.0
@@ -0,0 +1,118 @@
+import os
+import os.path as osp
+import sqlite3
+from contextlib import contextmanager
+
+from loguru import logger
+
+
+class WorkQueue:
+    """A queue of sample indices shared by all ranks through a SQLite file.
+
+    Ranks claim small chunks of pending samples until nothing is left, so a rank
+    that gets slow samples simply claims fewer chunks. A sample is only marked
+    done after its result has been persisted by the rank that claimed it; samples
+    claimed by a crashed rank are handed out again when that rank restarts.
+    """
+
+    PENDING = 0
+    CLAIMED = 1
+    DONE = 2
+
+    def __init__(self, db_file: str, rank: int, timeout: float = 600):
+        self.db_file = db_file
+        self.rank = rank
+        # isolation_level=None: we manage transactions ourselves with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(
+            db_file, timeout=timeout, isolation_level=None)
+        with self._transaction():
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS queue '
+                '(sample INTEGER PRIMARY KEY, status INTEGER NOT NULL, owner INTEGER)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    @contextmanager
+    def _transaction(self):
+        # take the write lock up front, so two ranks never claim the same samples
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def init(self, sample_indices: list[int], reset: bool = False) -> bool:
+        """Fill the queue with sample_indices, unless another rank (or a previous run) already did.
+
+        Samples this rank claimed in a previous run but never finished are released. With reset, the
+        queue of a previous run, done samples included, is dropped and filled again (--force-reinfer).
+
+        Returns:
+            bool: True if this call filled the queue.
+        """
+        with self._transaction():
+            if reset:
+                self.conn.execute('DELETE FROM queue')
+                self.conn.execute('DELETE FROM meta')
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'size'").fetchone()
+            if row is None:
+                self.conn.executemany(
+                    'INSERT INTO queue (sample, status, owner) VALUES (?, ?, NULL)',
+                    [(i, self.PENDING) for i in sample_indices])
+                self.conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('size', ?)", (str(len(sample_indices)),))
+                return True
+            if int(row[0]) != len(sample_indices):
+                raise ValueError(
+                    f'queue {self.db_file} holds {row[0]} samples, but dataset has {len(sample_indices)}, '
+                    'remove it or rerun with --force-reinfer if the dataset changed')
+            released = self.conn.execute(
+                'UPDATE queue SET status = ?, owner = NULL WHERE status = ? AND owner = ?',
+                (self.PENDING, self.CLAIMED, self.rank)).rowcount
+            if released:
+                logger.info(
+                    f'rank {self.rank} released {released} unfinished samples from a previous run')
+            return False
+
+    def claim(self, chunk_size: int) -> list[int]:
+        with self._transaction():
+            rows = self.conn.execute(
+                'SELECT sample FROM queue WHERE status = ? ORDER BY sample LIMIT ?',
+                (self.PENDING, chunk_size)).fetchall()
+            samples = [r[0] for r in rows]
+            self.conn.executemany(
+                'UPDATE queue SET status = ?, owner = ? WHERE sample = ?',
+                [(self.CLAIMED, self.rank, i) for i in samples])
+        return samples
+
+    def complete(self, samples: list[int]):
+        if len(samples) == 0:
+            return
+        with self._transaction():
+            self.conn.executemany(
+                'UPDATE queue SET status = ? WHERE sample = ?',
+                [(self.DONE, i) for i in samples])
+
+    def remaining(self) -> int:
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM queue WHERE status != ?', (self.DONE,)).fetchone()[0]
+
+    def iter_claims(self, chunk_size: int = 8):
+        """Yield sample indices chunk by chunk until the queue is drained"""
+        while True:
+            samples = self.claim(chunk_size)
+            if len(samples) == 0:
+                return
+            yield from samples
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def remove(db_file: str):
+        for f in [db_file, db_file + '-journal', db_file + '-wal', db_file + '-shm']:
+            if osp.exists(f):
+                os.remove(f)
@@ -0,0 +1,114 @@
+"""Memory and load time of the dataset row stores, on a dataset jsonl or a synthetic AHa-like one.
+
+    python benchmarks/dataset_memory.py --file /path/to/aha.jsonl
+    python benchmarks/dataset_memory.py --rows 200000
+
+Each store is loaded in a fresh interpreter: `list` (a list of dicts, the default), `rows` (JsonlRows, ROW_INDEX)
+and `columnar` (ColumnarRows, COLUMNAR). Reported are the load time, the RSS growth of the load (resident after
+loading and at the peak), and the time of the accesses the runner does: building the index -> position map, reading
+every audio path, and materializing 1000 random rows. `rows from` tells whether the columnar store builds rows from
+its table or, when the table does not round-trip them, parses them from the file.
+"""
+import argparse
+import json
+import os
+import os.path as osp
+import random
+import subprocess
+import sys
+import tempfile
+
+ROOT = osp.dirname(osp.dirname(osp.abspath(__file__)))
+STORES = ['list', 'rows', 'columnar']
+
+CHILD = '''
+import json, random, resource, sys, time
+import jsonlines
+import pyarrow.json
+from almeval.utils.columnar_rows import ColumnarRows
+from almeval.utils.jsonl_rows import JsonlRows
+
+store, file = sys.argv[1], sys.argv[2]
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+base = rss_mb()
+start = time.perf_counter()
+if store == 'list':
+    with jsonlines.open(file) as reader:
+        data = [line for line in reader]
+elif store == 'rows':
+    data = JsonlRows(file)
+    len(data)
+else:
+    data = ColumnarRows.from_jsonl(file)
+load = time.perf_counter() - start
+rss = rss_mb() - base
+
+start = time.perf_counter()
+if store == 'columnar':
+    positions = data.index_positions()
+    paths = data.column('audio_path')
+else:
+    positions = {str(item['index']): pos for pos, item in enumerate(data)}
+    paths = [item['audio_path'] for item in data]
+scan = time.perf_counter() - start
+
+random.seed(0)
+picks = [random.randrange(len(data)) for _ in range(1000)]
+start = time.perf_counter()
+rows = [data[i] for i in picks]
+access = time.perf_counter() - start
+print(json.dumps({'rows': len(data), 'load_s': load, 'rss_mb': rss, 'peak_rss_mb': peak_rss_mb() - base,
+                  'scan_s': scan, 'random_1000_s': access,
+                  'rows_from': 'file' if getattr(data, 'rows', None) is not None else 'table' if store == 'columnar'
+                  else '-'}))
+'''
+
+
+def make_dataset(file: str, n_rows: int):
+    """AHa-like rows: composite indices, a few hundred question types, many questions per clip"""
+    types = ['existence', 'temporal sequence', 'homophone_zh-zh', 'knowledge_en', 'asr_zh', 'polysemy_en']
+    random.seed(0)
+    with open(file, 'w', encoding='utf-8') as f:
+        for k in range(n_rows):
+            clip = k // 8
+            text = f'transcript of clip {clip} ' * 4
+            row = {'question_id': k, 'type': types[clip % len(types)], 'text': text, 'audio': '',
+                   'question': f'Is there a sound of {random.random()} in the audio? Answer yes or no.',
+                   'answer': random.choice(['yes', 'no']), 'label': random.choice(['en', 'zh']),
+                   'audio_path': f'kimi/dataset/aha_bench/{types[clip % len(types)]}/{clip}.wav',
+                   'index': f'{clip % 23 * 10}_{clip}_{k % 8 + 1}', 'audio_text': text}
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file', type=str, default=None, help='Dataset jsonl, a synthetic one if not set')
+    parser.add_argument('--rows', type=int, default=100000, help='Rows of the synthetic dataset')
+    parser.add_argument('--stores', nargs='+', default=STORES, choices=STORES)
+    args = parser.parse_args()
+
+    file = args.file
+    if file is None:
+        file = osp.join(tempfile.mkdtemp(), 'synthetic.jsonl')
+        make_dataset(file, args.rows)
+    print(f'{file}: {osp.getsize(file) / 2**20:.1f} MB')
+    print(f'{"store":<10} {"rows":>8} {"load s":>8} {"RSS MB":>8} {"peak MB":>8} {"scan s":>8} {"1000 rows s":>12} {"rows from":>10}')
+    for store in args.stores:
+        result = subprocess.run([sys.executable, '-c', CHILD, store, file], cwd=ROOT, capture_output=True, text=True,
+                                env=dict(os.environ, PYTHONPATH=ROOT))
+        if result.returncode != 0:
+            raise RuntimeError(f'{store} failed:\n{result.stderr[-2000:]}')
+        r = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f'{store:<10} {r["rows"]:>8} {r["load_s"]:>8.2f} {r["rss_mb"]:>8.1f} {r["peak_rss_mb"]:>8.1f} '
+              f'{r["scan_s"]:>8.2f} {r["random_1000_s"]:>12.3f} {r["rows_from"]:>10}')
+
+
+if __name__ == '__main__':
+    main()
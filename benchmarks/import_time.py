@@ -0,0 +1,97 @@
+"""Import time of the CLI entry points, measured with `python -X importtime`.
+
+    python benchmarks/import_time.py                 # compare with benchmarks/import_time_baseline.json
+    python benchmarks/import_time.py --update        # record a new baseline
+
+Each module is imported in a fresh interpreter `--repeat` times and the fastest run is kept. The heaviest
+imports below it are listed, so a regression (e.g. a wrapper imported eagerly again) shows where it comes from.
+Exits with 1 if an entry point got slower than the baseline by more than `--tolerance`.
+"""
+import argparse
+import json
+import os.path as osp
+import subprocess
+import sys
+
+ROOT = osp.dirname(osp.dirname(osp.abspath(__file__)))
+BASELINE = osp.join(ROOT, 'benchmarks', 'import_time_baseline.json')
+ENTRY_POINTS = ['run_audio', 'almeval.models', 'almeval.datasets', 'almeval.judge_models']
+
+
+def import_time(module: str) -> tuple[float, list[tuple[float, str]]]:
+    """Return the cumulative import time of module in seconds, and (seconds, name) of everything it imported"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr[-2000:]}')
+    total = None
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        seconds = int(cumulative) / 1e6
+        imports.append((seconds, name.rstrip()))
+        if name.strip() == module:
+            total = seconds
+    return total, imports
+
+
+def direct_imports(imports: list[tuple[float, str]], module: str) -> list[tuple[float, str]]:
+    """Imports done directly by module. -X importtime prints a module after everything it imports,
+    indented by two more spaces per level"""
+    def indent(name):
+        return len(name) - len(name.lstrip())
+
+    end = next(k for k, (_, name) in enumerate(imports) if name.strip() == module)
+    children = []
+    for seconds, name in reversed(imports[:end]):
+        if indent(name) <= indent(imports[end][1]):
+            break
+        if indent(name) == indent(imports[end][1]) + 2:
+            children.append((seconds, name.strip()))
+    return children
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=ENTRY_POINTS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10, help='Heaviest imports listed per module')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown over the baseline')
+    parser.add_argument('--update', action='store_true', help='Write the measured times as the new baseline')
+    args = parser.parse_args()
+
+    baseline = {}
+    if osp.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    measured = {}
+    regressions = []
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.repeat)]
+        total, imports = min(runs, key=lambda run: run[0])
+        measured[module] = round(total, 3)
+        line = f'{module}: {total:.3f}s'
+        if module in baseline.get('seconds', {}):
+            base = baseline['seconds'][module]
+            line += f' (baseline {base:.3f}s, {total / base - 1:+.0%})'
+            if total > base * (1 + args.tolerance):
+                regressions.append(module)
+        print(line)
+        for seconds, name in sorted(direct_imports(imports, module), reverse=True)[:args.top]:
+            print(f'    {seconds:7.3f}s  {name}')
+
+    if args.update:
+        with open(BASELINE, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'seconds': measured}, f, indent=4)
+        print(f'baseline written to {BASELINE}')
+    elif len(regressions) > 0:
+        print(f'slower than baseline by more than {args.tolerance:.0%}: {regressions}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
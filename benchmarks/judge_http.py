@@ -0,0 +1,146 @@
+"""Latency and throughput of judge requests with a pooled keep-alive session vs a new session per request.
+
+    python benchmarks/judge_http.py
+    python benchmarks/judge_http.py --requests 2000 --concurrency 32 --latency-ms 50
+
+A local stand-in for the chat completions API is started in a subprocess; it answers every request after
+`--latency-ms` and counts the TCP connections it accepted. `OpenAIWrapper.generate_inner` is called directly, so
+the retry loop and its random delays of `generate` are not measured. `per-request` opens a new session (and
+connection) for every request, as the wrapper did before, `pooled` uses the wrapper session. Over TLS the gap is
+larger, as every new connection also pays a handshake.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from almeval.judge_models.api import OpenAIWrapper  # noqa: E402
+
+MODES = ['per-request', 'pooled']
+
+SERVER = '''
+import asyncio, json, sys
+from aiohttp import web
+
+port, latency = int(sys.argv[1]), float(sys.argv[2])
+connections = set()
+
+async def chat(request):
+    connections.add(request.transport.get_extra_info('peername'))
+    await request.json()
+    await asyncio.sleep(latency)
+    return web.json_response({'choices': [{'message': {'content': 'Yes'}}]})
+
+async def stats(request):
+    return web.json_response({'connections': len(connections)})
+
+async def reset(request):
+    connections.clear()
+    return web.json_response({})
+
+app = web.Application()
+app.add_routes([web.post('/v1/chat/completions', chat), web.get('/stats', stats), web.get('/reset', reset)])
+web.run_app(app, host='127.0.0.1', port=port, print=None)
+'''
+
+
+class _OneShotSession:
+    """Stands in for the wrapper session: every post opens and closes its own ClientSession"""
+
+    def post(self, *args, **kwargs):
+        return _OneShotPost(args, kwargs)
+
+
+class _OneShotPost:
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession()
+        self.response = await self.session.post(*self.args, **self.kwargs)
+        return self.response
+
+    async def __aexit__(self, *exc):
+        self.response.release()
+        await self.session.close()
+
+
+class PerRequestWrapper(OpenAIWrapper):
+
+    def _get_session(self):
+        return _OneShotSession()
+
+
+def server_get(port: int, path: str) -> dict:
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}') as f:
+        return json.loads(f.read())
+
+
+async def run(judge_model, n_requests: int, concurrency: int) -> tuple[float, list[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    inputs = [dict(type='text', value='Question: Is there a dog barking?\nAnswer: yes\n')]
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            ret_code, answer, _ = await judge_model.generate_inner(inputs)
+            assert ret_code == 0 and answer == 'Yes', (ret_code, answer)
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        latencies = await asyncio.gather(*[one() for _ in range(n_requests)])
+    finally:
+        await judge_model.close()
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=20, help='Response time of the stand-in server')
+    parser.add_argument('--port', type=int, default=18631)
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, '-c', SERVER, str(args.port), str(args.latency_ms / 1000)])
+    try:
+        for _ in range(100):
+            try:
+                server_get(args.port, '/stats')
+                break
+            except OSError:
+                time.sleep(0.1)
+        api_base = f'http://127.0.0.1:{args.port}/v1/chat/completions'
+        print(f'{args.requests} requests, {args.concurrency} in flight, server latency {args.latency_ms:.0f} ms')
+        print(f'{"mode":<12} {"total s":>8} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"connections":>12}')
+        for mode in args.modes:
+            cls = PerRequestWrapper if mode == 'per-request' else OpenAIWrapper
+            judge_model = cls(model='gpt-4o-mini', key='benchmark', api_base=api_base)
+            server_get(args.port, '/reset')
+            total, latencies = asyncio.run(run(judge_model, args.requests, args.concurrency))
+            latencies = sorted(latencies)
+            p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+            n_connections = server_get(args.port, '/stats')['connections']
+            print(f'{mode:<12} {total:>8.2f} {args.requests / total:>8.1f} '
+                  f'{statistics.median(latencies) * 1000:>8.1f} {p99 * 1000:>8.1f} {n_connections:>12}')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
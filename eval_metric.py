@@ -3,13 +3,14 @@ from collections import defaultdict
 import jiwer
 import os
 
+from almeval.metrics.yes_no import HIGH, classify_yes_no
+
 def normalize(s):
-    s = s.strip().lower()
-    if 'yes' in s or '是' in s:
-        return 'yes'
-    if 'no' in s or '否' in s:
-        return 'no'
-    return s
+    # only plain yes/no answers are mapped, as in gpt_eval.py; a substring test read "unknown" and "I don't know" as no
+    label, confidence = classify_yes_no(s)
+    if confidence == HIGH:
+        return label
+    return s.strip().lower()
 
 def get_task_type(type_str):
     return type_str.split('_')[0]
@@ -56,7 +57,8 @@ for base_path, file_prefix in base_prefix_list:
             task_type = get_task_type(type_str)
             answer = normalize(item['answer'])
             prediction = item['prediction']
-            prediction_match = normalize(item['prediction_match'])
+            # samples scored with --answer-mode logits carry their label, no GPT matching needed
+            prediction_match = normalize(item['answer_label'] if 'answer_label' in item else item['prediction_match'])
             is_asr = 'asr' in type_str.lower()
             correct = False
 
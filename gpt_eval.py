@@ -1,8 +1,16 @@
-import requests
+import asyncio
+import contextlib
 import json
+import os
+import random
+from collections import Counter
 from tqdm import tqdm
 import argparse
-import os
+
+from almeval.judge_models import cached_judge_response, judge_response
+from almeval.judge_models.api import OpenAIWrapper
+from almeval.judge_models.cache import get_judge_cache
+from almeval.metrics.yes_no import HIGH, classify_yes_no
 
 prompt_template = (
     "You are an AI assistant who will help me to match an answer with two options of a question. "
@@ -15,53 +23,181 @@ prompt_template = (
     "Answer: {answer}\n"
 )
 
-def call_llm(question, answer, model_name):
-    payload = {
-        "model": model_name,
-        "messages": [
-            {"role": "user", "content": prompt_template.format(question=question, answer=answer)}
-        ]
-    }
-    headers = {'Content-Type': 'application/json'}
-    response = requests.post(url, data=json.dumps(payload), headers=headers)
-    response.raise_for_status()
-    content = response.json()['data']['choices'][0]['message']['content'].strip()
-    return content
-
-def process_jsonl_line(json_obj, model_name):
+
+async def call_llm(question, answer, judge_model, max_attempts, backoff, max_backoff):
+    """Judge one answer, retrying failed requests with exponential backoff. None after max_attempts failures"""
+    prompt = prompt_template.format(question=question, answer=answer)
+    for attempt in range(max_attempts):
+        content = await judge_response(prompt, judge_model=judge_model)
+        if content is not None and content != '' and judge_model.fail_msg not in content:
+            return content
+        # full jitter, so the requests failing together do not retry together
+        await asyncio.sleep(random.uniform(0, min(max_backoff, backoff * 2 ** attempt)))
+    return None
+
+
+async def process_jsonl_line(json_obj, judge_model, semaphore, stats, args):
+    if 'answer_label' in json_obj:
+        # scored with --answer-mode logits, the label is already Yes / No
+        stats['label'] += 1
+        return json_obj['answer_label'].capitalize()
     question = json_obj.get('question', '')
     prediction = json_obj.get('prediction', '')
-    prediction_result = call_llm(question, prediction, model_name)
-    return prediction_result
-
-def main(input_file, output_file, model_name):
-    with open(input_file, 'r', encoding='utf-8') as infile, \
-         open(output_file, 'w', encoding='utf-8') as outfile:
-        for line in tqdm(infile, desc="Processing JSONL lines"):
-            line = line.strip()
-            if not line:
-                continue
-            while True:
+    if not args.no_rules:
+        # plain answers like "Yes." or "不是" are decided locally, only the rest goes to the judge model
+        label, confidence = classify_yes_no(prediction)
+        if confidence == HIGH:
+            stats['rules'] += 1
+            judged = cached_judge_response(prompt_template.format(question=question, answer=prediction), judge_model)
+            if judged is not None:
+                stats['rules_compared'] += 1
+                stats['rules_agree'] += classify_yes_no(judged).label == label
+            return label.capitalize()
+    stats['judge'] += 1
+    async with semaphore:
+        return await call_llm(question, prediction, judge_model, args.max_attempts, args.backoff, args.max_backoff)
+
+
+def count_done(input_lines, output_file):
+    """Number of leading input lines already judged in output_file, which is written in input order"""
+    if not os.path.exists(output_file):
+        return 0
+    done = 0
+    size = 0
+    with open(output_file, 'r', encoding='utf-8') as outfile:
+        for line in outfile:
+            try:
+                json_obj = json.loads(line)
+            except json.JSONDecodeError:
+                # torn last line of an interrupted run
+                break
+            if done >= len(input_lines) or 'prediction_match' not in json_obj or \
+                    json_obj.get('index') != json.loads(input_lines[done]).get('index'):
+                raise ValueError(f'{output_file} does not match the input at line {done + 1}, '
+                                 'remove it to judge from scratch')
+            done += 1
+            size += len(line.encode('utf-8'))
+    # drop a torn last line
+    with open(output_file, 'r+b') as outfile:
+        outfile.truncate(size)
+    return done
+
+
+def load_partial(partial_file):
+    """Results judged out of order by an interrupted run, line number -> output object"""
+    results = {}
+    if os.path.exists(partial_file):
+        with open(partial_file, 'r', encoding='utf-8') as f:
+            for line in f:
                 try:
-                    json_obj = json.loads(line)
-                    prediction_result = process_jsonl_line(json_obj, model_name)
-                    json_obj['prediction_match'] = prediction_result
-                    outfile.write(json.dumps(json_obj, ensure_ascii=False) + '\n')
-                    break  
-                except Exception as e:
-                    print(f"Error processing line: {e}，retrying...")
+                    record = json.loads(line)
+                except json.JSONDecodeError:
                     continue
+                results[record['line']] = record['output']
+    return results
+
+
+async def main(input_file, output_file, judge_model, semaphore, stats, args, position=0):
+    with open(input_file, 'r', encoding='utf-8') as infile:
+        input_lines = [line.strip() for line in infile if line.strip()]
+
+    # resume: lines already in the output file are skipped, results finished out of order are kept in a sidecar
+    n_done = count_done(input_lines, output_file)
+    partial_file = f'{output_file}.partial'
+    finished = {k: v for k, v in load_partial(partial_file).items() if k >= n_done}
+
+    pbar = tqdm(total=len(input_lines), initial=n_done, desc=os.path.basename(input_file), position=position)
+    with open(output_file, 'a', encoding='utf-8') as outfile, open(partial_file, 'a', encoding='utf-8') as partial:
+        next_line = n_done
+
+        def flush():
+            # results are written in input order, a result whose predecessors are not done yet waits in finished
+            nonlocal next_line
+            while next_line in finished:
+                outfile.write(json.dumps(finished.pop(next_line), ensure_ascii=False) + '\n')
+                next_line += 1
+            outfile.flush()
+
+        async def judge_line(k):
+            json_obj = json.loads(input_lines[k])
+            prediction_result = await process_jsonl_line(json_obj, judge_model, semaphore, stats, args)
+            pbar.update(1)
+            if prediction_result is None:
+                return False
+            json_obj['prediction_match'] = prediction_result
+            finished[k] = json_obj
+            if k != next_line:
+                partial.write(json.dumps({'line': k, 'output': json_obj}, ensure_ascii=False) + '\n')
+                partial.flush()
+            flush()
+            return True
+
+        flush()
+        pending = [k for k in range(n_done, len(input_lines)) if k not in finished]
+        pbar.update(len(input_lines) - n_done - len(pending))
+        results = await asyncio.gather(*[judge_line(k) for k in pending])
+    pbar.close()
+
+    n_failed = sum(not ok for ok in results)
+    if n_failed == 0:
+        os.remove(partial_file)
+    else:
+        print(f'{input_file}: {n_failed} lines failed after {args.max_attempts} attempts, '
+              f'{next_line} of {len(input_lines)} lines written, rerun to resume')
+    return n_failed
+
+
+async def main_all(args):
+    judge_model = OpenAIWrapper(model=args.model_name, api_base=args.api_base, rpm=args.rpm, tpm=args.tpm,
+                                # call_llm retries with backoff, each attempt is a single request
+                                retry=1, wait=0)
+    # one limit for all files, so judging more repeats at once does not multiply the request rate
+    semaphore = asyncio.Semaphore(args.concurrency)
+    stats = Counter()
+    jobs = [main(f"{args.input_file}_{num}.jsonl", f"{args.output_file}_{num}.jsonl", judge_model, semaphore, stats,
+                 args, position=k)
+            for k, num in enumerate(args.num)]
+    judge_cache = get_judge_cache()
+    cache_counts = None
+    try:
+        with judge_cache.track() if judge_cache is not None else contextlib.nullcontext() as cache_counts:
+            return sum(await asyncio.gather(*jobs))
+    finally:
+        await judge_model.close()
+        n_lines = stats['label'] + stats['rules'] + stats['judge']
+        if n_lines > 0:
+            print(f'{n_lines} lines judged: {stats["label"]} by answer_label, '
+                  f'{stats["rules"]} by rules ({stats["rules"] / n_lines:.1%}), {stats["judge"]} by {args.model_name}')
+        print(f'rate limiter: {judge_model.rate_limiter.summary()}')
+        if stats['rules_compared'] > 0:
+            print(f'rules agree with the cached {args.model_name} judgement on '
+                  f'{stats["rules_agree"]}/{stats["rules_compared"]} lines '
+                  f'({stats["rules_agree"] / stats["rules_compared"]:.1%})')
+        if cache_counts is not None:
+            print(f'judge cache {judge_cache.db_file}: {cache_counts["hits"]} hits, {cache_counts["misses"]} misses')
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Process JSONL with LLM model")
     parser.add_argument('--input_file', type=str, required=True, help='输入文件路径前缀')
     parser.add_argument('--output_file', type=str, required=True, help='输出文件路径前缀')
-    parser.add_argument('--num', type=str, required=True, help='编号')
+    parser.add_argument('--num', type=str, nargs='+', required=True, help='编号, several numbers are judged concurrently')
     parser.add_argument('--model_name', type=str, required=True, help='模型名称')
+    parser.add_argument('--api_base', type=str, default=None,
+                        help='Chat completions endpoint, defaults to $OPENAI_API_BASE or the official OpenAI API')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Max judge requests in flight, the rate limiter adapts the actual number below it')
+    parser.add_argument('--max_attempts', type=int, default=8, help='Attempts per line before giving up')
+    parser.add_argument('--backoff', type=float, default=1.0, help='Base delay in seconds of the exponential backoff')
+    parser.add_argument('--max_backoff', type=float, default=60.0, help='Max delay in seconds between attempts')
+    parser.add_argument('--rpm', type=float, default=None,
+                        help='Requests per minute the API key allows (default: $ALMEVAL_JUDGE_RPM, unlimited)')
+    parser.add_argument('--tpm', type=float, default=None,
+                        help='Tokens per minute the API key allows (default: $ALMEVAL_JUDGE_TPM, unlimited)')
+    parser.add_argument('--no_rules', action='store_true',
+                        help='Send every line to the judge model, including plain yes/no answers')
     args = parser.parse_args()
 
-    input_file = f"{args.input_file}_{args.num}.jsonl"
-    output_file = f"{args.output_file}_{args.num}.jsonl"
-    model_name = args.model_name
-
-    main(input_file, output_file, model_name)
+    n_failed = asyncio.run(main_all(args))
+    if n_failed > 0:
+        raise SystemExit(1)
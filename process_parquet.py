@@ -1,7 +1,12 @@
+import argparse
 import os
 import json
 import hashlib
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow.parquet as pq
+
+from almeval.utils.audio_archive import ArchiveWriter
 
 
 type2id = {
@@ -29,70 +34,239 @@ type2id = {
     'asr_zh': 210,
     'asr_en': 220
 }
-# parquet path
-file_path = ""
-df = pd.read_parquet(file_path)
 
 audio_col = 'audio'
 type_col = 'type'
 qid_col = 'question_id'
 
-output_dir = 'kimi/dataset/aha_bench'
-os.makedirs(output_dir, exist_ok=True)
 
-results = []
+def hash_audio(wav_bytes):
+    return hashlib.md5(wav_bytes).hexdigest()
+
+
+def write_audio(wav_path, wav_bytes):
+    # idempotent: a clip written by an earlier run is kept, unless a changed parquet gave its name to another clip
+    if os.path.exists(wav_path) and os.path.getsize(wav_path) == len(wav_bytes):
+        with open(wav_path, 'rb') as f:
+            if f.read() == wav_bytes:
+                return
+    tmp_path = f'{wav_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(wav_bytes)
+    os.replace(tmp_path, wav_path)
+
+
+def parquet_fingerprint(parquet_path):
+    """Identity of the parquet file, a run on a different or changed file ingests it again from the start"""
+    stat = os.stat(parquet_path)
+    metadata = pq.ParquetFile(parquet_path).metadata
+    return {'path': os.path.abspath(parquet_path), 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'num_rows': metadata.num_rows, 'num_row_groups': metadata.num_row_groups}
+
+
+def new_state():
+    return {
+        'fingerprint': None,  # parquet_fingerprint of the ingested file
+        'rows_done': 0,  # parquet rows of finished batches, a re-run resumes after them
+        'jsonl_size': 0,  # bytes of the jsonl written by finished batches
+        'clips_size': 0,  # bytes of the clip list written by finished batches
+    }
+
+
+def load_state(state_path):
+    """Progress of earlier runs"""
+    if not os.path.exists(state_path):
+        return new_state()
+    with open(state_path, encoding='utf-8') as f:
+        state = json.load(f)
+    # states of older runs list the ingested rows instead
+    state.setdefault('rows_done', len(state.pop('done', [])))
+    state.setdefault('fingerprint', None)
+    state.setdefault('clips_size', 0)
+    return state
+
+
+def save_state(state, state_path):
+    tmp_path = f'{state_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, state_path)
+
+
+def truncate(path, size):
+    # drop what a batch interrupted before its state was saved wrote, it is processed again
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+def write_clips(clips, clips_file):
+    for cur_type, md5, type_audio_id, wav_path in clips:
+        clips_file.write(json.dumps({'type': cur_type, 'md5': md5, 'id': type_audio_id, 'audio_path': wav_path},
+                                    ensure_ascii=False) + '\n')
+
+
+def load_naming(state, clips_path, jsonl_path):
+    """Naming tables of earlier runs, so a re-run numbers new clips and questions after the existing ones.
+
+    Clips are appended to `clips_path` as they are named, the question count of every clip is read back from the
+    indices in the jsonl.
+    """
+    naming = {
+        'type_audio_hash_dict': {},  # {type: {md5: (type_audio_id, wav_path)}}
+        'type_audio_id_counter': {},  # {type: 当前type下音频编号}
+        'type_audio_id_to_count': {},  # {type: {type_audio_id: 当前音频下的顺序号}}
+    }
+    if 'type_audio_hash_dict' in state:
+        # states of older runs hold the tables themselves, move the clips to the clip list
+        clips = [(cur_type, md5, type_audio_id, wav_path)
+                 for cur_type, hashes in state.pop('type_audio_hash_dict').items()
+                 for md5, (type_audio_id, wav_path) in hashes.items()]
+        state.pop('type_audio_id_counter', None)
+        state.pop('type_audio_id_to_count', None)
+        with open(clips_path, 'w', encoding='utf-8') as f:
+            write_clips(clips, f)
+            state['clips_size'] = f.tell()
+
+    if os.path.exists(clips_path):
+        with open(clips_path, encoding='utf-8') as f:
+            for line in f:
+                clip = json.loads(line)
+                naming['type_audio_hash_dict'].setdefault(clip['type'], {})[clip['md5']] = \
+                    (clip['id'], clip['audio_path'])
+                naming['type_audio_id_counter'][clip['type']] = \
+                    naming['type_audio_id_counter'].get(clip['type'], 0) + 1
+    for cur_type in naming['type_audio_hash_dict']:
+        naming['type_audio_id_to_count'][cur_type] = {}
+    if os.path.exists(jsonl_path):
+        with open(jsonl_path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                # index is <type id>_<type_audio_id>_<顺序号>
+                _, type_audio_id, count = record['index'].rsplit('_', 2)
+                audio_id_to_count = naming['type_audio_id_to_count'][str(record[type_col])]
+                audio_id_to_count[int(type_audio_id)] = max(audio_id_to_count.get(int(type_audio_id), 0), int(count))
+    return naming
+
+
+def process_batch(rows, naming, args, pool, archive):
+    """Name the clips and questions of one record batch, write new clips, return the jsonl records and the new clips"""
+    type_audio_hash_dict = naming['type_audio_hash_dict']
+    type_audio_id_counter = naming['type_audio_id_counter']
+    type_audio_id_to_count = naming['type_audio_id_to_count']
 
-type_audio_hash_dict = {}  # {type: {md5: (type_audio_id, wav_path)}}
-type_audio_id_counter = {} # {type: 当前type下音频编号}
-type_audio_id_to_count = {} # {type: {type_audio_id: 当前音频下的顺序号}}
+    blobs = [row[audio_col]['bytes'] for row in rows]
+    # threads: hashlib and file writes release the GIL, and the blobs are not copied to other processes
+    md5s = list(pool.map(hash_audio, blobs))
 
+    results = []
+    clips = []
+    writes = []
+    for row, wav_bytes, md5 in zip(rows, blobs, md5s):
+        cur_type = str(row[type_col])
 
-for idx, row in df.iterrows():
-    audio_data = row[audio_col]
-    cur_type = str(row[type_col])
-    
+        # 初始化
+        if cur_type not in type_audio_hash_dict:
+            type_audio_hash_dict[cur_type] = {}
+            type_audio_id_counter[cur_type] = 0
+            type_audio_id_to_count[cur_type] = {}
 
-    wav_bytes = audio_data['bytes']
-    md5 = hashlib.md5(wav_bytes).hexdigest()
+        audio_hash_dict = type_audio_hash_dict[cur_type]
+        audio_id_to_count = type_audio_id_to_count[cur_type]
 
-    # 初始化
-    if cur_type not in type_audio_hash_dict:
+        if md5 not in audio_hash_dict:
+            type_audio_id = type_audio_id_counter[cur_type]
+            type_audio_id_counter[cur_type] += 1
+            if archive is not None:
+                wav_path = archive.add(wav_bytes, md5)
+            else:
+                save_dir = os.path.join(args.output_dir, cur_type)
+                os.makedirs(save_dir, exist_ok=True)
+                wav_path = os.path.join(save_dir, f"{type_audio_id}.wav")
+                writes.append((wav_path, wav_bytes))
+            audio_hash_dict[md5] = (type_audio_id, wav_path)
+            clips.append((cur_type, md5, type_audio_id, wav_path))
+            audio_id_to_count[type_audio_id] = 1
+        else:
+            type_audio_id, wav_path = audio_hash_dict[md5]
+            audio_id_to_count[type_audio_id] += 1
 
-        type_audio_hash_dict[cur_type] = {}
-        type_audio_id_counter[cur_type] = 0
-        type_audio_id_to_count[cur_type] = {}
+        cur_audio_count = audio_id_to_count[type_audio_id]
+        new_qid = f"{type_audio_id}_{cur_audio_count}"
 
-    audio_hash_dict = type_audio_hash_dict[cur_type]
-    audio_id_counter = type_audio_id_counter[cur_type]
-    audio_id_to_count = type_audio_id_to_count[cur_type]
+        record = dict(row)
+        record['audio'] = ''
+        record["audio_path"] = wav_path
+        record["index"] = f"{type2id[cur_type]}_{new_qid}"
+        record["audio_text"] = row['text']
+        results.append(record)
 
-    if md5 not in audio_hash_dict:
-        type_audio_id = audio_id_counter
-        type_audio_id_counter[cur_type] += 1
-        save_dir = os.path.join(output_dir, cur_type)
-        os.makedirs(save_dir, exist_ok=True)
-        wav_path = os.path.join(save_dir, f"{type_audio_id}.wav")
-        with open(wav_path, 'wb') as f:
-            f.write(wav_bytes)
-        audio_hash_dict[md5] = (type_audio_id, wav_path)
-        audio_id_to_count[type_audio_id] = 1
-    else:
-        type_audio_id, wav_path = audio_hash_dict[md5]
-        audio_id_to_count[type_audio_id] += 1
+    if len(writes) > 0:
+        list(pool.map(write_audio, *zip(*writes)))
+    return results, clips
 
-    cur_audio_count = audio_id_to_count[type_audio_id]
-    new_qid = f"{type_audio_id}_{cur_audio_count}"
 
-    record = row.to_dict()
-    record['audio'] = ''
-    record["audio_path"] = wav_path
-    record["index"] = f"{type2id[cur_type]}_{new_qid}"
-    record["audio_text"] = row['text']
-    results.append(record)
+def main(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    state_path = args.state or f'{args.jsonl}.ingest.json'
+    clips_path = f'{state_path}.clips.jsonl'
+    state = load_state(state_path)
+    fingerprint = parquet_fingerprint(args.parquet)
+    if state['fingerprint'] is not None and state['fingerprint'] != fingerprint:
+        print(f'{args.parquet} is not the parquet of the last run, ingesting it from the start')
+        state = new_state()
+    state['fingerprint'] = fingerprint
+    truncate(args.jsonl, state['jsonl_size'])
+    truncate(clips_path, state['clips_size'])
+    naming = load_naming(state, clips_path, args.jsonl)
+    save_state(state, state_path)
+    archive = ArchiveWriter(args.output_dir, prefix='aha_bench', shard_size_mb=args.shard_size_mb) \
+        if args.format == 'archive' else None
 
+    # stream record batches, only one batch of audio blobs is in memory at a time
+    parquet_file = pq.ParquetFile(args.parquet)
+    n_new = 0
+    row_offset = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool, \
+            open(args.jsonl, 'a', encoding='utf-8') as jf, open(clips_path, 'a', encoding='utf-8') as cf:
+        for batch in parquet_file.iter_batches(batch_size=args.batch_size):
+            # rows before the watermark were written by an earlier run
+            skip = min(len(batch), max(0, state['rows_done'] - row_offset))
+            row_offset += len(batch)
+            if skip == len(batch):
+                continue
+            rows = batch.slice(skip).to_pylist()
+            results, clips = process_batch(rows, naming, args, pool, archive)
+            for item in results:
+                jf.write(json.dumps(item, ensure_ascii=False) + '\n')
+            jf.flush()
+            write_clips(clips, cf)
+            cf.flush()
+            if archive is not None:
+                archive.flush()
+            state['jsonl_size'] = jf.tell()
+            state['clips_size'] = cf.tell()
+            state['rows_done'] = row_offset
+            save_state(state, state_path)
+            n_new += len(results)
+    if archive is not None:
+        archive.close()
+    print(f'{n_new} new rows of {row_offset} written to {args.jsonl}')
 
-jsonl_path = ""
-with open(jsonl_path, "w", encoding="utf-8") as jf:
-    for item in results:
-        jf.write(json.dumps(item, ensure_ascii=False) + '\n')
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    # parquet path
+    parser.add_argument('--parquet', type=str, default="")
+    parser.add_argument('--output-dir', type=str, default='kimi/dataset/aha_bench')
+    parser.add_argument('--jsonl', type=str, default="")
+    # wav: one file per clip under <output-dir>/<type>/
+    # archive: clips packed into a few large shard files under <output-dir>, audio_path is an archive:// reference
+    parser.add_argument('--format', type=str, default='wav', choices=['wav', 'archive'])
+    parser.add_argument('--shard-size-mb', type=float, default=1024)
+    parser.add_argument('--batch-size', type=int, default=256, help='Rows per parquet record batch')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Threads hashing and writing audio')
+    parser.add_argument('--state', type=str, default=None,
+                        help='Ingest state of earlier runs (default: <jsonl>.ingest.json), a re-run on the same '
+                             'parquet resumes after the rows done, a changed parquet is ingested from the start')
+    main(parser.parse_args())
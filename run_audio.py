@@ -1,9 +1,21 @@
 import argparse
 import torch
 from almeval.datasets import build_dataset
+from almeval.judge_models import get_judge_model
+from almeval.judge_models.stream import StreamingJudge, load_judge_sidecar
 from almeval.models import build_model
 from tqdm import tqdm
 from almeval.utils import *
+from almeval.utils.audio_manifest import get_sample_audio_paths, load_audio_manifest
+from almeval.utils.batching import bucket_batches
+from almeval.utils.audio_loader import WaveformCache, get_waveform_cache, set_waveform_cache
+from almeval.utils.embed_cache import EmbeddingCache
+from almeval.utils.infer_cache import InferenceCache
+from almeval.utils.journal import PredictionJournal, merge_journals
+from almeval.utils.prefetch import Prefetcher
+from almeval.utils.sharding import (group_by_key, imbalance, reuse_rate, shard_by_count, shard_by_weight,
+                                   shard_groups_by_weight, shard_loads)
+from almeval.utils.work_queue import WorkQueue
 from loguru import logger
 import sys
 import os
@@ -38,47 +50,102 @@ def setup_logging(rank, model, data, work_dir):
     return log_file
 
 
+def sample_result_files(args, result_file):
+    """Result files of one run, `{model}_{dataset}_{i}.jsonl` per sample with --num-samples > 1,
+    the layout gpt_eval.py and eval_metric.py read repeated runs from"""
+    if args.num_samples <= 1:
+        return [result_file]
+    return [result_file.replace('.jsonl', f'_{i}.jsonl') for i in range(args.num_samples)]
+
+
+def sample_eval_files(args, result_file, eval_file):
+    if args.num_samples <= 1:
+        return [eval_file]
+    return [f.replace('.jsonl', f'_{args.eval_method}_performance.json')
+            for f in sample_result_files(args, result_file)]
+
+
+def evaluate_results(args, dataset, result_file, eval_file):
+    for sample_file, sample_eval_file in zip(sample_result_files(args, result_file),
+                                             sample_eval_files(args, result_file, eval_file)):
+        perf = dataset.evaluate(sample_file, method=args.eval_method)
+        with open(sample_eval_file, 'w') as f:
+            json.dump(perf, f, indent=4)
+
+
 def merge_one_dataset(args, dataset, result_file, eval_file):
     model_data_dir = osp.join(args.work_dir, args.model, dataset.DATASET_NAME)
     os.makedirs(model_data_dir, exist_ok=True)
 
     if args.reeval:
-        perf = dataset.evaluate(result_file, method=args.eval_method)
-        with open(eval_file, 'w') as f:
-            json.dump(perf, f, indent=4)
+        evaluate_results(args, dataset, result_file, eval_file)
         return
 
-    tmp_files = [osp.join(model_data_dir, f'{rank}_{args.world_size}_{dataset.DATASET_NAME}.pkl') for rank in range(args.world_size)]
-
-    # Merge if all tmp_files exist
-    if all(osp.exists(tmpfile) for tmpfile in tmp_files):
-        data_all = {}
-        for tmpfile in tmp_files:
-            data_all.update(load(tmpfile))
-        raw_data = dataset.data
-        for x in raw_data:
-            idx = int(x['index'])
-            if idx not in data_all:
-                logger.warning(f'index {idx} not found in data_all, details: {x}')
-                x['prediction'] = 'null'
+    journal_files = [osp.join(model_data_dir, f'{rank}_{args.world_size}_{dataset.DATASET_NAME}.journal')
+                     for rank in range(args.world_size)]
+
+    # Merge if all journal_files exist
+    if all(osp.exists(journal_file) for journal_file in journal_files):
+        # journals are compacted and sorted by dataset position, so they are merged in one pass
+        records = merge_journals(journal_files)
+        record = next(records, None)
+        result_files = sample_result_files(args, result_file)
+        fouts = [open(f, 'w', encoding='utf8') for f in result_files]
+        for pos, x in enumerate(dataset.data):
+            while record is not None and record['pos'] < pos:
+                record = next(records, None)
+            if record is None or record['pos'] != pos or record['index'] != str(x['index']):
+                logger.warning(f'index {x["index"]} not found in journals, details: {x}')
+                predictions = ['null'] * len(fouts)
                 x['real_prompt'] = ''
-                continue
-            x['prediction'] = str(data_all[idx]['prediction'])
-            x['real_prompt'] = str(data_all[idx]['prompt'])
+            else:
+                # a list with --num-samples > 1, unless the sample was scored with --answer-mode logits
+                predictions = record['prediction']
+                if not isinstance(predictions, list):
+                    predictions = [predictions] * len(fouts)
+                x['real_prompt'] = str(record['prompt'])
+                # label and confidence of samples scored with --answer-mode logits
+                for key in ['answer_label', 'confidence']:
+                    if key in record:
+                        x[key] = record[key]
+            for k, (fout, prediction) in enumerate(zip(fouts, predictions)):
+                x['prediction'] = str(prediction)
+                if len(fouts) > 1:
+                    # sample k of the RNG stream seeded with seed
+                    x['seed'] = args.seed
+                    x['sample'] = k
+                if pos > 0:
+                    fout.write('\n')
+                fout.write(json.dumps(x, ensure_ascii=False, cls=NumpyEncoder))
+        for fout in fouts:
+            fout.close()
 
-        dump(raw_data, result_file)
+        for journal_file in journal_files:
+            os.remove(journal_file)
 
-        for tmpfile in tmp_files:
-            os.remove(tmpfile)
+        logger.info(f'model {args.model}, data {dataset.DATASET_NAME}, all {args.world_size} result merged to '
+                    f'{", ".join(result_files)}.')
 
-        logger.info(f'model {args.model}, data {dataset.DATASET_NAME}, all {args.world_size} result merged to {result_file}.')
+    # collect the results of the streaming judge of all ranks, kept across runs
+    stream_judge_file = result_file.replace('.jsonl', '_stream_judge.jsonl')
+    judge_files = [osp.join(model_data_dir, f'{rank}_{args.world_size}_{dataset.DATASET_NAME}.judge.jsonl')
+                   for rank in range(args.world_size)]
+    judge_files = [judge_file for judge_file in judge_files if osp.exists(judge_file)]
+    if len(judge_files) > 0:
+        stream_judge_journal = PredictionJournal(stream_judge_file, fsync_every=0)
+        for judge_file in judge_files:
+            for record in PredictionJournal.scan(judge_file):
+                stream_judge_journal.append(record)
+        stream_judge_journal.close()
+        for judge_file in judge_files:
+            os.remove(judge_file)
 
     if args.skip_eval:
         logger.info(f'skip eval for {dataset.DATASET_NAME}')
         return
-    perf = dataset.evaluate(result_file, method=args.eval_method)
-    with open(eval_file, 'w') as f:
-        json.dump(perf, f, indent=4)
+    if args.stream_judge:
+        dataset.judge_sidecar = load_judge_sidecar([stream_judge_file])
+    evaluate_results(args, dataset, result_file, eval_file)
     logger.info(f'model {args.model}, data {dataset.DATASET_NAME} evaluated.')
 
 
@@ -103,16 +170,96 @@ def do_reeval(dataset_name, result_file='auto', method='default'):
             json.dump(perf, f, indent=4)
 
 
+def audio_key_of(dataset):
+    return lambda i: tuple(get_sample_audio_paths(dataset.data[i]))
+
+
+def uses_audio_manifest(args) -> bool:
+    """Whether this run reads the audio manifest up front: duration-balanced shards, duration-bucketed batches,
+    caches keyed by audio content (their md5s persist in the manifest), or --audio-manifest. Otherwise no clip is
+    opened before inference"""
+    return (args.audio_manifest or args.shard_by != 'count' or args.batch_size > 1
+            or bool(args.infer_cache or args.embed_cache or args.audio_cache))
+
+
+def filter_legal_samples(args, dataset, model, sample_indices):
+    """Drop samples with clips the model would skip (unreadable, or outside its duration limits) before they are
+    scheduled, using the audio manifest instead of opening every clip during inference. Without a manifest
+    the model checks each sample when it gets to it"""
+    if not uses_audio_manifest(args):
+        return sample_indices
+    manifest = load_audio_manifest(dataset, rank=int(args.rank))
+    legal = manifest.sample_legal([dataset.data[i] for i in sample_indices], model.MIN_DURATION, model.MAX_DURATION)
+    n_skipped = len(sample_indices) - sum(legal)
+    if n_skipped > 0 and int(args.rank) == 0:
+        logger.warning(f'{dataset.DATASET_NAME}: skipping {n_skipped} of {len(sample_indices)} samples with audio '
+                       f'outside [{model.MIN_DURATION}, {model.MAX_DURATION}]s or unreadable')
+    return [i for i, ok in zip(sample_indices, legal) if ok]
+
+
+def shard_dataset(args, dataset, sample_indices):
+    """Split sample_indices into one shard per rank, by sample count, by total audio duration,
+    or by total audio duration with all samples of one clip on the same rank"""
+    world_size = int(args.world_size)
+    rank = int(args.rank)
+    if args.shard_by == 'count':
+        return shard_by_count(sample_indices, world_size)
+
+    manifest = load_audio_manifest(dataset, rank=rank)
+    durations = manifest.sample_durations([dataset.data[i] for i in sample_indices])
+    if args.shard_by == 'audio':
+        # per-clip caches only hit when every question about a clip runs on the same rank, back to back
+        duration_of = dict(zip(sample_indices, durations))
+        groups = group_by_key(sample_indices, audio_key_of(dataset))
+        shards = shard_groups_by_weight(groups, [sum(duration_of[i] for i in group) for group in groups], world_size)
+        if rank == 0:
+            logger.info(f'{dataset.DATASET_NAME}: {len(groups)} clips in {len(sample_indices)} samples, '
+                        f'predicted per-clip cache hit rate {reuse_rate(shards, audio_key_of(dataset)):.1%}, '
+                        f'count-based sharding would be '
+                        f'{reuse_rate(shard_by_count(sample_indices, world_size), audio_key_of(dataset)):.1%}')
+    else:
+        shards = shard_by_weight(sample_indices, durations, world_size)
+    if rank == 0:
+        duration_of = dict(zip(sample_indices, durations))
+        loads = shard_loads(shards, duration_of)
+        count_loads = shard_loads(shard_by_count(sample_indices, world_size), duration_of)
+        logger.info(f'{dataset.DATASET_NAME}: {sum(durations):.1f}s audio in {len(sample_indices)} samples, '
+                    f'per-rank seconds: {[round(x, 1) for x in loads]}, predicted imbalance (max/mean): '
+                    f'{imbalance(loads):.3f}, count-based sharding would be {imbalance(count_loads):.3f}')
+    return shards
+
+
+def iter_batches(args, dataset, sample_indices, lazy=False):
+    """Yield batches of sample indices, bucketed by audio duration and prompt length when batch size > 1"""
+    if args.batch_size <= 1:
+        return ([i] for i in sample_indices)
+
+    manifest = load_audio_manifest(dataset, rank=int(args.rank))
+
+    def cost_of(i):
+        item = dataset.data[i]
+        if args.shard_by == 'audio':
+            # keep the questions about one clip next to each other
+            return manifest.sample_durations([item])[0], audio_key_of(dataset)(i), len(str(item['question']))
+        return manifest.sample_durations([item])[0], len(str(item['question']))
+
+    # a lazy source (the work queue) is bucketed window by window instead of drained up front
+    window = args.batch_size * 8 if lazy else None
+    return bucket_batches(sample_indices, cost_of, args.batch_size,
+                          max_audio_seconds=args.max_batch_audio_seconds, window=window)
+
+
 def process_dataset(args, dataset, model):
     # Assign different subsets to each process
     model_data_dir = osp.join(args.work_dir, args.model, dataset.DATASET_NAME)
     result_file = osp.join(model_data_dir, f'{args.model}_{dataset.DATASET_NAME}.jsonl')
     eval_file = osp.join(model_data_dir, f'{args.model}_{dataset.DATASET_NAME}_{args.eval_method}_performance.json')
     os.makedirs(model_data_dir, exist_ok=True)
+    queue_file = osp.join(model_data_dir, f'{args.world_size}_{dataset.DATASET_NAME}.queue.db')
     rank = int(args.rank)
     
-    if os.path.exists(result_file) and not args.force_reinfer:
-        if args.reeval or not os.path.exists(eval_file):
+    if all(os.path.exists(f) for f in sample_result_files(args, result_file)) and not args.force_reinfer:
+        if args.reeval or not all(os.path.exists(f) for f in sample_eval_files(args, result_file, eval_file)):
             if rank==0:
                 logger.info(f'file {result_file} exists, reevaluating...')
                 merge_one_dataset(args, dataset, result_file, eval_file)
@@ -124,42 +271,159 @@ def process_dataset(args, dataset, model):
     else:
         if args.debug:
             dataset.set_demo_mode()
-        sample_indices = [i for i in range(len(dataset))]
+        sample_indices = filter_legal_samples(args, dataset, model, [i for i in range(len(dataset))])
 
         # Distribute data to each rank
         world_size = int(args.world_size)
         rank = int(args.rank)
-        sample_indices_sub = sample_indices[rank::world_size]
+        queue = None
+        if args.schedule == 'queue':
+            # ranks pull chunks from a shared queue until it is drained
+            queue = WorkQueue(queue_file, rank)
+            # a forced re-run must not keep the done samples of an earlier run, rank 0 resets the queue
+            queue.init(sample_indices, reset=args.force_reinfer and rank == 0)
+            sample_indices_sub = queue.iter_claims(args.queue_chunk_size)
+        else:
+            sample_indices_sub = shard_dataset(args, dataset, sample_indices)[rank]
 
-        tmpl = osp.join(model_data_dir, f'{rank}_{args.world_size}_{dataset.DATASET_NAME}.pkl')
-        out_file = tmpl.format(rank)
-        res = load(out_file) if osp.exists(out_file) else {}
+        journal_file = osp.join(model_data_dir, f'{rank}_{args.world_size}_{dataset.DATASET_NAME}.journal')
+        # rebuild the resume set from the records this rank has already journaled
+        done = set() if args.force_reinfer else set(
+            record['index'] for record in PredictionJournal.scan(journal_file))
+        journal = PredictionJournal(journal_file, fsync_every=args.journal_fsync)
+        judge_file = osp.join(model_data_dir, f'{rank}_{args.world_size}_{dataset.DATASET_NAME}.judge.jsonl')
+        stream_judge = None
         
         processed_samples = 0
-        for i in tqdm(sample_indices_sub, disable=args.rank != 0):
-            msg = dataset[i]
-            idx = int(msg['index'])
-            if not args.force_reinfer:
-                if idx in res:
+        n_failed = 0
+        pbar = tqdm(total=None if queue is not None else len(sample_indices_sub), disable=args.rank != 0)
+
+        def pending_samples():
+            for i in sample_indices_sub:
+                if dataset.index_at(i) in done:
+                    if queue is not None:
+                        queue.complete([i])
+                    pbar.update(1)
                     continue
+                yield i
+
+        infer_cache = InferenceCache(args.infer_cache) if args.infer_cache else None
+        if infer_cache is not None and args.num_samples == 1 and model.is_sampling():
+            # nothing seeds a single run, a cached response would stand in for every later draw
+            logger.warning(f'{model.NAME} samples its responses, --infer-cache ignored for a single unseeded run, '
+                           'use --num-samples with --seed to cache seeded samples')
+            infer_cache.close()
+            infer_cache = None
 
+        answer_logits = args.answer_mode == 'logits'
+        if answer_logits and not model.ANSWER_LOGITS:
+            logger.warning(f'{model.NAME} does not support --answer-mode logits, generating answers instead')
+            answer_logits = False
+
+        cache_config = model.get_cache_config()
+        if args.num_samples > 1:
+            cache_config = dict(cache_config, num_samples=args.num_samples, seed=args.seed)
+
+        def scored_by_logits(i):
+            return answer_logits and dataset.is_yes_no_question(dataset.data[i])
+
+        def prepare(batch):
+            # runs in prefetch threads: build messages, look them up in the inference cache,
+            # and let the model decode the audio of cache misses ahead of generation
+            msgs = [dataset[i] for i in batch]
+            keys = [None] * len(msgs)
+            cached = [None] * len(msgs)
+            if infer_cache is not None:
+                for k, msg in enumerate(msgs):
+                    if scored_by_logits(batch[k]):
+                        # a single forward pass, not worth a cache entry
+                        continue
+                    keys[k] = infer_cache.key(cache_config, model.get_cache_prompt(msg), msg['audio'])
+                    cached[k] = infer_cache.get(keys[k])
+                    if cached[k] is not None and args.num_samples > 1:
+                        cached[k] = (cached[k][0], json.loads(cached[k][1]))
+            msgs = [msg if cached[k] is not None else model.preprocess(msg) for k, msg in enumerate(msgs)]
+            return batch, msgs, keys, cached
+
+        batches = iter_batches(args, dataset, pending_samples(), lazy=queue is not None)
+        prefetcher = Prefetcher(prepare, batches, depth=args.prefetch, workers=args.prefetch_workers)
+        generate_time = 0.
+        for batch, msgs, keys, cached in prefetcher:
             if processed_samples==0:
-                logger.info(f'Msg example: {msg}')
-
-            real_prompt, response = model(msg)
-            torch.cuda.empty_cache()
-            if response is None:
-                continue
-            
-            # we need response and prompt, because model may change prompt
-            res[idx] = {
-                'prompt': real_prompt,
-                'prediction': response,
-            }
-            processed_samples += 1
-            if processed_samples % 20 == 0:
-                dump(res, out_file)
-        dump(res, out_file)
+                logger.info(f'Msg example: {msgs[0]}')
+
+            outputs = list(cached)
+            labels = [None] * len(msgs)
+            todo = [k for k in range(len(msgs)) if cached[k] is None]
+            scored = [k for k in todo if scored_by_logits(batch[k])]
+            if len(scored) > 0:
+                start = time.perf_counter()
+                for k, (real_prompt, label, confidence) in zip(scored, model.answer_logits([msgs[k] for k in scored])):
+                    outputs[k] = (real_prompt, label.capitalize() if label is not None else None)
+                    labels[k] = (label, confidence)
+                generate_time += time.perf_counter() - start
+                todo = [k for k in todo if k not in scored]
+            if len(todo) > 0:
+                start = time.perf_counter()
+                if args.num_samples > 1:
+                    # all samples of a prompt come from one generate call, the audio is encoded once
+                    generated = model.generate_samples([msgs[k] for k in todo], args.num_samples, args.seed)
+                elif len(todo) == 1:
+                    generated = [model(msgs[todo[0]])]
+                else:
+                    generated = model.generate_batch([msgs[k] for k in todo])
+                torch.cuda.empty_cache()
+                generate_time += time.perf_counter() - start
+                for k, (real_prompt, response) in zip(todo, generated):
+                    outputs[k] = (real_prompt, response)
+                    if infer_cache is not None and response is not None:
+                        infer_cache.put(keys[k], real_prompt,
+                                        json.dumps(response, ensure_ascii=False) if args.num_samples > 1 else response)
+            for i, (real_prompt, response), label in zip(batch, outputs, labels):
+                if response is not None:
+                    # we need response and prompt, because model may change prompt
+                    record = {
+                        'pos': i,
+                        'index': dataset.index_at(i),
+                        'prompt': real_prompt,
+                        'prediction': response,
+                    }
+                    if label is not None:
+                        record['answer_label'], record['confidence'] = label
+                    journal.append(record)
+                    processed_samples += 1
+                    if args.stream_judge and not args.skip_eval and label is None:
+                        # judge in the background while the next batches are generated
+                        for prediction in (response if isinstance(response, list) else [response]):
+                            row = dict(dataset.data[i], prediction=str(prediction), real_prompt=str(real_prompt))
+                            setting = dataset.get_judge_setting(row, method=args.eval_method)
+                            if setting is not None:
+                                if stream_judge is None:
+                                    stream_judge = StreamingJudge(get_judge_model(args.eval_method), judge_file)
+                                stream_judge.submit(setting)
+                    # the result is journaled, so the sample never needs to be claimed again
+                    if queue is not None:
+                        queue.complete([i])
+                else:
+                    # left claimed, not released: this rank would claim it again right away. The next run of
+                    # this rank releases it, and the resume retries what the journal lacks
+                    n_failed += 1
+            pbar.update(len(batch))
+        pbar.close()
+        logger.info(f'rank {rank}: main loop waited {prefetcher.wait_time:.1f}s on preprocessing of '
+                    f'{prefetcher.n_items} batches, generation took {generate_time:.1f}s')
+        if n_failed > 0:
+            logger.warning(f'rank {rank}: {n_failed} samples got no response, they are retried on the next run')
+        if infer_cache is not None:
+            logger.info(f'rank {rank}: inference cache {infer_cache.hits} hits, {infer_cache.misses} misses')
+            infer_cache.close()
+        journal.close()
+        if stream_judge is not None:
+            stream_judge.close()
+        position = dataset.index_positions()
+        PredictionJournal.compact(journal_file, position)
+        if queue is not None:
+            queue.close()
 
         # Write a file to indicate this rank is done
         with open(osp.join(model_data_dir, f'{rank}_{args.world_size}_{dataset.DATASET_NAME}.done'), 'w') as f:
@@ -176,6 +440,7 @@ def process_dataset(args, dataset, model):
                     # Delete all done files
                     for success_file in all_success_files:
                         os.remove(success_file)
+                    WorkQueue.remove(queue_file)
                     break
                 else:
                     time.sleep(10)
@@ -183,6 +448,43 @@ def process_dataset(args, dataset, model):
                     logger.info(f'waiting for other ranks to finish, time elapsed: {time_elapsed}s')
             merge_one_dataset(args, dataset, result_file, eval_file)
 
+def build_local_model(args):
+    if args.audio_cache:
+        set_waveform_cache(WaveformCache(args.audio_cache, max_disk_gb=args.audio_cache_gb))
+    model = build_model(args.model)
+    embed_cache = None
+    if args.embed_cache:
+        embed_cache = EmbeddingCache(args.embed_cache, max_disk_gb=args.embed_cache_gb)
+        model.enable_embedding_cache(embed_cache)
+    prefix_cache = None
+    if args.prefix_cache_gb > 0:
+        # imported where used, like the model wrappers, so runs without a prefix cache do not load it
+        from almeval.models.prefix_cache import PrefixKVCache
+        prefix_cache = PrefixKVCache(max_gb=args.prefix_cache_gb)
+        model.enable_prefix_cache(prefix_cache)
+    return model, embed_cache, prefix_cache
+
+
+def serve(args):
+    """Load the model once and serve it to run_audio.py --server clients until interrupted"""
+    logger.remove()
+    logger.add(sys.stdout, format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}", level="INFO")
+    # the server module is only loaded by --serve and --server runs
+    from almeval.models.server import ModelServer
+    server = ModelServer(args.host, args.port, max_concurrency=args.max_concurrency)
+    server.start()
+    model, _, _ = build_local_model(args)
+    # warm up on the first sample of the first dataset
+    dataset = build_dataset(args.data[0])
+    if isinstance(dataset, list):
+        dataset = dataset[0]
+    server.set_model(model, warmup_msg=dataset[0] if len(dataset) > 0 else None)
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
 def main(args):
     datasets = []
     for dataset_name in args.data:
@@ -191,13 +493,30 @@ def main(args):
             datasets.extend(d)
         else:
             datasets.append(d)
-            
-    model = build_model(args.model)
+
+    if args.server:
+        # the model is loaded once by run_audio.py --serve
+        from almeval.models.server import RemoteModel
+        model, embed_cache, prefix_cache = RemoteModel(args.server), None, None
+        if model.NAME != args.model:
+            raise ValueError(f'server {args.server} serves {model.NAME}, not {args.model}')
+    else:
+        model, embed_cache, prefix_cache = build_local_model(args)
+    if args.num_samples > 1 and not model.supports_samples():
+        # checked before any dataset is scheduled, so no queue claims are left behind
+        raise ValueError(f'{model.NAME} generates greedily and has no native sampling, --num-samples '
+                         f'{args.num_samples} would give identical responses, use --num-samples 1')
     logger.info(f"Datasets: {datasets}")
     for dataset in datasets:
         setup_logging(args.rank, args.model, dataset.DATASET_NAME, args.work_dir)
         logger.info(f"Running {args.model} on dataset: {dataset.DATASET_NAME}")
         process_dataset(args, dataset, model)
+        if embed_cache is not None:
+            logger.info(f'rank {args.rank}: {embed_cache.stats()}')
+        if prefix_cache is not None:
+            logger.info(f'rank {args.rank}: {prefix_cache.stats()}')
+        if get_waveform_cache() is not None:
+            logger.info(f'rank {args.rank}: {get_waveform_cache().stats()}')
 
 
 if __name__ == '__main__':
@@ -213,8 +532,57 @@ if __name__ == '__main__':
     parser.add_argument('--eval-method', type=str, default='default', help='Evaluation method')
     parser.add_argument('--force-reinfer', action='store_true', help='Whether to force re-inference')
     parser.add_argument('--skip-eval', action='store_true', help='Whether to skip evaluation')
+    parser.add_argument('--batch-size', type=int, default=1, help='Number of samples per generate call')
+    parser.add_argument('--max-batch-audio-seconds', type=float, default=None,
+                        help='Max padded audio seconds (batch length * longest clip) per batch')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='Number of batches prepared ahead of generation in background threads, 0 to disable')
+    parser.add_argument('--prefetch-workers', type=int, default=2, help='Number of prefetch threads')
+    parser.add_argument('--journal-fsync', type=int, default=1,
+                        help='fsync the prediction journal every N finished samples, 0 to fsync only when a rank finishes')
+    parser.add_argument('--infer-cache', type=str, default=None,
+                        help='SQLite file caching model outputs across runs and datasets, disabled if not set')
+    parser.add_argument('--embed-cache', type=str, default=None,
+                        help='Directory caching audio encoder outputs, so questions about the same clip skip the encoder')
+    parser.add_argument('--embed-cache-gb', type=float, default=20, help='Disk budget of --embed-cache in GB')
+    parser.add_argument('--audio-manifest', action='store_true',
+                        help='Scan clip headers into <dataset>_manifest.parquet before inference and drop samples '
+                             'the model would skip; always on with --shard-by duration/audio or --batch-size > 1')
+    parser.add_argument('--audio-cache', type=str, default=None,
+                        help='Directory caching decoded and resampled waveforms, shared by all models and runs')
+    parser.add_argument('--audio-cache-gb', type=float, default=50, help='Disk budget of --audio-cache in GB')
+    parser.add_argument('--prefix-cache-gb', type=float, default=0,
+                        help='Memory budget in GB for KV caches of prompt prefixes shared by questions about one clip, '
+                             '0 to disable')
+    parser.add_argument('--num-samples', type=int, default=1,
+                        help='Number of sampled responses per prompt, generated in one call and written to '
+                             '<model>_<dataset>_{i}.jsonl')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the RNG stream all samples of --num-samples are drawn from, recorded in the '
+                             'result files')
+    parser.add_argument('--answer-mode', type=str, default='generate', choices=['generate', 'logits'],
+                        help='How yes/no questions are answered: free-form generation, or one forward pass comparing '
+                             'the probabilities of the yes and no tokens')
+    parser.add_argument('--stream-judge', action='store_true',
+                        help='Judge finished predictions with the LLM judge while inference is still running')
+    parser.add_argument('--schedule', type=str, default='static', choices=['static', 'queue'],
+                        help='How samples are distributed to ranks: static striding, or a shared work queue')
+    parser.add_argument('--shard-by', type=str, default='count', choices=['count', 'duration', 'audio'],
+                        help='How static shards are balanced: by sample count, by total audio duration, '
+                             'or by total audio duration keeping all samples of one clip on the same rank')
+    parser.add_argument('--queue-chunk-size', type=int, default=8, help='Number of samples a rank claims at a time in queue mode')
+    parser.add_argument('--serve', action='store_true',
+                        help='Load the model once and serve it over HTTP to runs started with --server, '
+                             'the first sample of --data is used for warmup')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address the model server binds to')
+    parser.add_argument('--port', type=int, default=8000, help='Port the model server listens on')
+    parser.add_argument('--max-concurrency', type=int, default=1, help='Model calls the server runs at a time')
+    parser.add_argument('--server', type=str, default=None,
+                        help='URL of a model server started with --serve, used instead of loading the model')
     args = parser.parse_args()
-    if args.reeval:
+    if args.serve:
+        serve(args)
+    elif args.reeval:
         do_reeval(args.data, args.eval_file, args.eval_method)
     else:
         main(args)
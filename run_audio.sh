@@ -22,9 +22,22 @@ print_help() {
     echo "Optional parameters:"
     echo "  --eval-method METHOD    Evaluation method (default: default)"
     echo "  --eval-file FILE        Path to evaluation result file (default: auto)"
+    echo "  --schedule MODE         Sample scheduling across ranks: static or queue (default: static)"
+    echo "  --shard-by POLICY       Static shard balancing: count, duration or audio (default: count)"
+    echo "  --batch-size N          Number of samples per generate call (default: 1)"
+    echo "  --prefetch N            Batches decoded ahead of generation in background threads (default: 0)"
+    echo "  --infer-cache FILE      SQLite file caching model outputs across runs and datasets"
+    echo "  --embed-cache DIR       Directory caching audio encoder outputs (Qwen2-Audio, Qwen2.5-Omni)"
+    echo "  --audio-cache DIR       Directory caching decoded waveforms, shared by all models"
+    echo "  --audio-manifest        Scan clip durations before inference and skip illegal samples up front"
+    echo "  --server URL            Use a model server started with run_audio.py --serve instead of loading the model"
+    echo "  --answer-mode MODE      Yes/no answering: generate or logits (default: generate)"
+    echo "  --num-samples N         Sampled responses per prompt, written to one result file each (default: 1)"
+    echo "  --seed S                Seed of the RNG stream samples are drawn from (default: 0)"
     echo
     echo "Control parameters:"
     echo "  --force-reinfer         Force re-inference"
+    echo "  --stream-judge          Run the LLM judge on finished predictions during inference"
     echo "  --reeval                Re-evaluate"
     echo "  --skip-eval             Skip evaluation"
     echo "  --debug                 Debug mode"
@@ -83,10 +96,62 @@ while [[ $# -gt 0 ]]; do
             EVAL_FILE="$2"
             shift 2
             ;;
+        --schedule)
+            SCHEDULE="$2"
+            shift 2
+            ;;
+        --shard-by)
+            SHARD_BY="$2"
+            shift 2
+            ;;
+        --batch-size)
+            BATCH_SIZE="$2"
+            shift 2
+            ;;
+        --prefetch)
+            PREFETCH="$2"
+            shift 2
+            ;;
+        --infer-cache)
+            INFER_CACHE="$2"
+            shift 2
+            ;;
+        --embed-cache)
+            EMBED_CACHE="$2"
+            shift 2
+            ;;
+        --audio-cache)
+            AUDIO_CACHE="$2"
+            shift 2
+            ;;
+        --audio-manifest)
+            AUDIO_MANIFEST="true"
+            shift
+            ;;
+        --server)
+            SERVER="$2"
+            shift 2
+            ;;
+        --answer-mode)
+            ANSWER_MODE="$2"
+            shift 2
+            ;;
+        --num-samples)
+            NUM_SAMPLES="$2"
+            shift 2
+            ;;
+        --seed)
+            SEED="$2"
+            shift 2
+            ;;
         --force-reinfer)
             FORCE_REINFER="true"
             shift
             ;;
+        --stream-judge)
+            STREAM_JUDGE="true"
+            shift
+            ;;
         --reeval)
             REEVAL="true"
             shift
@@ -210,7 +275,20 @@ for model in "${models[@]}"; do
 
         # Add optional parameters
         [ "$EVAL_METHOD" != "default" ] && CMD="$CMD --eval-method $EVAL_METHOD"
+        [ -n "$SCHEDULE" ] && CMD="$CMD --schedule $SCHEDULE"
+        [ -n "$SHARD_BY" ] && CMD="$CMD --shard-by $SHARD_BY"
+        [ -n "$BATCH_SIZE" ] && CMD="$CMD --batch-size $BATCH_SIZE"
+        [ -n "$PREFETCH" ] && CMD="$CMD --prefetch $PREFETCH"
+        [ -n "$INFER_CACHE" ] && CMD="$CMD --infer-cache $INFER_CACHE"
+        [ -n "$EMBED_CACHE" ] && CMD="$CMD --embed-cache $EMBED_CACHE"
+        [ -n "$AUDIO_CACHE" ] && CMD="$CMD --audio-cache $AUDIO_CACHE"
+        [ -n "$AUDIO_MANIFEST" ] && CMD="$CMD --audio-manifest"
+        [ -n "$SERVER" ] && CMD="$CMD --server $SERVER"
+        [ -n "$ANSWER_MODE" ] && CMD="$CMD --answer-mode $ANSWER_MODE"
+        [ -n "$NUM_SAMPLES" ] && CMD="$CMD --num-samples $NUM_SAMPLES"
+        [ -n "$SEED" ] && CMD="$CMD --seed $SEED"
         [ -n "$FORCE_REINFER" ] && CMD="$CMD --force-reinfer"
+        [ -n "$STREAM_JUDGE" ] && CMD="$CMD --stream-judge"
         [ -n "$SKIP_EVAL" ] && CMD="$CMD --skip-eval"
         [ -n "$DEBUG" ] && CMD="$CMD --debug"
 
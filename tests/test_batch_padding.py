@@ -0,0 +1,14 @@
+from tiny_qwen2_audio import tiny_msg, tiny_qwen2_audio
+
+
+def test_padded_batch_matches_single_generation():
+    # clips and prompts of different lengths, so the batch is left padded both in text and in audio features
+    model = tiny_qwen2_audio()
+    msgs = [tiny_msg(0, 'is there a dog barking?', 1.0),
+            tiny_msg(1, 'what sound do you hear? how many people speak?', 2.5),
+            tiny_msg(2, 'yes', 0.4)]
+    singles = [model.generate_inner(msg) for msg in msgs]
+    assert model.generate_batch_inner(msgs) == singles
+    # padding the batch must not change greedy generation_config either
+    model.generation_config = dict(model.generation_config, max_new_tokens=4)
+    assert model.generate_batch_inner(msgs[::-1]) == [model.generate_inner(msg) for msg in msgs[::-1]]
@@ -0,0 +1,30 @@
+from tiny_qwen2_audio import tiny_msg, tiny_qwen2_audio, torch
+
+from almeval.models.prefix_cache import PrefixKVCache, generate_with_prefix
+
+
+def test_prefix_cached_generation_matches_uncached():
+    model = tiny_qwen2_audio()
+    # two questions about one clip share the audio prefix, the second reuses its KV cache. The last clip has as
+    # many audio tokens as the first, only its features tell the prefixes apart
+    msgs = [tiny_msg(0, 'is there a dog barking?', 1.5), tiny_msg(1, 'what sound do you hear?', 1.5, audio_seed=0),
+            tiny_msg(2, 'what sound do you hear?', 1.5)]
+    uncached = [model.generate_inner(msg) for msg in msgs]
+
+    model.prefix_cache = PrefixKVCache(max_gb=1)
+    cached = [model.generate_inner(msg) for msg in msgs]
+    assert cached == uncached
+    assert (model.prefix_cache.hits, model.prefix_cache.misses) == (1, 2)
+
+
+def test_generate_with_prefix_token_for_token():
+    model = tiny_qwen2_audio()
+    cache = PrefixKVCache(max_gb=1)
+    for text in ['is there a dog barking?', 'what sound do you hear? how many people speak?']:
+        _, inputs = model.build_inputs([tiny_msg(0, text, 1.2)])
+        prefix_len = model.audio_prefix_len(inputs.input_ids)
+        assert prefix_len is not None
+        expected = model.model.generate(**inputs, **model.generation_config)
+        generated = generate_with_prefix(model.model, inputs, prefix_len, cache, **model.generation_config)
+        assert torch.equal(generated, expected)
+    assert cache.hits == 1
@@ -0,0 +1,71 @@
+"""A Qwen2Audio wrapper around a tiny randomly initialized Qwen2-Audio model, so generation paths run on CPU
+without downloading weights"""
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+tokenizers = pytest.importorskip('tokenizers')
+
+from almeval.models.qwen_audio import Qwen2Audio  # noqa: E402
+
+SAMPLING_RATE = 16000
+WORDS = ['listen', 'to', 'the', 'given', 'audio', 'carefully', 'and', 'answer', 'this', 'question:', 'is', 'there',
+         'a', 'dog', 'barking?', 'what', 'sound', 'do', 'you', 'hear?', 'how', 'many', 'people', 'speak?', 'yes', 'no']
+SPECIAL = ['<|endoftext|>', '<|audio_bos|>', '<|AUDIO|>', '<|audio_eos|>']
+
+
+class _Processor:
+    """Qwen2AudioProcessor called with the `audios` keyword of the transformers versions the wrappers target,
+    newer versions name it `audio`"""
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.tokenizer = processor.tokenizer
+        self.feature_extractor = processor.feature_extractor
+
+    def __call__(self, text, audios, **kwargs):
+        return self.processor(text=text, audio=audios, **kwargs)
+
+    def batch_decode(self, *args, **kwargs):
+        return self.processor.batch_decode(*args, **kwargs)
+
+
+def tiny_qwen2_audio(seed=0) -> Qwen2Audio:
+    vocab = {w: i for i, w in enumerate(SPECIAL + WORDS + ['.', '[UNK]'])}
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token='[UNK]'))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.WhitespaceSplit()
+    tokenizer = transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token='<|endoftext|>', eos_token='<|endoftext|>',
+        additional_special_tokens=SPECIAL[1:])
+    processor = transformers.Qwen2AudioProcessor(
+        feature_extractor=transformers.WhisperFeatureExtractor(feature_size=16), tokenizer=tokenizer)
+    config = transformers.Qwen2AudioConfig(
+        audio_config=dict(num_mel_bins=16, encoder_layers=1, encoder_attention_heads=2, encoder_ffn_dim=32,
+                          d_model=16),
+        text_config=dict(model_type='qwen2', vocab_size=len(vocab), hidden_size=32, intermediate_size=64,
+                         num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=2,
+                         max_position_embeddings=4096, initializer_range=0.5),
+        audio_token_index=vocab['<|AUDIO|>'])
+    torch.manual_seed(seed)
+    model = Qwen2Audio.__new__(Qwen2Audio)
+    model.model_path = None
+    model.processor = _Processor(processor)
+    model.model = transformers.Qwen2AudioForConditionalGeneration(config).eval()
+    if not hasattr(model.model, 'audio_tower'):
+        # newer transformers keep the encoder on the inner model, the wrappers look it up on the outer one
+        model.model.audio_tower = model.model.model.audio_tower
+    model.generation_config = dict(max_new_tokens=8, min_new_tokens=1, do_sample=False, top_k=None, top_p=None)
+    return model
+
+
+def tiny_msg(k: int, text: str, seconds: float, audio_seed: int = None) -> dict:
+    """A sample with its waveform already decoded, as preprocess leaves it"""
+    waveform = np.random.RandomState(k if audio_seed is None else audio_seed).randn(int(seconds * SAMPLING_RATE))
+    return {
+        'index': str(k),
+        'text': text,
+        'audio': [f'clip_{k}.wav'],
+        'audio_data': [(0.1 * waveform).astype('float32')],
+        'meta': {'task': 'MQA', 'type': 'existence', 'interactive': 'Audio-analysis', 'audio_type': 'AudioEvent'},
+    }